@@ -1,8 +1,33 @@
 import streamlit as st
 import pandas as pd
+import numpy as np
 import mysql.connector
-from mysql.connector import Error
-from langchain_groq import ChatGroq
+from mysql.connector import Error, pooling
+import asyncio
+import atexit
+import gzip
+import hashlib
+import json
+import os
+import re
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeout
+from contextlib import contextmanager
+from datetime import datetime, date, timedelta
+from decimal import Decimal
+from functools import lru_cache, wraps
+from types import SimpleNamespace
+import random
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
+import uuid
+
+# Feature-specific dependencies (pymongo, langchain_groq, scipy, ...) are imported
+# inside the functions that use them, so a cold start only pays for the pages opened.
+COLD_START_BUDGET_MS = 1500
 
 # llm = ChatGroq(
 #     temperature=0,
@@ -14,418 +39,4948 @@ from langchain_groq import ChatGroq
 # response=llm.invoke("how to store data in .dat file python")
 # print(response.content)
 
+DATABASE_CONFIG = {
+    "host": "localhost",
+    "user": "root",
+    "password": "password",
+    "database": "inventory_db",
+}
+
+# Storage backend: "mysql" (default) or "sqlite" for single-process edge sites and
+# tests. The SQLite backend runs the same schema (SQLITE_SCHEMA) in WAL mode behind a
+# small mysql.connector-compatible wrapper that rewrites the MySQL dialect used here.
+# Archived orders go to MongoDB or, with INVENTORY_ARCHIVE=file, to JSON-lines files.
+STORAGE_BACKEND = os.environ.get("INVENTORY_BACKEND", "mysql")
+SQLITE_PATH = os.environ.get("INVENTORY_SQLITE_PATH", "inventory.db")
+SQLITE_PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",  # WAL keeps commits atomic; a power cut can only lose the newest ones
+    "busy_timeout": 5000,
+    "cache_size": -65536,  # 64 MiB
+    "temp_store": "MEMORY",
+    "mmap_size": 268435456,
+}
+ARCHIVE_BACKEND = os.environ.get("INVENTORY_ARCHIVE", "file" if STORAGE_BACKEND == "sqlite" else "mongodb")
+ARCHIVE_DIR = os.environ.get("INVENTORY_ARCHIVE_DIR", "archive")
+# Edge sites push their CDC_TABLES rows to this MySQL server with the upstream_sync job
+UPSTREAM_CONFIG = json.loads(os.environ.get("INVENTORY_UPSTREAM", "null"))
+SYNC_BATCH_SIZE = 1000
+
+# Read replicas as "host:port,host:port"; reads go to the least-lagged healthy replica
+REPLICA_CONFIGS = [
+    dict(DATABASE_CONFIG, host=address.split(":")[0], port=int(address.split(":")[1]) if ":" in address else 3306)
+    for address in os.environ.get("INVENTORY_DB_REPLICAS", "").split(",")
+    if address.strip() and STORAGE_BACKEND == "mysql"
+]
+MAX_REPLICA_LAG = 5  # seconds behind the primary before a replica stops taking reads
+REPLICA_LAG_CHECK_INTERVAL = 5  # seconds
+READ_YOUR_WRITES_WINDOW = 10  # seconds a session reads from the primary after it commits
+# Pooled primary connections are not reset between script runs, so their server-side
+# prepared statements stay valid; see run_statement()
+DATABASE_POOL_SIZE = int(os.environ.get("INVENTORY_DB_POOL_SIZE", "16"))
+DATABASE_POOL_WAIT = 5  # seconds to wait for a free pooled connection
+
+
+@st.cache_resource
+def replica_health():
+    # "host:port" -> (checked_at, lag seconds or None when replication is broken or unreachable)
+    return {}
+
+
+def replica_lag(connection):
+    cursor = connection.cursor(dictionary=True)
+    try:
+        cursor.execute("SHOW REPLICA STATUS")
+    except Error:
+        cursor.execute("SHOW SLAVE STATUS")  # MariaDB and MySQL before 8.0.22
+    status = cursor.fetchone()
+    if status is None:
+        return None
+    lag = status.get("Seconds_Behind_Source", status.get("Seconds_Behind_Master"))
+    return None if lag is None else int(lag)
+
+
+class ConnectionRouter:
+    # Wraps the primary connection: writes, transactions and cursors go to the primary,
+    # while fetch_table_data() reads through reader().
+    def __init__(self, primary, replica_configs):
+        self.primary = primary
+        self.replica_configs = replica_configs
+        self.replicas = {}
+        self.closed = False
+
+    def __getattr__(self, name):
+        return getattr(self.primary, name)
+
+    def commit(self):
+        self.primary.commit()
+        st.session_state["read_primary_until"] = time.time() + READ_YOUR_WRITES_WINDOW
+
+    def replica(self, config):
+        name = f"{config['host']}:{config['port']}"
+        if name not in self.replicas:
+            self.replicas[name] = mysql.connector.connect(**config)
+        return name, self.replicas[name]
+
+    def reader(self):
+        if not self.replica_configs or time.time() < st.session_state.get("read_primary_until", 0):
+            return self.primary
+
+        health = replica_health()
+        candidates = []
+        for config in self.replica_configs:
+            name = f"{config['host']}:{config['port']}"
+            checked_at, lag = health.get(name, (0, None))
+            if time.time() - checked_at > REPLICA_LAG_CHECK_INTERVAL:
+                try:
+                    lag = replica_lag(self.replica(config)[1])
+                except Error:
+                    self.replicas.pop(name, None)
+                    lag = None
+                health[name] = (time.time(), lag)
+            if lag is not None and lag <= MAX_REPLICA_LAG:
+                candidates.append((lag, random.random(), config))
+
+        if not candidates:
+            return self.primary
+        try:
+            return self.replica(min(candidates, key=lambda candidate: candidate[:2])[2])[1]
+        except Error:
+            return self.primary
+
+    def close(self):
+        if self.__dict__.get("closed", True):
+            return
+        self.closed = True
+        for replica in self.replicas.values():
+            replica.close()
+        try:
+            # Pooled sessions are not reset, so never hand an open transaction back
+            self.primary.rollback()
+        except Error:
+            pass
+        self.primary.close()
+
+    def __del__(self):
+        # A script run that stops early (st.rerun, an exception) still returns its connection
+        self.close()
+
+
+def read_connection(connection):
+    return connection.reader() if isinstance(connection, ConnectionRouter) else connection
+
+
+@st.cache_resource
+def database_pool():
+    return pooling.MySQLConnectionPool(
+        pool_name="inventory", pool_size=DATABASE_POOL_SIZE, pool_reset_session=False, **DATABASE_CONFIG
+    )
+
+
+def pooled_connection():
+    if STORAGE_BACKEND == "sqlite":
+        return open_connection()  # opening a SQLite file is cheaper than pooling it
+    deadline = time.time() + DATABASE_POOL_WAIT
+    while True:
+        try:
+            return database_pool().get_connection()
+        except pooling.errors.PoolError:
+            if time.time() > deadline:
+                raise
+            time.sleep(0.05)
+
+
 def connect_to_database():
     try:
-        connection = mysql.connector.connect(
-            host="localhost",
-            user="root",
-            password="password",
-            database="inventory_db"
-        )
-        return connection
+        connection = pooled_connection()
+        return ConnectionRouter(connection, REPLICA_CONFIGS)
     except Error as e:
         st.error(f"Error connecting to MySQL: {e}")
         return None
-from pymongo import MongoClient
+
+
+def open_connection(autocommit=False):
+    # A standalone connection for background threads and jobs, on the configured backend
+    if STORAGE_BACKEND == "sqlite":
+        return SQLiteConnection(SQLITE_PATH, autocommit)
+    return mysql.connector.connect(**DATABASE_CONFIG, autocommit=autocommit)
+
+
+def sqlite_interval(match):
+    base, sign, amount, unit = match.groups()
+    modifier = f"'{sign}' || {amount} || ' {unit.lower()}s'"
+    if base.startswith("NOW"):
+        return f"strftime('%Y-%m-%d %H:%M:%f', 'now', 'localtime', {modifier})"
+    if base.startswith("CURDATE"):
+        return f"date('now', 'localtime', {modifier})"
+    return f"strftime('%Y-%m-%d %H:%M:%f', {base}, {modifier})"
+
+
+def sqlite_update_join(match):
+    # UPDATE t JOIN (...) AS a ON ... SET t.x = ...  ->  UPDATE t SET x = ... FROM (...) AS a WHERE ...
+    table, source, alias, condition, assignments = match.groups()
+    assignments = re.sub(rf"\b{table}\.(\w+)\s*=", r"\1 =", assignments)
+    return f"UPDATE {table} SET {assignments} FROM {source} AS {alias} WHERE {condition}"
+
+
+# Applied in order; placeholders first so later patterns can match "?"
+SQLITE_REWRITES = [
+    (r"%s", "?"),
+    (r"\bINSERT IGNORE\b", "INSERT OR IGNORE"),
+    (r"\bON DUPLICATE KEY UPDATE\b", "ON CONFLICT DO UPDATE SET"),
+    (r"\bVALUES\((\w+)\)", r"excluded.\1"),
+    (r"\s+(FOR UPDATE|FOR SHARE|LOCK IN SHARE MODE)\b", ""),
+    (r"(?s)UPDATE\s+(\w+)\s+JOIN\s+(\(.*\))\s+AS\s+(\w+)\s+ON\s+(.*?)\s+SET\s+(.*)", sqlite_update_join),
+    (r"(NOW\(\d?\)|CURDATE\(\)|\?|[\w.`]+)\s*([-+])\s*INTERVAL\s+(\?|\d+)\s+(SECOND|MINUTE|HOUR|DAY|MONTH)\b", sqlite_interval),
+    (r"\bNOW\(\d?\)", "strftime('%Y-%m-%d %H:%M:%f', 'now', 'localtime')"),
+    (r"\bCURDATE\(\)", "date('now', 'localtime')"),
+]
+
+
+@lru_cache(maxsize=1024)
+def to_sqlite_sql(query):
+    for pattern, replacement in SQLITE_REWRITES:
+        query = re.sub(pattern, replacement, query)
+    return query
+
+
+def sqlite_datediff(end, start):
+    if end is None or start is None:
+        return None
+    return (date.fromisoformat(str(end)[:10]) - date.fromisoformat(str(start)[:10])).days
+
+
+def sqlite_greatest(*values):
+    return None if None in values else max(values)
+
+
+def sqlite_timestamp(value):
+    # Millisecond precision everywhere, so stored and bound timestamps compare as text
+    return value.strftime("%Y-%m-%d %H:%M:%S.%f")[:-3]
+
+
+@contextmanager
+def sqlite_errors():
+    # Surface SQLite failures as the mysql.connector errors (and errnos) callers handle
+    try:
+        yield
+    except sqlite3.IntegrityError as e:
+        errno = 1062 if "UNIQUE" in str(e) else 1048 if "NOT NULL" in str(e) else 1452
+        raise mysql.connector.errors.IntegrityError(msg=str(e), errno=errno) from e
+    except sqlite3.OperationalError as e:
+        if "locked" in str(e) or "busy" in str(e):
+            raise mysql.connector.errors.DatabaseError(msg=str(e), errno=1205) from e
+        if "interrupted" in str(e):
+            raise mysql.connector.errors.DatabaseError(msg=str(e), errno=1317) from e
+        raise mysql.connector.errors.ProgrammingError(msg=str(e), errno=1064) from e
+    except sqlite3.Error as e:
+        raise mysql.connector.errors.DatabaseError(msg=str(e)) from e
+
+
+class SQLiteCursor:
+    def __init__(self, connection, dictionary=False):
+        self.connection = connection
+        self.dictionary = dictionary
+        self.cursor = connection.raw.cursor()
+
+    def execute(self, query, params=None):
+        with sqlite_errors():
+            self.connection.begin()
+            self.cursor.execute(to_sqlite_sql(query), tuple(params or ()))
+
+    def executemany(self, query, seq_params):
+        with sqlite_errors():
+            self.connection.begin()
+            self.cursor.executemany(to_sqlite_sql(query), [tuple(params) for params in seq_params])
+
+    @property
+    def column_names(self):
+        return tuple(column[0] for column in self.cursor.description or ())
+
+    @property
+    def lastrowid(self):
+        return self.cursor.lastrowid
+
+    @property
+    def rowcount(self):
+        return self.cursor.rowcount
+
+    def rows(self, rows):
+        if not self.dictionary:
+            return rows
+        names = self.column_names
+        return [dict(zip(names, row)) for row in rows]
+
+    def fetchone(self):
+        row = self.cursor.fetchone()
+        return None if row is None else self.rows([row])[0]
+
+    def fetchmany(self, size=1):
+        return self.rows(self.cursor.fetchmany(size))
+
+    def fetchall(self):
+        return self.rows(self.cursor.fetchall())
+
+    def close(self):
+        self.cursor.close()
+
+
+class SQLiteConnection:
+    # Enough of the mysql.connector connection API for this dashboard: implicit
+    # transactions (a BEGIN before the first statement after commit/rollback), cursors
+    # with dictionary rows, reconnect() and is_connected()
+    def __init__(self, path, autocommit=False):
+        self.path = path
+        self.autocommit = autocommit
+        self.raw = None
+        self.reconnect()
+
+    def reconnect(self, attempts=1, delay=0):
+        sqlite3.register_adapter(datetime, sqlite_timestamp)
+        sqlite3.register_adapter(date, date.isoformat)
+        sqlite3.register_adapter(Decimal, float)
+        sqlite3.register_adapter(np.int64, int)
+        sqlite3.register_adapter(np.int32, int)
+        sqlite3.register_adapter(np.float64, float)
+        sqlite3.register_converter("DATE", lambda value: date.fromisoformat(value.decode()))
+        for name in ("DATETIME", "TIMESTAMP"):
+            sqlite3.register_converter(name, lambda value: datetime.fromisoformat(value.decode()))
+
+        self.raw = sqlite3.connect(
+            self.path,
+            isolation_level=None,  # transactions are opened explicitly by begin()
+            detect_types=sqlite3.PARSE_DECLTYPES,
+            check_same_thread=False,
+            cached_statements=256,
+        )
+        for pragma, value in SQLITE_PRAGMAS.items():
+            self.raw.execute(f"PRAGMA {pragma} = {value}")
+        self.raw.create_function("DATEDIFF", 2, sqlite_datediff, deterministic=True)
+        self.raw.create_function("GREATEST", -1, sqlite_greatest, deterministic=True)
+
+    def begin(self):
+        if not self.autocommit and not self.raw.in_transaction:
+            self.raw.execute("BEGIN")
+
+    def cursor(self, dictionary=False, prepared=False):
+        # SQLite caches compiled statements per connection, so prepared cursors need nothing extra
+        return SQLiteCursor(self, dictionary)
+
+    def commit(self):
+        with sqlite_errors():
+            if self.raw.in_transaction:
+                self.raw.execute("COMMIT")
+
+    def rollback(self):
+        with sqlite_errors():
+            if self.raw.in_transaction:
+                self.raw.execute("ROLLBACK")
+
+    def is_connected(self):
+        return self.raw is not None
+
+    def close(self):
+        if self.raw is not None:
+            self.raw.close()
+            self.raw = None
+
+
+class FileArchiveCollection:
+    def __init__(self, path, lock):
+        self.path = path
+        self.lock = lock
+
+    def insert_one(self, document):
+        with self.lock, open(self.path, "a", encoding="utf-8") as archive:
+            archive.write(json.dumps(document, default=str) + "\n")
+            archive.flush()
+            os.fsync(archive.fileno())
+
+    def replace_one(self, filter, document, upsert=False):
+        # Appends the new version; find() keeps only the last document per _id
+        self.insert_one(dict(document, _id=filter["_id"]))
+
+    def find(self):
+        if not os.path.exists(self.path):
+            return []
+        with self.lock, open(self.path, encoding="utf-8") as archive:
+            documents = [json.loads(line) for line in archive if line.strip()]
+        latest = {document.get("_id", index): document for index, document in enumerate(documents)}
+        return list(latest.values())
+
+
+class FileArchiveStore:
+    # Stand-in for the Mongo database: each collection is an append-only JSON-lines file
+    def __init__(self, directory):
+        self.directory = directory
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def __getitem__(self, collection):
+        return FileArchiveCollection(os.path.join(self.directory, f"{collection}.jsonl"), self.lock)
+
+
+@st.cache_resource
+def file_archive():
+    return FileArchiveStore(ARCHIVE_DIR)
+
+
+def archive_database():
+    if ARCHIVE_BACKEND == "file":
+        return file_archive()
+    return mongo_client()["inventory_db"]
+
+
+def connect_to_archive():
+    if ARCHIVE_BACKEND == "file":
+        return file_archive()
+    return connect_to_mongodb()
+
+
+@st.cache_resource
+def mongo_client():
+    from pymongo import MongoClient
+
+    return MongoClient("")
+
 
 def connect_to_mongodb():
     try:
-        client = MongoClient("")
+        client = mongo_client()
         db = client["inventory_db"] 
         return db
     except Exception as e:
         st.error(f"Error connecting to MongoDB: {e}")
         return None
 
-def fetch_table_data(connection, query):
+# Query governor: fetch_table_data() classifies each query as a lookup or an
+# analytical scan (aggregates, GROUP BY, DISTINCT or no WHERE clause). Each class has
+# its own number of concurrent slots, a bounded wait queue and a time limit, sent to
+# MySQL as a MAX_EXECUTION_TIME hint and enforced here as well. The query runs on a
+# worker thread while the page thread polls it; every poll touches the page, which is
+# where Streamlit stops a run whose user has moved on, and the query is then killed.
+QUERY_CLASSES = {
+    "lookup": {"slots": 16, "queue": 64, "wait": 10, "timeout": 10},
+    "analytical": {"slots": int(os.environ.get("INVENTORY_ANALYTICAL_SLOTS", "2")), "queue": 4, "wait": 30, "timeout": 60},
+}
+QUERY_POLL_INTERVAL = 0.25  # seconds
+QUERY_STATUS_AFTER = 1  # seconds before a waiting or running query shows its status
+QUERY_CANCEL_WAIT = 2  # seconds to let a killed query unwind before its connection is reused
+QUERY_TIMEOUT_ERRNOS = (3024, 1317)  # ER_QUERY_TIMEOUT, ER_QUERY_INTERRUPTED
+ANALYTICAL_QUERY_PATTERN = re.compile(r"\b(GROUP\s+BY|DISTINCT|COUNT|SUM|AVG|MIN|MAX)\b", re.IGNORECASE)
+
+
+class QueryRejected(Exception):
+    pass
+
+
+def classify_query(query):
+    if ANALYTICAL_QUERY_PATTERN.search(query) or not re.search(r"\bWHERE\b", query, re.IGNORECASE):
+        return "analytical"
+    return "lookup"
+
+
+def with_time_limit(query, seconds):
+    if STORAGE_BACKEND == "sqlite":
+        return query
+    return re.sub(r"^\s*SELECT\b", f"SELECT /*+ MAX_EXECUTION_TIME({int(seconds * 1000)}) */", query, count=1, flags=re.IGNORECASE)
+
+
+class QueryGovernor:
+    def __init__(self, classes=QUERY_CLASSES):
+        self.classes = classes
+        self.lock = threading.Lock()
+        self.slots = {name: threading.Semaphore(settings["slots"]) for name, settings in classes.items()}
+        self.stats = {
+            name: {"Running": 0, "Queued": 0, "Admitted": 0, "Rejected": 0, "TimedOut": 0, "Cancelled": 0}
+            for name in classes
+        }
+        self.executor = ThreadPoolExecutor(
+            max_workers=sum(settings["slots"] for settings in classes.values()), thread_name_prefix="query"
+        )
+
+    def count(self, query_class, field, delta=1):
+        with self.lock:
+            self.stats[query_class][field] += delta
+
+    @contextmanager
+    def admit(self, query_class, on_wait):
+        settings = self.classes[query_class]
+        with self.lock:
+            stats = self.stats[query_class]
+            if stats["Queued"] >= settings["queue"]:
+                stats["Rejected"] += 1
+                raise QueryRejected(f"{stats['Running']} {query_class} queries are running and {stats['Queued']} are waiting.")
+            stats["Queued"] += 1
+        started = time.time()
+        try:
+            while not self.slots[query_class].acquire(timeout=QUERY_POLL_INTERVAL):
+                waited = time.time() - started
+                if waited > settings["wait"]:
+                    self.count(query_class, "Rejected")
+                    raise QueryRejected(f"No {query_class} query slot came free within {settings['wait']} s.")
+                on_wait(waited)
+        finally:
+            self.count(query_class, "Queued", -1)
+        with self.lock:
+            self.stats[query_class]["Running"] += 1
+            self.stats[query_class]["Admitted"] += 1
+        try:
+            yield settings
+        finally:
+            self.count(query_class, "Running", -1)
+            self.slots[query_class].release()
+
+    def report(self):
+        with self.lock:
+            report = pd.DataFrame.from_dict(self.stats, orient="index")
+        for field in ("slots", "queue", "timeout"):
+            report[field.title()] = [self.classes[name][field] for name in report.index]
+        return report.rename_axis("Class").reset_index()
+
+
+@st.cache_resource
+def query_governor():
+    return QueryGovernor()
+
+
+def kill_query(reader):
+    raw = getattr(reader, "_cnx", None) or reader  # unwrap pooled connections
+    if isinstance(raw, SQLiteConnection):
+        raw.raw.interrupt()
+        return
     try:
-        cursor = connection.cursor(dictionary=True)
-        cursor.execute(query)
-        rows = cursor.fetchall()
-        return pd.DataFrame(rows)
-    except Error as e:
-        st.error(f"Error fetching data: {e}")
-        return pd.DataFrame()
+        killer = mysql.connector.connect(**dict(DATABASE_CONFIG, host=raw.server_host, port=raw.server_port))
+        try:
+            killer.cmd_query(f"KILL QUERY {int(raw.connection_id)}")
+        finally:
+            killer.close()
+    except Error:
+        pass  # the query still ends at its MAX_EXECUTION_TIME
+
+
+def governed_fetch(connection, query, params=None, query_class=None):
+    governor = query_governor()
+    query_class = query_class or classify_query(query)
+    status = None
+
+    def show(message):
+        nonlocal status
+        if status is None:
+            status = st.empty()
+        status.caption(message)
+
+    def wait_status(waited):
+        if waited >= QUERY_STATUS_AFTER:
+            stats = governor.stats[query_class]
+            show(f"Waiting for a {query_class} query slot: {stats['Running']} running, {stats['Queued']} queued ({waited:.0f} s)")
+
+    try:
+        with governor.admit(query_class, wait_status) as settings:
+            reader = read_connection(connection)
+
+            def run():
+                cursor = reader.cursor(dictionary=True)
+                cursor.execute(with_time_limit(query, settings["timeout"]), params)
+                return cursor.fetchall()
+
+            future = governor.executor.submit(run)
+            started = time.time()
+            killed = False
+            try:
+                while True:
+                    try:
+                        return pd.DataFrame(future.result(timeout=QUERY_POLL_INTERVAL))
+                    except FutureTimeout:
+                        elapsed = time.time() - started
+                        if elapsed > settings["timeout"] and not killed:
+                            killed = True
+                            kill_query(reader)
+                        elif elapsed >= QUERY_STATUS_AFTER:
+                            show(f"Running {query_class} query ({elapsed:.0f} s of {settings['timeout']} s)")
+            except Error as e:
+                if e.errno in QUERY_TIMEOUT_ERRNOS:
+                    governor.count(query_class, "TimedOut")
+                raise
+            except BaseException:
+                # Streamlit stopped this run (the user navigated away): kill the query before
+                # its connection is closed or reused
+                if not future.done():
+                    governor.count(query_class, "Cancelled")
+                    kill_query(reader)
+                    try:
+                        future.exception(timeout=QUERY_CANCEL_WAIT)
+                    except FutureTimeout:
+                        pass
+                raise
+    finally:
+        if status is not None:
+            status.empty()
+
+
+# Compact frames: fetch_table_data() converts each result column by name before the
+# frame reaches a page or a shared cache. Product, location, supplier and category
+# names become categoricals over one process-wide dictionary per column, so the
+# frames of every session share the strings and hold only integer codes. Short
+# vocabularies such as Status get categoricals of their own, other text is
+# Arrow-backed, Decimals become float64, and ids and quantities int32 when they have
+# no gaps. Bytes before and after are kept per page for Diagnostics.
+SHARED_NAME_COLUMNS = ("ProductName", "LocationName", "SupplierName", "CategoryName")
+COLUMN_DTYPES = {
+    **{column: "shared" for column in SHARED_NAME_COLUMNS},
+    **{column: "category" for column in ("Status", "MovementType", "AlertType", "SourceTable")},
+    **{column: "float64" for column in ("Price", "SaleAmount")},
+    **{
+        column: "int32"
+        for column in ("ProductID", "LocationID", "SupplierID", "CategoryID", "CustomerID", "OrderID", "OrderItemID", "Quantity")
+    },
+}
+INT32_RANGE = (np.iinfo(np.int32).min, np.iinfo(np.int32).max)
+
+try:
+    TEXT_DTYPE = pd.StringDtype("pyarrow", na_value=np.nan)  # missing text stays NaN, as in object columns
+except (ImportError, TypeError):
+    TEXT_DTYPE = None  # no pyarrow, or a pandas without NaN-backed strings: keep Python strings
+
+page_scope = threading.local()  # the page or fragment now running on this thread, and its user
+
+
+class NameDictionary:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.dtypes = {}
+
+    def encode(self, column_name, values):
+        names = pd.Index(values.dropna().unique())
+        with self.lock:
+            dtype = self.dtypes.get(column_name)
+            if dtype is None or not names.isin(dtype.categories).all():
+                # Frames already built keep the dictionary they were encoded with
+                known = dtype.categories if dtype is not None else pd.Index([], dtype=object)
+                dtype = self.dtypes[column_name] = pd.CategoricalDtype(known.union(names))
+        return values.astype(dtype)
+
+    def report(self):
+        with self.lock:
+            dtypes = dict(self.dtypes)
+        return pd.DataFrame(
+            [
+                {"Column": name, "Names": len(dtype.categories), "Bytes": int(dtype.categories.memory_usage(deep=True))}
+                for name, dtype in sorted(dtypes.items())
+            ],
+            columns=["Column", "Names", "Bytes"],
+        )
+
+
+@st.cache_resource
+def name_dictionary():
+    return NameDictionary()
+
+
+@st.cache_resource
+def frame_memory():
+    return {"lock": threading.Lock(), "scopes": {}}
+
+
+def compact_column(name, column):
+    kind = COLUMN_DTYPES.get(name)
+    if kind is None and column.dtype == object:
+        non_null = column.dropna()
+        if not non_null.empty and isinstance(non_null.iloc[0], Decimal):
+            kind = "float64"
+        elif not non_null.empty and isinstance(non_null.iloc[0], str):
+            kind = "text"
+    if kind == "shared":
+        return name_dictionary().encode(name, column)
+    if kind == "category":
+        return column.astype("category")
+    if kind == "float64":
+        return column.astype("float64")  # float() per Decimal, None to NaN
+    if kind == "int32":
+        if pd.api.types.is_integer_dtype(column) and column.between(*INT32_RANGE).all():
+            return column.astype("int32")
+        return column  # gaps (NaN) or out of range: leave as fetched
+    if kind == "text" and TEXT_DTYPE is not None:
+        return column.astype(TEXT_DTYPE)
+    return column
+
+
+def frame_bytes(frame):
+    usage = frame.memory_usage(deep=True)
+    for column in SHARED_NAME_COLUMNS:
+        # The shared dictionary is counted once, not per frame
+        if column in frame.columns and isinstance(frame[column].dtype, pd.CategoricalDtype):
+            usage[column] = frame[column].cat.codes.nbytes
+    return int(usage.sum())
+
+
+def compact_frame(frame):
+    if frame.empty:
+        return frame
+    before = int(frame.memory_usage(deep=True).sum())
+    for column in frame.columns:
+        frame[column] = compact_column(column, frame[column])
+    after = frame_bytes(frame)
+
+    memory = frame_memory()
+    scope = getattr(page_scope, "name", "Background")
+    with memory["lock"]:
+        stats = memory["scopes"].setdefault(scope, {"Frames": 0, "Rows": 0, "BytesBefore": 0, "BytesAfter": 0})
+        stats["Frames"] += 1
+        stats["Rows"] += len(frame)
+        stats["BytesBefore"] += before
+        stats["BytesAfter"] += after
+    return frame
+
+
+def frame_memory_report():
+    memory = frame_memory()
+    with memory["lock"]:
+        report = pd.DataFrame.from_dict(memory["scopes"], orient="index")
+    if report.empty:
+        return report
+    report["SavedPct"] = (100 * (1 - report["BytesAfter"] / report["BytesBefore"])).round(1)
+    return report.rename_axis("Scope").reset_index().sort_values("BytesBefore", ascending=False)
+
+
+def fetch_failed(error):
+    # Reports a failed fetch on the page and stands in an empty frame for its result
+    if isinstance(error, QueryRejected):
+        st.warning(f"The database is busy, please try again shortly. {error}")
+    elif error.errno in QUERY_TIMEOUT_ERRNOS:
+        st.error("The query ran past its time limit and was stopped. Try a narrower period or filter.")
+    else:
+        st.error(f"Error fetching data: {error}")
+    return pd.DataFrame()
+
+
+def fetch_table_data(connection, query, params=None, query_class=None):
+    try:
+        return compact_frame(governed_fetch(connection, query, params, query_class))
+    except (QueryRejected, Error) as e:
+        return fetch_failed(e)
+
+# Named statements prepared server-side once per physical connection and reused by
+# later calls. The first call of a name registers its SQL; timings for first calls
+# (prepare + execute) and reused calls (execute only) are kept per name.
+UNKNOWN_STATEMENT_ERRNO = 1243  # ER_UNKNOWN_STMT_HANDLER, e.g. after a reconnect
+
+
+@st.cache_resource
+def statement_registry():
+    # Keeps one string object per name: prepared cursors skip re-preparing only when
+    # they are handed the identical object they prepared last time
+    return {"lock": threading.Lock(), "sql": {}, "stats": {}}
+
+
+def physical_connection(connection):
+    connection = read_connection(connection)
+    return getattr(connection, "_cnx", None) or connection  # unwrap pooled connections
+
+
+def run_statement(connection, name, sql, params=()):
+    registry = statement_registry()
+    with registry["lock"]:
+        if registry["sql"].get(name) != sql:
+            registry["sql"][name] = sql
+        sql = registry["sql"][name]
+
+    raw = physical_connection(connection)
+    cursors = getattr(raw, "prepared_statements", None)
+    if cursors is None:
+        cursors = raw.prepared_statements = {}
+
+    for attempt in range(2):
+        cursor = cursors.get(name)
+        first = cursor is None
+        if first:
+            cursor = cursors[name] = raw.cursor(prepared=True)
+        started = time.perf_counter()
+        try:
+            cursor.execute(sql, tuple(params))
+            rows = cursor.fetchall()
+            break
+        except Error as e:
+            cursors.pop(name, None)
+            if e.errno != UNKNOWN_STATEMENT_ERRNO or attempt:
+                raise
+    elapsed_ms = (time.perf_counter() - started) * 1000
+
+    with registry["lock"]:
+        stats = registry["stats"].setdefault(name, {"Prepares": 0, "PrepareMs": 0.0, "Executions": 0, "ExecuteMs": 0.0})
+        if first:
+            stats["Prepares"] += 1
+            stats["PrepareMs"] += elapsed_ms
+        else:
+            stats["Executions"] += 1
+            stats["ExecuteMs"] += elapsed_ms
+    return pd.DataFrame(rows, columns=cursor.column_names)
+
+
+def statement_report():
+    registry = statement_registry()
+    with registry["lock"]:
+        report = pd.DataFrame.from_dict(registry["stats"], orient="index")
+    if report.empty:
+        return report
+    report["FirstCallMs"] = report["PrepareMs"] / report["Prepares"].where(report["Prepares"] > 0)
+    report["ReuseMs"] = report["ExecuteMs"] / report["Executions"].where(report["Executions"] > 0)
+    # A first call pays prepare and execute; a reused one only execute
+    report["PrepareCostMs"] = (report["FirstCallMs"] - report["ReuseMs"]).clip(lower=0)
+    return report.rename_axis("Statement").reset_index()
+
+
+def benchmark_statement_cache(connection, order_id, repeats=200):
+    sql = """
+        SELECT OrderID, SupplierID, OrderDate, Status, Version
+        FROM `Order`
+        WHERE OrderID = %s
+    """
+    cursor = read_connection(connection).cursor()
+    started = time.perf_counter()
+    for _ in range(repeats):
+        cursor.execute(sql, (order_id,))  # parameters interpolated client-side, parsed by the server every time
+        cursor.fetchall()
+    text_ms = (time.perf_counter() - started) * 1000
+
+    started = time.perf_counter()
+    for _ in range(repeats):
+        run_statement(connection, "order_by_id", sql, (order_id,))
+    prepared_ms = (time.perf_counter() - started) * 1000
+    return text_ms, prepared_ms
+
 
 def execute_query(connection, query, params=None):
     try:
-        cursor = connection.cursor()
-        cursor.execute(query, params)
-        connection.commit()
+        run_in_transaction(connection, lambda cursor: cursor.execute(query, params))
         return True
     except Error as e:
         st.error(f"Error executing query: {e}")
         return False
 
-def add_order(connection):
-    st.header("Add Order")
+# MySQL error codes that mean "try the whole transaction again"
+DEADLOCK_ERRNOS = (
+    1213,  # ER_LOCK_DEADLOCK
+    1205,  # ER_LOCK_WAIT_TIMEOUT
+)
+# Client-side codes for a dropped connection; the transaction is retried on a fresh one
+CONNECTION_LOST_ERRNOS = (
+    2006,  # CR_SERVER_GONE_ERROR
+    2013,  # CR_SERVER_LOST
+    2055,  # CR_SERVER_LOST_EXTENDED
+)
+TRANSIENT_ERRNOS = DEADLOCK_ERRNOS + CONNECTION_LOST_ERRNOS
+TRANSACTION_RETRIES = 5
+IDEMPOTENCY_KEY_TTL_DAYS = 7
+IDEMPOTENCY_PURGE_INTERVAL = 3600  # seconds between purges of expired keys per server process
+WRITE_QUEUE_INTERVAL = 0.5  # seconds between write queue flushes
+WRITE_QUEUE_TIMEOUT = 5  # seconds a page waits for its queued write before reporting it as pending
 
-    # Input fields for Order
-    supplier_id = st.number_input("Supplier ID", min_value=1, step=1)
-    order_date = st.date_input("Order Date")
-    status = st.selectbox("Order Status", ["Pending", "Shipped", "Delivered"])
 
-    # Input fields for Order Items
-    st.subheader("Order Items")
-    product_id = st.number_input("Product ID", min_value=1, step=1)
-    quantity = st.number_input("Quantity", min_value=1, step=1)
-    price = st.number_input("Price per Unit", min_value=0.0, step=0.01)
+class ConcurrencyConflict(Exception):
+    pass
 
-    if st.button("Add Order"):
-        try:
-            # Start a transaction
-            cursor = connection.cursor()
 
-            # Insert into Order table
-            query_order = """
-                INSERT INTO `Order` (SupplierID, OrderDate, Status)
-                VALUES (%s, %s, %s)
-            """
-            cursor.execute(query_order, (supplier_id, order_date, status))
-            order_id = cursor.lastrowid  # Get the last inserted OrderID
+class IdempotencyConflict(Exception):
+    pass
 
-            # Insert into OrderItem table
-            query_order_item = """
-                INSERT INTO OrderItem (OrderID, ProductID, Quantity, Price)
-                VALUES (%s, %s, %s, %s)
-            """
-            cursor.execute(query_order_item, (order_id, product_id, quantity, price))
 
-            # Update inventory
-            query_update_inventory = """
-                UPDATE Inventory
-                SET Quantity = Quantity - %s
-                WHERE ProductID = %s
-            """
-            cursor.execute(query_update_inventory, (quantity, product_id))
+class InsufficientStock(Exception):
+    pass
 
-            # Commit the transaction
-            connection.commit()
-            st.success(f"Order {order_id} added successfully and inventory updated!")
-        except Error as e:
-            # Rollback in case of an error
-            connection.rollback()
-            st.error(f"Error adding order or updating inventory: {e}")
 
-from bson import Decimal128
-from datetime import datetime, date
-from decimal import Decimal  
+def ensure_column(connection, table, column, definition):
+    cursor = connection.cursor()
+    cursor.execute(
+        """
+            SELECT COUNT(*)
+            FROM INFORMATION_SCHEMA.COLUMNS
+            WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND COLUMN_NAME = %s
+        """,
+        (table, column),
+    )
+    if cursor.fetchone()[0] == 0:
+        cursor.execute(f"ALTER TABLE `{table}` ADD COLUMN `{column}` {definition}")
+        connection.commit()
 
 
-def delete_order(connection, mongodb):
-    st.header("Delete Order")
+def setup_concurrency_control(connection):
+    # Every conditional update bumps Version, so a stale copy can never overwrite a newer row
+    for table in ("Order", "OrderItem", "Inventory"):
+        ensure_column(connection, table, "Version", "INT NOT NULL DEFAULT 0")
 
-    # Input field for Order ID
-    order_id = st.number_input("Enter Order ID to Delete", min_value=1, step=1)
 
-    if st.button("Delete Order"):
-        try:
-            # Fetch order details before deletion
-            query_order = "SELECT * FROM `Order` WHERE OrderID = %s"
-            order_data = fetch_table_data(connection, query_order % order_id)
-
-            if not order_data.empty:
-                # Fetch associated order items
-                query_order_items = "SELECT * FROM `OrderItem` WHERE OrderID = %s"
-                order_items_data = fetch_table_data(connection, query_order_items % order_id)
-
-                # Fetch associated shipment details
-                query_shipment = "SELECT * FROM `Shipment` WHERE OrderID = %s"
-                shipment_data = fetch_table_data(connection, query_shipment % order_id)
-
-                # Function to convert incompatible types (datetime.date, decimal.Decimal)
-                def convert_types(record):
-                    for key, value in record.items():
-                        if isinstance(value, date):  # Convert date to datetime
-                            record[key] = datetime.combine(value, datetime.min.time())
-                        elif isinstance(value, Decimal):  # Convert Decimal to float
-                            record[key] = float(value)
-                    return record
-
-                # Prepare data for MongoDB
-                order_data_dict = order_data.to_dict("records")
-                order_items_data_dict = order_items_data.to_dict("records")
-                shipment_data_dict = shipment_data.to_dict("records")
-                converted_order = [convert_types(record) for record in order_data_dict]
-                converted_items = [convert_types(record) for record in order_items_data_dict]
-                converted_shipments = [convert_types(record) for record in shipment_data_dict]
-
-                # Insert the deleted order, items, and shipments into MongoDB
-                order_history = {
-                    "Order": converted_order,
-                    "OrderItems": converted_items,
-                    "Shipments": converted_shipments,
-                    "DeletedAt": datetime.now().isoformat()
-                }
-                mongodb["deleted_order"].insert_one(order_history)
-
-                # Delete associated rows from Shipment table
-                delete_shipment_query = "DELETE FROM `Shipment` WHERE OrderID = %s"
-                cursor = connection.cursor()
-                cursor.execute(delete_shipment_query, (order_id,))
-
-                # Verify rows are deleted from Shipment
-                cursor.execute("SELECT COUNT(*) FROM `Shipment` WHERE OrderID = %s", (order_id,))
-                remaining_shipments = cursor.fetchone()[0]
-                if remaining_shipments > 0:
-                    raise Exception("Failed to delete associated rows from `Shipment`.")
-
-                # Delete associated rows from OrderItem table
-                delete_order_items_query = "DELETE FROM `OrderItem` WHERE OrderID = %s"
-                cursor.execute(delete_order_items_query, (order_id,))
-
-                # Verify rows are deleted from OrderItem
-                cursor.execute("SELECT COUNT(*) FROM `OrderItem` WHERE OrderID = %s", (order_id,))
-                remaining_items = cursor.fetchone()[0]
-                if remaining_items > 0:
-                    raise Exception("Failed to delete associated rows from `OrderItem`.")
-
-                # Delete the order from the Order table
-                delete_order_query = "DELETE FROM `Order` WHERE OrderID = %s"
-                cursor.execute(delete_order_query, (order_id,))
-                connection.commit()
+def recover_connection(connection, error):
+    try:
+        if error.errno in CONNECTION_LOST_ERRNOS:
+            connection.reconnect(attempts=3, delay=1)
+        else:
+            connection.rollback()
+    except Error:
+        pass  # the next attempt fails again and reports the error
 
-                st.success(f"Order {order_id} and its associated items and shipments were deleted successfully and recorded in MongoDB.")
-            else:
-                st.warning(f"Order ID {order_id} not found.")
+
+def run_in_transaction(connection, work, retries=TRANSACTION_RETRIES):
+    # Runs work(cursor) in one transaction, retrying with jittered backoff on deadlocks,
+    # lock wait timeouts and lost connections. A commit lost with the connection may have
+    # applied, so non-idempotent writes should go through run_idempotent.
+    for attempt in range(retries):
+        try:
+            # End any read snapshot left open by earlier SELECTs on this connection
+            connection.rollback()
+            cursor = AuditCursor(connection.cursor(), connection)
+            result = work(cursor)
+            connection.commit()
+            if cursor.records:
+                audit_log().append(cursor.records, cursor.audit_ms)
+            return result
         except Error as e:
+            recover_connection(connection, e)
+            if e.errno in TRANSIENT_ERRNOS and attempt < retries - 1:
+                time.sleep(0.05 * (2 ** attempt) * random.uniform(0.5, 1.5))
+                continue
+            raise
+        except Exception:
             connection.rollback()
-            st.error(f"Error deleting order from MySQL: {e}")
-        except Exception as e:
-            st.error(f"Error interacting with MongoDB or cleaning up dependencies: {e}")
+            raise
 
 
-# Track Order
-def track_order(connection):
-    st.header("Track Order")
+def setup_idempotency(connection):
+    cursor = connection.cursor()
+    cursor.execute(
+        """
+            CREATE TABLE IF NOT EXISTS IdempotencyKey (
+                RequestKey CHAR(64) PRIMARY KEY,
+                Operation VARCHAR(32) NOT NULL,
+                Result TEXT NULL,
+                CreatedAt DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+                INDEX idx_idempotency_created (CreatedAt)
+            )
+        """
+    )
+    connection.commit()
 
-    # Input field for Order ID
-    order_id = st.number_input("Enter Order ID to Track", min_value=1, step=1)
 
-    if st.button("Track Order"):
-        try:
-            # Query to fetch Shipment details for the order
-            query = """
-                SELECT 
-                    Shipment.ShipmentID, 
-                    Shipment.ShipmentDate, 
-                    Shipment.TrackingNumber, 
-                    `Order`.Status
-                FROM Shipment
-                LEFT JOIN `Order` ON Shipment.OrderID = `Order`.OrderID
-                WHERE `Order`.OrderID = %s
-            """
-            shipment_data = fetch_table_data(connection, query % order_id)
+def request_key(form, payload):
+    # The same inputs submitted again from the same form (double clicks, reruns, client
+    # retries) map to the same key. API callers can pass ?idempotency_key=... instead of
+    # the session's nonce; the payload still counts, so a lingering key in the URL only
+    # replays the exact submission it was made for.
+    explicit = st.query_params.get("idempotency_key")
+    nonce = explicit or st.session_state.setdefault(f"request_nonce_{form}", uuid.uuid4().hex)
+    material = json.dumps([form, nonce, payload], default=str, sort_keys=True)
+    return hashlib.sha256(material.encode()).hexdigest()
 
-            if not shipment_data.empty:
-                st.write("Order Shipment Details:")
-                st.dataframe(shipment_data, use_container_width=True)
-            else:
-                st.warning("No shipment details found for the given Order ID.")
+
+def new_request(form):
+    st.session_state.pop(f"request_nonce_{form}", None)
+
+
+def run_idempotent(connection, key, operation, work, retries=TRANSACTION_RETRIES):
+    # Runs work(cursor) at most once per key, in the same transaction that claims the key,
+    # and returns (result, replayed). The result must be JSON-serialisable.
+    def attempt(cursor):
+        try:
+            # Blocks on a concurrent request holding the same key until it commits or rolls back
+            cursor.execute("INSERT INTO IdempotencyKey (RequestKey, Operation) VALUES (%s, %s)", (key, operation))
         except Error as e:
-            st.error(f"Error fetching shipment details: {e}")
+            if e.errno != 1062:  # ER_DUP_ENTRY
+                raise
+            cursor.execute("SELECT Operation, Result FROM IdempotencyKey WHERE RequestKey = %s LOCK IN SHARE MODE", (key,))
+            stored_operation, stored_result = cursor.fetchone()
+            if stored_operation != operation:
+                raise IdempotencyConflict(f"Request key was already used for {stored_operation}.")
+            return json.loads(stored_result), True
 
-def modify_order(connection):
-    st.header("Modify Order")
+        result = work(cursor)
+        cursor.execute("UPDATE IdempotencyKey SET Result = %s WHERE RequestKey = %s", (json.dumps(result), key))
+        return result, False
 
-    # Initialize session state for order details if not set
-    if "order_details" not in st.session_state:
-        st.session_state["order_details"] = None
-    if "order_items" not in st.session_state:
-        st.session_state["order_items"] = None
+    return run_in_transaction(connection, attempt, retries)
+
+
+def purge_idempotency_keys(connection):
+    cursor = connection.cursor()
+    cursor.execute(
+        "DELETE FROM IdempotencyKey WHERE CreatedAt < NOW() - INTERVAL %s DAY", (IDEMPOTENCY_KEY_TTL_DAYS,)
+    )
+    connection.commit()
+    return cursor.rowcount
+
+
+@st.cache_resource
+def idempotency_purge_state():
+    return {"last_run": 0.0}
 
-    # Input to select Order ID
-    order_id = st.number_input("Enter Order ID to Modify", min_value=1, step=1)
 
-    # Fetch Order Details
-    if st.button("Fetch Order Details"):
+def maybe_purge_idempotency_keys(connection):
+    state = idempotency_purge_state()
+    if time.time() - state["last_run"] < IDEMPOTENCY_PURGE_INTERVAL:
+        return
+    state["last_run"] = time.time()
+    try:
+        purge_idempotency_keys(connection)
+    except Error as e:
+        st.warning(f"Expired request keys not purged: {e}")
+
+
+class WriteQueue(threading.Thread):
+    # Batches last-writer-wins updates: writes for the same (statement, key) that arrive
+    # within one flush interval collapse to the newest, and each flush is one transaction
+    def __init__(self, interval=WRITE_QUEUE_INTERVAL):
+        super().__init__(name="write-queue", daemon=True)
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.pending = OrderedDict()
+        self.connection = None
+        self.flushes = 0
+        self.writes = 0
+        self.coalesced = 0
+
+    def submit(self, statement, key, params):
+        future = Future()
+        scope = getattr(page_scope, "user", None), getattr(page_scope, "name", None)
+        with self.lock:
+            _, futures, _ = self.pending.pop((statement, key), (None, [], None))
+            self.coalesced += len(futures)
+            self.pending[(statement, key)] = (params, futures + [future], scope)
+        return future
+
+    def run(self):
+        while True:
+            time.sleep(self.interval)
+            with self.lock:
+                batch, self.pending = self.pending, OrderedDict()
+            if batch:
+                self.flush(batch)
+
+    def flush(self, batch):
+        def apply(cursor):
+            for (statement, _), (params, _, scope) in batch.items():
+                with acting_as(*scope):
+                    cursor.execute(statement, params)
+
+        futures = [future for _, futures, _ in batch.values() for future in futures]
         try:
-            # Fetch order details from the database
-            query_order = """
-                SELECT OrderID, SupplierID, OrderDate, Status
-                FROM `Order`
-                WHERE OrderID = %s
-            """
-            order_data = fetch_table_data(connection, query_order % order_id)
+            if self.connection is None or not self.connection.is_connected():
+                self.connection = open_connection()
+            run_in_transaction(self.connection, apply)
+        except Exception as e:
+            for future in futures:
+                future.set_exception(e)
+            return
+        self.flushes += 1
+        self.writes += len(batch)
+        for future in futures:
+            future.set_result(True)
+
+
+@st.cache_resource
+def write_queue():
+    queue = WriteQueue()
+    queue.start()
+    return queue
+
+
+# Stock changes are appended to InventoryMovement instead of rewriting Inventory rows.
+# Inventory.Quantity is a snapshot that includes every movement up to
+# InventoryLedgerState.CompactedThrough; availability is snapshot + later movements.
+MOVEMENT_TYPES = ("Reservation", "Receipt", "Adjustment", "Release")
+SHIPPED_STATUSES = ("Shipped", "Delivered")  # a reservation of these orders is stock that has left
+LEDGER_COMPACTION_INTERVAL = 300  # seconds between compactions per server process
+LEDGER_COMPACTION_HORIZON = 60  # only fold movements older than this
+LEDGER_COMPACTION_BATCH = 50000  # movements folded per compaction at most
+# MovementIDs are handed out at insert but become visible at commit, so a gap below a
+# visible ID may still be filled. Compaction stops at the first gap until the movement
+# after it is this old, by which time the gap can only be a rolled-back insert.
+# (Assumes auto_increment_increment = 1.)
+LEDGER_GAP_TIMEOUT = 900
+
+PENDING_MOVEMENTS_SUBQUERY = """
+    SELECT ProductID, LocationID, SUM(Quantity) AS Delta
+    FROM InventoryMovement
+    WHERE MovementID > (SELECT CompactedThrough FROM InventoryLedgerState WHERE StateID = 1)
+    GROUP BY ProductID, LocationID
+"""
+
+
+def setup_inventory_ledger(connection):
+    cursor = connection.cursor()
+    cursor.execute(
+        """
+            CREATE TABLE IF NOT EXISTS InventoryMovement (
+                MovementID BIGINT AUTO_INCREMENT PRIMARY KEY,
+                ProductID INT NOT NULL,
+                LocationID INT NOT NULL,
+                MovementType ENUM('Reservation', 'Receipt', 'Adjustment', 'Release') NOT NULL,
+                Quantity INT NOT NULL,
+                OrderID INT NULL,
+                CreatedAt DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+                INDEX idx_movement_product_location (ProductID, LocationID, MovementID),
+                INDEX idx_movement_order (OrderID),
+                INDEX idx_movement_created (CreatedAt)
+            )
+        """
+    )
+    cursor.execute(
+        """
+            CREATE TABLE IF NOT EXISTS InventoryLedgerState (
+                StateID TINYINT PRIMARY KEY,
+                CompactedThrough BIGINT NOT NULL DEFAULT 0
+            )
+        """
+    )
+    cursor.execute("INSERT IGNORE INTO InventoryLedgerState (StateID, CompactedThrough) VALUES (1, 0)")
+    connection.commit()
 
-            if not order_data.empty:  # Check if DataFrame is not empty
-                st.session_state["order_details"] = order_data.iloc[0]
 
-                # Fetch associated Order Items
-                query_items = """
-                    SELECT OrderItemID, ProductID, Quantity, Price
-                    FROM OrderItem
-                    WHERE OrderID = %s
-                """
-                items_data = fetch_table_data(connection, query_items % order_id)
-                st.session_state["order_items"] = items_data
-            else:
-                st.warning("Order ID not found.")
-        except Error as e:
-            st.error(f"Error fetching order details: {e}")
+def record_movements(cursor, movements):
+    # movements is a list of (ProductID, LocationID, MovementType, Quantity, OrderID)
+    for movement in movements:
+        if movement[2] not in MOVEMENT_TYPES:
+            raise ValueError(f"Unknown movement type: {movement[2]}")
+    cursor.executemany(
+        """
+            INSERT INTO InventoryMovement (ProductID, LocationID, MovementType, Quantity, OrderID)
+            VALUES (%s, %s, %s, %s, %s)
+        """,
+        movements,
+    )
+
+
+def reserve_stock(cursor, items, order_id=None, strategy="Greedy"):
+    # items is a list of (ProductID, Quantity); returns [(ProductID, LocationID, Quantity), ...]
+    required = {}
+    for product_id, quantity in items:
+        required[int(product_id)] = required.get(int(product_id), 0) + int(quantity)
+    product_ids = sorted(required)
+    if not product_ids:
+        return []
+
+    # Lock the snapshot rows in (ProductID, LocationID) order. Every reserver and the
+    # compactor take these locks in the same order, so they can't deadlock each other,
+    # and the rows themselves are never rewritten by a reservation. Stock that so far
+    # only exists as movements gets an empty snapshot row first, so it is locked too.
+    placeholders = ", ".join(["%s"] * len(product_ids))
+    cursor.execute(
+        f"""
+            INSERT IGNORE INTO Inventory (ProductID, LocationID, Quantity)
+            SELECT DISTINCT ProductID, LocationID, 0
+            FROM InventoryMovement
+            WHERE ProductID IN ({placeholders})
+              AND MovementID > (SELECT CompactedThrough FROM InventoryLedgerState WHERE StateID = 1)
+        """,
+        tuple(product_ids),
+    )
+    cursor.execute(
+        f"""
+            SELECT ProductID, LocationID, Quantity
+            FROM Inventory
+            WHERE ProductID IN ({placeholders})
+            ORDER BY ProductID, LocationID
+            FOR UPDATE
+        """,
+        tuple(product_ids),
+    )
+    snapshot = {(row[0], row[1]): row[2] for row in cursor.fetchall()}
+
+    # A locking read sees every movement committed while we waited for the row locks,
+    # even if an earlier plain read in this transaction already fixed its snapshot
+    cursor.execute(
+        f"""
+            SELECT ProductID, LocationID, SUM(Quantity)
+            FROM InventoryMovement
+            WHERE ProductID IN ({placeholders})
+              AND MovementID > (SELECT CompactedThrough FROM InventoryLedgerState WHERE StateID = 1)
+            GROUP BY ProductID, LocationID
+            LOCK IN SHARE MODE
+        """,
+        tuple(product_ids),
+    )
+    available = dict(snapshot)
+    for product_id, location_id, delta in cursor.fetchall():
+        available[(product_id, location_id)] = available.get((product_id, location_id), 0) + int(delta)
+
+    demand = np.array([required[product_id] for product_id in product_ids], dtype=np.int64)
+    location_ids = sorted({location_id for _, location_id in available})
+    stock = np.zeros((len(product_ids), len(location_ids)), dtype=np.int64)
+    product_index = {product_id: i for i, product_id in enumerate(product_ids)}
+    location_index = {location_id: j for j, location_id in enumerate(location_ids)}
+    for (product_id, location_id), quantity in available.items():
+        stock[product_index[product_id], location_index[location_id]] = max(int(quantity), 0)
+
+    short = np.nonzero(stock.sum(axis=1) < demand)[0]
+    if len(short):
+        i = short[0]
+        raise InsufficientStock(
+            f"Product {product_ids[i]} has {stock[i].sum()} units available, {demand[i]} requested."
+        )
 
-    # Display and Update Order Details
-    if st.session_state["order_details"] is not None:
-        order_details = st.session_state["order_details"]
-        st.write("**Order Details:**")
-        
-        supplier_id = st.number_input(
-            "Supplier ID", value=order_details["SupplierID"], step=1, key="supplier_id"
+    allocation = allocate_greedy(demand, stock)
+    if strategy == "ILP":
+        # The solver runs while the stock rows are locked, so it is time-boxed and only
+        # replaces the greedy plan when it actually found a better one
+        optimised = allocate_ilp(demand, stock)
+        if optimised is not None and allocation_cost(optimised) < allocation_cost(allocation):
+            allocation = optimised
+
+    rows, cols = np.nonzero(allocation)
+    allocations = [
+        (product_ids[i], location_ids[j], int(allocation[i, j])) for i, j in zip(rows, cols)
+    ]
+    record_movements(
+        cursor,
+        [(product_id, location_id, "Reservation", -take, order_id) for product_id, location_id, take in allocations],
+    )
+    return allocations
+
+
+# Allocation picks which locations fulfil each product of an order. Both strategies take
+# demand (one entry per product) and a products x locations matrix of available stock
+# and return a matrix of the same shape with the quantity to take from each location.
+ALLOCATION_STRATEGIES = ("Greedy", "ILP")
+ILP_TIME_LIMIT = 2  # seconds
+
+
+def allocation_cost(allocation):
+    # (shipping locations, product lines split across locations)
+    used = allocation > 0
+    return int(used.any(axis=0).sum()), int((used.sum(axis=1) > 1).sum())
+
+
+def allocate_greedy(demand, stock):
+    allocation = np.zeros_like(stock)
+    remaining = np.ones(len(demand), dtype=bool)
+    shipping = np.zeros(stock.shape[1], dtype=bool)
+    covers = stock >= demand[:, None]
+
+    # Set-cover pass: repeatedly ship from the location that can fill the most
+    # remaining products in full (ties go to the location holding more of them)
+    while remaining.any():
+        score = covers[remaining].sum(axis=0)
+        if score.max() == 0:
+            break
+        best = np.lexsort((stock[remaining].sum(axis=0), score))[-1]
+        filled = remaining & covers[:, best]
+        allocation[filled, best] = demand[filled]
+        remaining &= ~filled
+        shipping[best] = True
+
+    # Products no single location can fill are split, drawing from locations that
+    # already ship first and then from the largest stock
+    rows = np.nonzero(remaining)[0]
+    if len(rows):
+        priority = stock[rows] + shipping * (stock.max() + 1)
+        order = np.argsort(-priority, axis=1, kind="stable")
+        ordered_stock = np.take_along_axis(stock[rows], order, axis=1)
+        drawn_before = np.cumsum(ordered_stock, axis=1) - ordered_stock
+        take = np.clip(demand[rows, None] - drawn_before, 0, ordered_stock)
+        split = np.zeros_like(take)
+        np.put_along_axis(split, order, take, axis=1)
+        allocation[rows] = split
+
+    return allocation
+
+
+def allocate_ilp(demand, stock, time_limit=ILP_TIME_LIMIT):
+    # Minimises the number of shipping locations, then the number of split lines.
+    # Returns None when SciPy is unavailable or HiGHS finds no solution in time.
+    try:
+        from scipy.optimize import Bounds, LinearConstraint, milp
+        from scipy.sparse import coo_matrix
+    except ImportError:
+        return None
+
+    n_products, n_locations = stock.shape
+    pair_product, pair_location = np.nonzero(stock > 0)
+    n_pairs = len(pair_product)
+    capacity = np.minimum(stock[pair_product, pair_location], demand[pair_product])
+
+    # Variables: x (units per pair), z (pair used), y (location used)
+    x = np.arange(n_pairs)
+    z = n_pairs + x
+    y = 2 * n_pairs + np.arange(n_locations)
+    n_vars = 2 * n_pairs + n_locations
+    cost = np.concatenate([np.zeros(n_pairs), np.ones(n_pairs), np.full(n_locations, n_pairs + 1.0)])
+
+    # sum_j x[p, j] == demand[p]
+    fill = coo_matrix((np.ones(n_pairs), (pair_product, x)), shape=(n_products, n_vars))
+    # x[p, j] <= capacity * z[p, j]
+    link_pair = coo_matrix(
+        (np.concatenate([np.ones(n_pairs), -capacity]), (np.tile(np.arange(n_pairs), 2), np.concatenate([x, z]))),
+        shape=(n_pairs, n_vars),
+    )
+    # z[p, j] <= y[j]
+    link_location = coo_matrix(
+        (np.concatenate([np.ones(n_pairs), -np.ones(n_pairs)]),
+         (np.tile(np.arange(n_pairs), 2), np.concatenate([z, y[pair_location]]))),
+        shape=(n_pairs, n_vars),
+    )
+
+    result = milp(
+        cost,
+        constraints=[
+            LinearConstraint(fill.tocsr(), demand, demand),
+            LinearConstraint(link_pair.tocsr(), -np.inf, 0),
+            LinearConstraint(link_location.tocsr(), -np.inf, 0),
+        ],
+        integrality=np.ones(n_vars),
+        bounds=Bounds(np.zeros(n_vars), np.concatenate([capacity, np.ones(n_pairs + n_locations)])),
+        options={"time_limit": time_limit},
+    )
+    if result.x is None:
+        return None
+
+    allocation = np.zeros_like(stock)
+    allocation[pair_product, pair_location] = np.round(result.x[x]).astype(stock.dtype)
+    return allocation
+
+
+def release_order_stock(cursor, order_id, product_ids=None):
+    # Give back whatever is still reserved for the order (reservations net of earlier
+    # releases), unless it has shipped: then the reservation is what left the building
+    shipped = ", ".join(["%s"] * len(SHIPPED_STATUSES))
+    products = ""
+    if product_ids is not None:
+        products = f"AND ProductID IN ({', '.join(['%s'] * len(product_ids))})"
+    cursor.execute(
+        f"""
+            INSERT INTO InventoryMovement (ProductID, LocationID, MovementType, Quantity, OrderID)
+            SELECT ProductID, LocationID, 'Release', -SUM(Quantity), OrderID
+            FROM InventoryMovement
+            WHERE OrderID = %s AND MovementType IN ('Reservation', 'Release') {products}
+              AND NOT EXISTS (SELECT 1 FROM `Order` WHERE OrderID = %s AND Status IN ({shipped}))
+            GROUP BY ProductID, LocationID, OrderID
+            HAVING SUM(Quantity) < 0
+        """,
+        (order_id,) + tuple(product_ids or ()) + (order_id,) + SHIPPED_STATUSES,
+    )
+
+
+def rereserve_order_stock(cursor, order_id, product_ids):
+    # After an order's lines changed: swap what it holds of these products for what its
+    # lines now ask for. Shipped orders and orders that never reserved stock are left alone.
+    product_ids = sorted({int(product_id) for product_id in product_ids})
+    if not product_ids:
+        return
+    cursor.execute("SELECT Status FROM `Order` WHERE OrderID = %s FOR UPDATE", (order_id,))
+    order = cursor.fetchone()
+    if order is None or order[0] in SHIPPED_STATUSES:
+        return
+    cursor.execute(
+        "SELECT 1 FROM InventoryMovement WHERE OrderID = %s AND MovementType = 'Reservation' LIMIT 1",
+        (order_id,),
+    )
+    if cursor.fetchone() is None:
+        return
+    release_order_stock(cursor, order_id, product_ids)
+    placeholders = ", ".join(["%s"] * len(product_ids))
+    cursor.execute(
+        f"""
+            SELECT ProductID, SUM(Quantity)
+            FROM OrderItem
+            WHERE OrderID = %s AND ProductID IN ({placeholders})
+            GROUP BY ProductID
+        """,
+        (order_id,) + tuple(product_ids),
+    )
+    reserve_stock(cursor, cursor.fetchall(), order_id)
+
+
+def compact_inventory_ledger(connection):
+    def compact(cursor):
+        cursor.execute("SELECT CompactedThrough FROM InventoryLedgerState WHERE StateID = 1 FOR UPDATE")
+        compacted_through = cursor.fetchone()[0]
+        cursor.execute(
+            """
+                SELECT MovementID,
+                       CreatedAt < NOW() - INTERVAL %s SECOND AS Settled,
+                       CreatedAt < NOW() - INTERVAL %s SECOND AS GapExpired
+                FROM InventoryMovement
+                WHERE MovementID > %s
+                ORDER BY MovementID
+                LIMIT %s
+            """,
+            (LEDGER_COMPACTION_HORIZON, LEDGER_GAP_TIMEOUT, compacted_through, LEDGER_COMPACTION_BATCH),
         )
-        order_date = st.date_input(
-            "Order Date", value=pd.to_datetime(order_details["OrderDate"]), key="order_date"
+        upto = compacted_through
+        for movement_id, settled, gap_expired in cursor.fetchall():
+            # Stop at the first young movement, or at a gap that may still commit
+            if not settled or (movement_id != upto + 1 and not gap_expired):
+                break
+            upto = movement_id
+        if upto <= compacted_through:
+            return 0
+
+        deltas = """
+            SELECT ProductID, LocationID, SUM(Quantity) AS Delta
+            FROM InventoryMovement
+            WHERE MovementID > %s AND MovementID <= %s
+            GROUP BY ProductID, LocationID
+        """
+        cursor.execute(
+            f"""
+                UPDATE Inventory
+                JOIN ({deltas}) AS Pending
+                  ON Pending.ProductID = Inventory.ProductID AND Pending.LocationID = Inventory.LocationID
+                SET Inventory.Quantity = Inventory.Quantity + Pending.Delta,
+                    Inventory.Version = Inventory.Version + 1
+            """,
+            (compacted_through, upto),
         )
-        status = st.selectbox(
-            "Order Status",
-            ["Pending", "Shipped", "Delivered"],
-            index=["Pending", "Shipped", "Delivered"].index(order_details["Status"]),
-            key="order_status",
+        # Receipts for a product at a new location create its snapshot row
+        cursor.execute(
+            f"""
+                INSERT INTO Inventory (ProductID, LocationID, Quantity)
+                SELECT Pending.ProductID, Pending.LocationID, Pending.Delta
+                FROM ({deltas}) AS Pending
+                WHERE NOT EXISTS (
+                    SELECT 1 FROM Inventory
+                    WHERE Inventory.ProductID = Pending.ProductID AND Inventory.LocationID = Pending.LocationID
+                )
+            """,
+            (compacted_through, upto),
         )
+        cursor.execute("UPDATE InventoryLedgerState SET CompactedThrough = %s WHERE StateID = 1", (upto,))
+        return upto - compacted_through
 
-        # Display and Update Order Items
-        if st.session_state["order_items"] is not None and not st.session_state["order_items"].empty:
-            items_data = st.session_state["order_items"]
-            st.write("**Order Items:**")
-            updated_items = []
-
-            for _, item in items_data.iterrows():
-                st.write(f"Item ID: {item['OrderItemID']}")
-                product_id = st.number_input(
-                    f"Product ID (Item {item['OrderItemID']})",
-                    value=item["ProductID"],
-                    step=1,
-                    key=f"prod_{item['OrderItemID']}",
-                )
-                quantity = st.number_input(
-                    f"Quantity (Item {item['OrderItemID']})",
-                    value=item["Quantity"],
-                    step=1,
-                    key=f"qty_{item['OrderItemID']}",
-                )
-                price = st.number_input(
-                    f"Price (Item {item['OrderItemID']})",
-                    value=float(item["Price"]),
-                    step=0.01,
-                    key=f"price_{item['OrderItemID']}",
-                )
+    return run_in_transaction(connection, compact)
 
-                updated_items.append(
-                    {
-                        "OrderItemID": item["OrderItemID"],
-                        "ProductID": product_id,
-                        "Quantity": quantity,
-                        "Price": price,
-                    }
-                )
 
-            # Update Order Items Button
-            if st.button("Update Order Items"):
-                try:
-                    for item in updated_items:
-                        query_update_item = """
-                            UPDATE OrderItem
-                            SET ProductID = %s, Quantity = %s, Price = %s
-                            WHERE OrderItemID = %s
-                        """
-                        execute_query(
-                            connection,
-                            query_update_item,
-                            (item["ProductID"], item["Quantity"], item["Price"], item["OrderItemID"]),
-                        )
-                    st.success("Order items updated successfully!")
-                except Error as e:
-                    st.error(f"Error updating order items: {e}")
+@st.cache_resource
+def ledger_compaction_state():
+    return {"last_run": 0.0}
+
+
+def maybe_compact_inventory_ledger(connection):
+    state = ledger_compaction_state()
+    if time.time() - state["last_run"] < LEDGER_COMPACTION_INTERVAL:
+        return
+    state["last_run"] = time.time()
+    try:
+        compact_inventory_ledger(connection)
+    except Error as e:
+        st.warning(f"Inventory ledger compaction skipped: {e}")
+
+
+def fetch_stock_history(connection, product_id, location_id=None, start_date=None, end_date=None):
+    query = """
+        SELECT
+            InventoryMovement.MovementID,
+            InventoryMovement.CreatedAt,
+            Location.LocationName,
+            InventoryMovement.MovementType,
+            InventoryMovement.Quantity,
+            InventoryMovement.OrderID
+        FROM InventoryMovement
+        LEFT JOIN Location ON InventoryMovement.LocationID = Location.LocationID
+        WHERE InventoryMovement.ProductID = %s
+    """
+    params = [product_id]
+    if location_id:
+        query += " AND InventoryMovement.LocationID = %s"
+        params.append(location_id)
+    if start_date:
+        query += " AND InventoryMovement.CreatedAt >= %s"
+        params.append(start_date)
+    if end_date:
+        query += " AND InventoryMovement.CreatedAt < %s + INTERVAL 1 DAY"
+        params.append(end_date)
+    query += " ORDER BY InventoryMovement.MovementID"
+
+    cursor = read_connection(connection).cursor(dictionary=True)
+    cursor.execute(query, tuple(params))
+    return pd.DataFrame(cursor.fetchall())
+
+
+def stock_history(connection):
+    st.header("Stock History")
+
+    product_id = st.number_input("Product ID", min_value=1, step=1)
+    location_id = st.number_input("Location ID (0 for all locations)", min_value=0, step=1)
+    start_date = st.date_input("From", value=None)
+    end_date = st.date_input("To", value=None)
+
+    if st.button("Show History"):
+        history = fetch_stock_history(connection, product_id, location_id or None, start_date, end_date)
+        if not history.empty:
+            history["NetChange"] = history["Quantity"].cumsum()
+            line_chart(history, x="CreatedAt", y="NetChange", method="Min/Max")
+            st.dataframe(history, use_container_width=True)
+        else:
+            st.info("No stock movements found for this product.")
+
+
+def adjust_stock(connection):
+    st.header("Adjust Stock")
+
+    product_id = st.number_input("Product ID", min_value=1, step=1)
+    location_id = st.number_input("Location ID", min_value=1, step=1)
+    movement_type = st.selectbox("Movement Type", ["Receipt", "Adjustment"])
+    quantity = st.number_input("Quantity (negative to remove stock)", step=1, value=0)
+
+    if st.button("Record Movement"):
+        if quantity == 0:
+            st.error("Quantity must not be zero.")
+            return
+        try:
+            run_in_transaction(
+                connection,
+                lambda cursor: record_movements(cursor, [(product_id, location_id, movement_type, quantity, None)]),
+            )
+            st.success(f"{movement_type} of {quantity} recorded for product {product_id} at location {location_id}.")
+        except Error as e:
+            st.error(f"Error recording stock movement: {e}")
+
+# Goods receiving: scans are appended to a local write-ahead segment (fsync'd before
+# they are acknowledged) and summed per (product, location) in memory. Every
+# RECEIVING_FLUSH_EVENTS scans or RECEIVING_FLUSH_INTERVAL seconds the segment is
+# closed and applied in one transaction: one Receipt movement per (product, location)
+# and an Inventory upsert of LastRestockDate. The segment name is recorded in
+# ReceivingBatch in the same transaction, so a segment replayed after a crash, or
+# retried after a failed flush, is applied at most once; it is deleted once committed.
+RECEIVING_WAL_DIR = os.environ.get("INVENTORY_RECEIVING_WAL", "receiving_wal")
+RECEIVING_FLUSH_EVENTS = 500
+RECEIVING_FLUSH_INTERVAL = 5  # seconds
+RECEIVING_CSV_COLUMNS = ("ProductID", "LocationID", "Quantity")  # Quantity defaults to 1 per row
+RECEIVING_LOOKUP_BATCH = 1000  # scanned IDs checked per query
+
+
+def ensure_index(connection, table, index, definition):
+    cursor = connection.cursor()
+    cursor.execute(
+        """
+            SELECT COUNT(*)
+            FROM INFORMATION_SCHEMA.STATISTICS
+            WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND INDEX_NAME = %s
+        """,
+        (table, index),
+    )
+    if cursor.fetchone()[0] == 0:
+        cursor.execute(f"ALTER TABLE `{table}` ADD {definition}")
+        connection.commit()
+
 
-        # Update Order Details Button
-        if st.button("Update Order Details"):
+def setup_receiving(connection):
+    # Receipts upsert the snapshot row by (ProductID, LocationID), which needs a unique key on it
+    ensure_index(
+        connection, "Inventory", "uq_inventory_product_location",
+        "UNIQUE KEY uq_inventory_product_location (ProductID, LocationID)",
+    )
+    cursor = connection.cursor()
+    cursor.execute(
+        """
+            CREATE TABLE IF NOT EXISTS ReceivingBatch (
+                BatchID VARCHAR(64) PRIMARY KEY,
+                Scans INT NOT NULL,
+                Units INT NOT NULL,
+                AppliedAt DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+                INDEX idx_receiving_applied (AppliedAt)
+            )
+        """
+    )
+    connection.commit()
+
+
+class ReceivingBuffer(threading.Thread):
+    def __init__(self, wal_dir=RECEIVING_WAL_DIR, flush_events=RECEIVING_FLUSH_EVENTS, interval=RECEIVING_FLUSH_INTERVAL):
+        super().__init__(name="receiving", daemon=True)
+        self.wal_dir = wal_dir
+        self.flush_events = flush_events
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.wake = threading.Event()
+        self.connection = None
+        self.scans = 0
+        self.flushed_scans = 0
+        self.flushed_units = 0
+        self.flushes = 0
+        self.last_error = None
+        os.makedirs(wal_dir, exist_ok=True)
+        # Segments left by an earlier process are applied first, in the order written
+        self.sealed = []
+        for path in sorted(self.segment_paths()):
+            segment = self.read_segment(path)
+            if segment["scans"]:
+                self.sealed.append(segment)
+            else:
+                os.remove(path)
+        self.open_segment()
+
+    def segment_paths(self):
+        return [os.path.join(self.wal_dir, name) for name in os.listdir(self.wal_dir) if name.endswith(".wal")]
+
+    def open_segment(self):
+        name = f"{time.strftime('%Y%m%d%H%M%S')}-{uuid.uuid4().hex[:12]}"
+        self.segment = {"name": name, "path": os.path.join(self.wal_dir, f"{name}.wal"), "totals": {}, "scans": 0}
+        self.wal = open(self.segment["path"], "a", encoding="utf-8")
+
+    @staticmethod
+    def add_scan(segment, product_id, location_id, quantity, received_on):
+        units, last_date = segment["totals"].get((product_id, location_id), (0, received_on))
+        segment["totals"][(product_id, location_id)] = (units + quantity, max(last_date, received_on))
+        segment["scans"] += 1
+
+    def read_segment(self, path):
+        segment = {"name": os.path.basename(path)[:-len(".wal")], "path": path, "totals": {}, "scans": 0}
+        with open(path, encoding="utf-8") as wal:
+            for line in wal:
+                try:
+                    scan = json.loads(line)
+                except json.JSONDecodeError:
+                    continue  # torn last line: that scan was never acknowledged
+                self.add_scan(segment, scan["ProductID"], scan["LocationID"], scan["Quantity"], scan["ReceivedOn"])
+        return segment
+
+    def submit(self, scans):
+        # scans is a list of (ProductID, LocationID, Quantity); returns once they are durable
+        received_on = date.today().isoformat()
+        scans = [(int(product_id), int(location_id), int(quantity)) for product_id, location_id, quantity in scans]
+        for _, _, quantity in scans:
+            if quantity <= 0:
+                raise ValueError("Received quantities must be positive.")
+        with self.lock:
+            self.wal.write(
+                "".join(
+                    json.dumps({"ProductID": p, "LocationID": l, "Quantity": q, "ReceivedOn": received_on}) + "\n"
+                    for p, l, q in scans
+                )
+            )
+            self.wal.flush()
+            os.fsync(self.wal.fileno())
+            for product_id, location_id, quantity in scans:
+                self.add_scan(self.segment, product_id, location_id, quantity, received_on)
+            self.scans += len(scans)
+            full = self.segment["scans"] >= self.flush_events
+        if full:
+            self.wake.set()
+        return len(scans)
+
+    def rotate(self):
+        with self.lock:
+            if self.segment["scans"]:
+                self.wal.close()
+                self.sealed.append(self.segment)
+                self.open_segment()
+            return list(self.sealed)
+
+    def run(self):
+        while True:
+            self.wake.wait(self.interval)
+            self.wake.clear()
+            self.flush()
+
+    def flush(self):
+        for segment in self.rotate():
             try:
-                query_update_order = """
-                    UPDATE `Order`
-                    SET SupplierID = %s, OrderDate = %s, Status = %s
-                    WHERE OrderID = %s
+                if self.connection is None or not self.connection.is_connected():
+                    self.connection = open_connection()
+                applied = self.apply(segment)
+            except Exception as e:
+                self.last_error = f"{segment['name']}: {e}"
+                return  # kept on disk and retried on the next flush
+            with self.lock:
+                self.sealed.remove(segment)
+            os.remove(segment["path"])
+            if applied:
+                self.flushes += 1
+                self.flushed_scans += segment["scans"]
+                self.flushed_units += sum(units for units, _ in segment["totals"].values())
+            self.last_error = None
+
+    def apply(self, segment):
+        totals = segment["totals"]
+
+        def receive(cursor):
+            cursor.execute(
+                "INSERT INTO ReceivingBatch (BatchID, Scans, Units) VALUES (%s, %s, %s)",
+                (segment["name"], segment["scans"], sum(units for units, _ in totals.values())),
+            )
+            record_movements(
+                cursor, [(product_id, location_id, "Receipt", units, None) for (product_id, location_id), (units, _) in totals.items()]
+            )
+            # Stock itself arrives through the ledger; the snapshot row only needs to exist
+            cursor.executemany(
                 """
-                execute_query(
-                    connection,
-                    query_update_order,
-                    (supplier_id, order_date, status, order_id),
-                )
-                st.success("Order details updated successfully!")
-            except Error as e:
-                st.error(f"Error updating order details: {e}")
+                    INSERT INTO Inventory (ProductID, LocationID, Quantity, LastRestockDate)
+                    VALUES (%s, %s, 0, %s)
+                    ON DUPLICATE KEY UPDATE LastRestockDate = GREATEST(COALESCE(LastRestockDate, VALUES(LastRestockDate)), VALUES(LastRestockDate))
+                """,
+                [(product_id, location_id, received_on) for (product_id, location_id), (_, received_on) in totals.items()],
+            )
+
+        try:
+            run_in_transaction(self.connection, receive)
+            return True
+        except Error as e:
+            if e.errno != 1062:  # ER_DUP_ENTRY
+                raise
+            return False  # committed before a crash or a lost acknowledgement
+
+    def status(self):
+        with self.lock:
+            return {
+                "Buffered Scans": self.segment["scans"] + sum(segment["scans"] for segment in self.sealed),
+                "Unflushed Segments": len(self.sealed),
+                "Scans Accepted": self.scans,
+                "Scans Applied": self.flushed_scans,
+                "Units Applied": self.flushed_units,
+                "Flushes": self.flushes,
+            }
+
+
+@st.cache_resource
+def receiving_buffer():
+    buffer = ReceivingBuffer()
+    buffer.start()
+    return buffer
+
+
+def read_receiving_csv(upload):
+    scans = pd.read_csv(upload)
+    missing = [column for column in RECEIVING_CSV_COLUMNS[:2] if column not in scans.columns]
+    if missing:
+        raise ValueError(f"Missing columns: {', '.join(missing)}")
+    if "Quantity" not in scans:
+        scans["Quantity"] = 1
+    scans = scans[list(RECEIVING_CSV_COLUMNS)]
+    if scans.isna().any(axis=None) or (scans["Quantity"] <= 0).any():
+        raise ValueError("Every row needs a product, a location and a positive quantity.")
+    return scans.astype(np.int64)
+
+
+def unknown_receiving_ids(connection, scans):
+    # Looks up only the scanned IDs. A failed lookup raises: it must not read as "unknown".
+    def unknown(table, column):
+        ids = sorted({int(value) for value in scans[column]})
+        found = set()
+        for start in range(0, len(ids), RECEIVING_LOOKUP_BATCH):
+            batch = ids[start:start + RECEIVING_LOOKUP_BATCH]
+            rows = governed_fetch(
+                connection, f"SELECT {column} FROM {table} WHERE {column} IN ({', '.join(['%s'] * len(batch))})", batch
+            )
+            found.update(int(value) for value in rows.get(column, []))
+        return [value for value in ids if value not in found]
+
+    return unknown("Product", "ProductID"), unknown("Location", "LocationID")
+
+
+def receiving_page(connection):
+    st.header("Receiving")
+    buffer = receiving_buffer()
 
+    with st.form("receive_scan", clear_on_submit=True):
+        col1, col2, col3 = st.columns(3)
+        product_id = col1.number_input("Product ID", min_value=1, step=1)
+        location_id = col2.number_input("Location ID", min_value=1, step=1)
+        quantity = col3.number_input("Quantity", min_value=1, step=1, value=1)
+        scanned = st.form_submit_button("Receive")
+    if scanned:
+        scans = pd.DataFrame([(product_id, location_id, quantity)], columns=list(RECEIVING_CSV_COLUMNS))
+        try:
+            unknown_products, unknown_locations = unknown_receiving_ids(connection, scans)
+        except (QueryRejected, Error) as e:
+            st.error(f"Could not check the scan, nothing was received: {e}")
+        else:
+            if unknown_products or unknown_locations:
+                st.error("Unknown product or location.")
+            else:
+                buffer.submit([(product_id, location_id, quantity)])
+                st.success(f"Received {quantity} of product {product_id} at location {location_id}.")
+
+    st.subheader("Import Scans")
+    upload = st.file_uploader("CSV with ProductID, LocationID and Quantity columns", type="csv")
+    if upload is not None and st.button("Receive File"):
+        try:
+            scans = read_receiving_csv(upload)
+        except ValueError as e:
+            st.error(str(e))
+            scans = None
+        if scans is not None:
+            try:
+                unknown_products, unknown_locations = unknown_receiving_ids(connection, scans)
+            except (QueryRejected, Error) as e:
+                st.error(f"Could not check the scans, nothing was received: {e}")
+            else:
+                if unknown_products or unknown_locations:
+                    st.error(f"Unknown products {unknown_products[:10]} or locations {unknown_locations[:10]}.")
+                else:
+                    buffer.submit(list(scans.itertuples(index=False, name=None)))
+                    st.success(f"Received {len(scans):,} scans ({scans['Quantity'].sum():,} units).")
+
+    st.subheader("Buffer")
+    if st.button("Flush Now"):
+        buffer.wake.set()
+    st.dataframe(pd.DataFrame([buffer.status()]), hide_index=True, use_container_width=True)
+    if buffer.last_error:
+        st.warning(f"Last flush failed and will be retried: {buffer.last_error}")
+
+    batches = fetch_table_data(
+        connection, "SELECT BatchID, Scans, Units, AppliedAt FROM ReceivingBatch ORDER BY AppliedAt DESC LIMIT 20"
+    )
+    if not batches.empty:
+        st.write("Recent Batches:")
+        st.dataframe(batches, hide_index=True, use_container_width=True)
+
+
+# Per-user working sets live in st.session_state under the signed-in user's name,
+# bounded per namespace and expired after SESSION_CACHE_TTL seconds.
+SESSION_CACHE_LIMITS = {"order": 5, "product": 20, "supplier": 20}
+SESSION_CACHE_TTL = 1800
+USER_ROLES = {
+    "Admin": ["Inventory", "Orders", "Discounts", "Shipments", "Suppliers", "Customer Insights", "Insights", "System"],
+    "Manager": ["Inventory", "Orders", "Discounts", "Shipments", "Suppliers", "Customer Insights", "Insights"],
+    "Operator": ["Inventory", "Orders", "Shipments"],
+}
+
+# Reference tables shared, read-only, by every session in the process
+REFERENCE_QUERIES = {
+    "Category": "SELECT CategoryID, CategoryName FROM Category ORDER BY CategoryName",
+    "Location": "SELECT LocationID, LocationName, Address FROM Location ORDER BY LocationName",
+    "Supplier": "SELECT SupplierID, SupplierName, ContactInfo FROM Supplier ORDER BY SupplierName",
+}
+REFERENCE_DATA_TTL = 600
+
+
+def current_user():
+    return st.session_state.get("user_name") or "anonymous"
+
+
+def user_cache(namespace):
+    caches = st.session_state.setdefault("user_caches", {})
+    return caches.setdefault(current_user(), {}).setdefault(namespace, OrderedDict())
+
+
+def session_cache_get(namespace, key):
+    cache = user_cache(namespace)
+    entry = cache.get(key)
+    if entry is None:
+        return None
+    stored_at, value = entry
+    if time.time() - stored_at > SESSION_CACHE_TTL:
+        del cache[key]
+        return None
+    cache.move_to_end(key)
+    return value
+
+
+def session_cache_put(namespace, key, value):
+    cache = user_cache(namespace)
+    cache[key] = (time.time(), value)
+    cache.move_to_end(key)
+    while len(cache) > SESSION_CACHE_LIMITS.get(namespace, 1):
+        cache.popitem(last=False)
+
+
+def session_cache_drop(namespace, key):
+    user_cache(namespace).pop(key, None)
+
+
+def recently_viewed(namespace):
+    now = time.time()
+    return [
+        (key, value)
+        for key, (stored_at, value) in reversed(user_cache(namespace).items())
+        if now - stored_at <= SESSION_CACHE_TTL
+    ]
+
+
+@st.cache_resource(ttl=REFERENCE_DATA_TTL, show_spinner=False)
+def cached_reference_data(_connection, table):
+    # Small keyed lists, so they run as lookups whatever classify_query says about their
+    # missing WHERE; a failure raises and is never cached
+    return compact_frame(governed_fetch(_connection, REFERENCE_QUERIES[table], query_class="lookup"))
+
+
+def reference_data(connection, table):
+    try:
+        return cached_reference_data(connection, table)
+    except (QueryRejected, Error) as e:
+        return fetch_failed(e)
+
+
+def estimate_size(obj, seen=None):
+    # Deep size in bytes; DataFrames and Series are measured by pandas
+    seen = set() if seen is None else seen
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    if isinstance(obj, (pd.DataFrame, pd.Series)):
+        usage = obj.memory_usage(deep=True)
+        return int(usage.sum() if isinstance(obj, pd.DataFrame) else usage)
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(estimate_size(k, seen) + estimate_size(v, seen) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum(estimate_size(item, seen) for item in obj)
+    return size
+
+
+def session_memory_report():
+    rows = []
+    for user, namespaces in st.session_state.get("user_caches", {}).items():
+        for namespace, cache in namespaces.items():
+            rows.append({"User": user, "Namespace": namespace, "Entries": len(cache), "Bytes": estimate_size(cache)})
+    for key in st.session_state:
+        if key != "user_caches":
+            rows.append({"User": "(widgets)", "Namespace": key, "Entries": 1, "Bytes": estimate_size(st.session_state[key])})
+    return pd.DataFrame(rows, columns=["User", "Namespace", "Entries", "Bytes"])
+
+
+def user_sidebar():
+    st.sidebar.text_input("User", key="user_name")
+    role = st.sidebar.selectbox("Role", list(USER_ROLES), key="user_role")
+
+    with st.sidebar.expander("Recently Viewed"):
+        for namespace in ("product", "supplier"):
+            for key, label in recently_viewed(namespace):
+                st.write(f"{namespace.title()} {key}: {label}")
+    return USER_ROLES[role]
+
+
+# Fragments: page sections that rerun on their own when one of their widgets changes,
+# instead of rerunning main() and every query on the page. A fragment-only rerun comes
+# after main() has closed its connection, so fragments go through fragment_connection().
+# Run times of full page runs and of each fragment are kept per process for Diagnostics.
+RERUN_TIMING_SAMPLES = 200
+
+
+@st.cache_resource
+def rerun_timings():
+    return {"lock": threading.Lock(), "samples": {}}
+
+
+def record_rerun(scope, elapsed_ms):
+    timings = rerun_timings()
+    with timings["lock"]:
+        timings["samples"].setdefault(scope, deque(maxlen=RERUN_TIMING_SAMPLES)).append(elapsed_ms)
+
+
+def rerun_report():
+    timings = rerun_timings()
+    with timings["lock"]:
+        samples = {scope: list(values) for scope, values in timings["samples"].items()}
+    rows = [
+        {
+            "Scope": scope,
+            "Runs": len(values),
+            "MedianMs": float(np.median(values)),
+            "P95Ms": float(np.percentile(values, 95)),
+            "MaxMs": max(values),
+        }
+        for scope, values in sorted(samples.items())
+    ]
+    return pd.DataFrame(rows, columns=["Scope", "Runs", "MedianMs", "P95Ms", "MaxMs"])
+
+
+def page_fragment(name):
+    def decorate(render):
+        @st.fragment
+        @wraps(render)
+        def run(*args, **kwargs):
+            started = time.perf_counter()
+            outer_scope = getattr(page_scope, "name", None)
+            page_scope.name, page_scope.user = f"Fragment: {name}", current_user()
+            try:
+                return render(*args, **kwargs)
+            finally:
+                page_scope.name = outer_scope
+                record_rerun(f"Fragment: {name}", (time.perf_counter() - started) * 1000)
+        return run
+    return decorate
+
+
+@contextmanager
+def fragment_connection(connection):
+    # The page's connection during a full run, a pooled one for a fragment-only rerun
+    if not connection.closed:
+        yield connection
+        return
+    connection = ConnectionRouter(pooled_connection(), REPLICA_CONFIGS)
+    try:
+        yield connection
+    finally:
+        connection.close()
+
+
+def place_order(cursor, supplier_id, order_date, status, lines, strategy="Greedy"):
+    # lines is a list of (ProductID, Quantity, Price); returns the new OrderID and its
+    # allocations as JSON-serialisable lists, for run_idempotent to store
+    query_order = """
+        INSERT INTO `Order` (SupplierID, OrderDate, Status)
+        VALUES (%s, %s, %s)
+    """
+    cursor.execute(query_order, (supplier_id, order_date, status))
+    order_id = cursor.lastrowid  # Get the last inserted OrderID
+
+    # Insert into OrderItem table
+    query_order_item = """
+        INSERT INTO OrderItem (OrderID, ProductID, Quantity, Price)
+        VALUES (%s, %s, %s, %s)
+    """
+    cursor.executemany(
+        query_order_item,
+        [(order_id, int(product_id), int(quantity), float(price)) for product_id, quantity, price in lines],
+    )
+
+    # Reserve stock location by location through the inventory ledger
+    items = [(product_id, quantity) for product_id, quantity, _ in lines]
+    allocations = reserve_stock(cursor, items, order_id, strategy)
+    return order_id, [[int(value) for value in allocation] for allocation in allocations]
+
+
+def add_order(connection):
+    st.header("Add Order")
+
+    # Input fields for Order
+    supplier_id = st.number_input("Supplier ID", min_value=1, step=1)
+    order_date = st.date_input("Order Date")
+    status = st.selectbox("Order Status", ["Pending", "Shipped", "Delivered"])
+
+    # Input fields for Order Items
+    st.subheader("Order Items")
+    order_lines = st.data_editor(
+        pd.DataFrame({"ProductID": [1], "Quantity": [1], "Price": [0.0]}),
+        num_rows="dynamic",
+        column_config={
+            "ProductID": st.column_config.NumberColumn("Product ID", min_value=1, step=1, required=True),
+            "Quantity": st.column_config.NumberColumn("Quantity", min_value=1, step=1, required=True),
+            "Price": st.column_config.NumberColumn("Price per Unit", min_value=0.0, step=0.01, required=True),
+        },
+        use_container_width=True,
+        key="order_lines",
+    )
+    strategy = st.radio("Location Allocation", ALLOCATION_STRATEGIES, horizontal=True)
+
+    if st.button("Add Order"):
+        order_lines = order_lines.dropna()
+        if order_lines.empty:
+            st.error("Please add at least one order item.")
+            return
+        key = request_key("add_order", [supplier_id, order_date, status, strategy, order_lines.to_dict("records")])
+        lines = [(line.ProductID, line.Quantity, line.Price) for line in order_lines.itertuples()]
+
+        try:
+            (order_id, allocations), replayed = run_idempotent(
+                connection,
+                key,
+                "add_order",
+                lambda cursor: place_order(cursor, supplier_id, order_date, status, lines, strategy),
+            )
+            if replayed:
+                st.info(f"This order was already placed as Order {order_id}; nothing was added again.")
+            else:
+                st.success(f"Order {order_id} added successfully and inventory updated!")
+            st.write("Stock allocated from:")
+            st.dataframe(
+                pd.DataFrame(allocations, columns=["ProductID", "LocationID", "Quantity"]),
+                use_container_width=True,
+            )
+        except (InsufficientStock, IdempotencyConflict) as e:
+            st.error(f"Order not placed: {e}")
+        except Error as e:
+            st.error(f"Error adding order or updating inventory: {e}")
+
+    if st.button("Start New Order", help="Submit the same order lines again as a separate order"):
+        new_request("add_order")
+
+
+# Function to convert incompatible types (datetime.date, decimal.Decimal)
+def convert_types(record):
+    for key, value in record.items():
+        if isinstance(value, datetime):
+            continue
+        if isinstance(value, date):  # Convert date to datetime
+            record[key] = datetime.combine(value, datetime.min.time())
+        elif isinstance(value, Decimal):  # Convert Decimal to float
+            record[key] = float(value)
+    return record
+
+
+def archive_and_delete_order(connection, mongodb, order_id):
+    # Copies the order, its items and shipments to MongoDB, then deletes them from MySQL in one
+    # transaction. The archive document is keyed by OrderID, so a retry after a failed delete
+    # replaces it rather than adding a second copy. Returns False when the order does not exist.
+    return run_in_transaction(connection, lambda cursor: archive_order_rows(connection, cursor, mongodb, order_id))
+
+
+def archive_order_rows(connection, cursor, mongodb, order_id):
+    reader = connection.cursor(dictionary=True)
+
+    # Fetch order details before deletion, locking the order until it is gone
+    reader.execute("SELECT * FROM `Order` WHERE OrderID = %s FOR UPDATE", (order_id,))
+    order_data_dict = reader.fetchall()
+    if not order_data_dict:
+        return False
+
+    # Fetch associated order items
+    reader.execute("SELECT * FROM `OrderItem` WHERE OrderID = %s", (order_id,))
+    order_items_data_dict = reader.fetchall()
+
+    # Fetch associated shipment details
+    reader.execute("SELECT * FROM `Shipment` WHERE OrderID = %s", (order_id,))
+    shipment_data_dict = reader.fetchall()
+
+    # Prepare data for MongoDB
+    converted_order = [convert_types(record) for record in order_data_dict]
+    converted_items = [convert_types(record) for record in order_items_data_dict]
+    converted_shipments = [convert_types(record) for record in shipment_data_dict]
+
+    # Insert the deleted order, items, and shipments into MongoDB
+    order_history = {
+        "Order": converted_order,
+        "OrderItems": converted_items,
+        "Shipments": converted_shipments,
+        "DeletedAt": datetime.now().isoformat()
+    }
+    mongodb["deleted_order"].replace_one({"_id": int(order_id)}, order_history, upsert=True)
+
+    # Delete associated rows from Shipment table
+    delete_shipment_query = "DELETE FROM `Shipment` WHERE OrderID = %s"
+    cursor.execute(delete_shipment_query, (order_id,))
+
+    # Verify rows are deleted from Shipment
+    cursor.execute("SELECT COUNT(*) FROM `Shipment` WHERE OrderID = %s", (order_id,))
+    remaining_shipments = cursor.fetchone()[0]
+    if remaining_shipments > 0:
+        raise Exception("Failed to delete associated rows from `Shipment`.")
+
+    # Delete associated rows from OrderItem table
+    delete_order_items_query = "DELETE FROM `OrderItem` WHERE OrderID = %s"
+    cursor.execute(delete_order_items_query, (order_id,))
+
+    # Verify rows are deleted from OrderItem
+    cursor.execute("SELECT COUNT(*) FROM `OrderItem` WHERE OrderID = %s", (order_id,))
+    remaining_items = cursor.fetchone()[0]
+    if remaining_items > 0:
+        raise Exception("Failed to delete associated rows from `OrderItem`.")
+
+    # Return any stock still reserved for the order
+    release_order_stock(cursor, order_id)
+
+    # Delete the order from the Order table
+    delete_order_query = "DELETE FROM `Order` WHERE OrderID = %s"
+    cursor.execute(delete_order_query, (order_id,))
+    return True
+
+
+def delete_order(connection, mongodb):
+    st.header("Delete Order")
+
+    # Input field for Order ID
+    order_id = st.number_input("Enter Order ID to Delete", min_value=1, step=1)
+
+    if st.button("Delete Order"):
+        try:
+            if archive_and_delete_order(connection, mongodb, order_id):
+                st.success(f"Order {order_id} and its associated items and shipments were deleted successfully and recorded in MongoDB.")
+            else:
+                st.warning(f"Order ID {order_id} not found.")
+        except Error as e:
+            connection.rollback()
+            st.error(f"Error deleting order from MySQL: {e}")
+        except Exception as e:
+            connection.rollback()
+            st.error(f"Error interacting with MongoDB or cleaning up dependencies: {e}")
+
+
+@page_fragment("Stock Availability")
+def check_stock_availability(connection):
+    st.header("Check Stock Availability")
+    product_id = st.number_input("Enter Product ID", min_value=1, step=1)
+    required_quantity = st.number_input("Enter Required Quantity", min_value=1, step=1)
+
+    if st.button("Check Availability"):
+        query = f"""
+            SELECT 
+                Product.ProductName, 
+                Inventory.Quantity + COALESCE(Pending.Delta, 0) AS AvailableStock, 
+                Location.LocationName, 
+                Location.Address
+            FROM Inventory
+            LEFT JOIN ({PENDING_MOVEMENTS_SUBQUERY}) AS Pending
+                ON Pending.ProductID = Inventory.ProductID AND Pending.LocationID = Inventory.LocationID
+            LEFT JOIN Product ON Inventory.ProductID = Product.ProductID
+            LEFT JOIN Location ON Inventory.LocationID = Location.LocationID
+            WHERE Inventory.ProductID = %s
+        """
+        try:
+            with fragment_connection(connection) as live:
+                stock_df = run_statement(live, "stock_by_product", query, (product_id,))
+        except Error as e:
+            st.error(f"Error fetching stock: {e}")
+            return
+
+        if not stock_df.empty:
+            session_cache_put("product", product_id, stock_df["ProductName"].iloc[0])
+            total_stock = stock_df['AvailableStock'].sum()
+            sufficient_stock = total_stock >= required_quantity
+
+            st.write("Stock Details:")
+            st.dataframe(stock_df)
+
+            st.write(f"Total Available Stock: **{total_stock}**")
+            if sufficient_stock:
+                st.success("Sufficient stock is available.")
+            else:
+                st.error("Insufficient stock.")
+        else:
+            st.warning("Product not found in inventory.")
+
+
+# Track Order
+def track_order(connection):
+    st.header("Track Order")
+
+    # Input field for Order ID
+    order_id = st.number_input("Enter Order ID to Track", min_value=1, step=1)
+
+    if st.button("Track Order"):
+        try:
+            # Query to fetch Shipment details for the order
+            query = """
+                SELECT 
+                    Shipment.ShipmentID, 
+                    Shipment.ShipmentDate, 
+                    Shipment.TrackingNumber, 
+                    `Order`.Status
+                FROM Shipment
+                LEFT JOIN `Order` ON Shipment.OrderID = `Order`.OrderID
+                WHERE `Order`.OrderID = %s
+            """
+            shipment_data = run_statement(connection, "order_shipments", query, (order_id,))
+
+            if not shipment_data.empty:
+                st.write("Order Shipment Details:")
+                st.dataframe(shipment_data, use_container_width=True)
+            else:
+                st.warning("No shipment details found for the given Order ID.")
+        except Error as e:
+            st.error(f"Error fetching shipment details: {e}")
+
+def fetch_order_working_set(connection, order_id):
+    # Fetch order details from the database
+    query_order = """
+        SELECT OrderID, SupplierID, OrderDate, Status, Version
+        FROM `Order`
+        WHERE OrderID = %s
+    """
+    order_data = run_statement(connection, "order_by_id", query_order, (order_id,))
+    if order_data.empty:
+        return None
+
+    # Fetch associated Order Items
+    query_items = """
+        SELECT OrderItemID, ProductID, Quantity, Price, Version
+        FROM OrderItem
+        WHERE OrderID = %s
+    """
+    items_data = run_statement(connection, "order_items_by_order", query_items, (order_id,))
+
+    working_set = {"details": order_data.iloc[0], "items": items_data, "fetched_at": time.time()}
+    session_cache_put("order", order_id, working_set)
+    return working_set
+
+def modify_order(connection):
+    st.header("Modify Order")
+
+    # Input to select Order ID
+    order_id = st.number_input("Enter Order ID to Modify", min_value=1, step=1)
+
+    # Fetch Order Details, reusing this user's working copy unless a reload is requested
+    fetch = st.button("Fetch Order Details")
+    reload = st.button("Reload from Database")
+    if fetch or reload:
+        working_set = None if reload else session_cache_get("order", order_id)
+        if working_set is not None:
+            # Drop the working copy if the change feed saw the order or its items change since
+            bus, _ = change_feed()
+            if bus.changed_since("Order", (order_id,), working_set["fetched_at"]):
+                working_set = None
+        if working_set is None:
+            try:
+                working_set = fetch_order_working_set(connection, order_id)
+                if working_set is None:
+                    st.warning("Order ID not found.")
+            except Error as e:
+                st.error(f"Error fetching order details: {e}")
+
+        if working_set is not None:
+            session_cache_put("current", "order", order_id)
+            supplier = working_set["details"]["SupplierID"]
+            session_cache_put("supplier", int(supplier), f"Supplier {supplier}")
+
+    # Header, item grid and stock panel rerun on their own; only their save buttons write
+    current_order_id = session_cache_get("current", "order")
+    if current_order_id is not None and session_cache_get("order", current_order_id) is not None:
+        order_header_form(connection, current_order_id)
+        order_items_grid(connection, current_order_id)
+        order_stock_panel(connection, current_order_id)
+
+
+def order_working_set(order_id):
+    working_set = session_cache_get("order", order_id)
+    if working_set is None:
+        st.info("Fetch the order again to keep editing it.")
+    return working_set
+
+
+@page_fragment("Order Header")
+def order_header_form(connection, order_id):
+    working_set = order_working_set(order_id)
+    if working_set is None:
+        return
+    order_details = working_set["details"]
+    st.write(f"**Order Details (Order {order_details['OrderID']}):**")
+
+    supplier_id = st.number_input(
+        "Supplier ID", value=order_details["SupplierID"], step=1, key=f"supplier_id_{order_id}"
+    )
+    order_date = st.date_input(
+        "Order Date", value=pd.to_datetime(order_details["OrderDate"]), key=f"order_date_{order_id}"
+    )
+    status = st.selectbox(
+        "Order Status",
+        ORDER_STATUSES,
+        index=ORDER_STATUSES.index(order_details["Status"]),
+        key=f"order_status_{order_id}",
+    )
+
+    # Update Order Details Button
+    if st.button("Update Order Details"):
+        def update_order(cursor):
+            query_update_order = """
+                UPDATE `Order`
+                SET SupplierID = %s, OrderDate = %s, Status = %s, Version = Version + 1
+                WHERE OrderID = %s AND Version = %s
+            """
+            cursor.execute(
+                query_update_order,
+                (
+                    int(supplier_id),
+                    order_date,
+                    status,
+                    int(order_details["OrderID"]),
+                    int(order_details["Version"]),
+                ),
+            )
+            if cursor.rowcount != 1:
+                raise ConcurrencyConflict(
+                    f"Order {order_details['OrderID']} was changed by another user. "
+                    "Fetch it again before saving."
+                )
+
+        try:
+            with fragment_connection(connection) as live:
+                run_in_transaction(live, update_order)
+            order_details["Version"] += 1
+            order_details["SupplierID"], order_details["OrderDate"], order_details["Status"] = (
+                supplier_id, order_date, status
+            )
+            st.success("Order details updated successfully!")
+        except ConcurrencyConflict as e:
+            session_cache_drop("order", order_id)
+            st.warning(str(e))
+        except Error as e:
+            st.error(f"Error updating order details: {e}")
+
+
+ORDER_ITEM_COLUMNS = ["ProductID", "Quantity", "Price"]
+
+
+def update_order_items(cursor, order_id, items, restocked_products):
+    # items are edited OrderItem records with the Version they were read at; the stock
+    # of restocked_products is re-reserved for the order's new lines
+    query_update_item = """
+        UPDATE OrderItem
+        SET ProductID = %s, Quantity = %s, Price = %s, Version = Version + 1
+        WHERE OrderItemID = %s AND Version = %s
+    """
+    for item in items:
+        cursor.execute(
+            query_update_item,
+            (
+                int(item["ProductID"]),
+                int(item["Quantity"]),
+                item["Price"],
+                int(item["OrderItemID"]),
+                int(item["Version"]),
+            ),
+        )
+        if cursor.rowcount != 1:
+            raise ConcurrencyConflict(
+                f"Order item {item['OrderItemID']} was changed by another user. "
+                "Fetch the order again before saving."
+            )
+    rereserve_order_stock(cursor, order_id, restocked_products)
+
+
+@page_fragment("Order Items")
+def order_items_grid(connection, order_id):
+    working_set = order_working_set(order_id)
+    if working_set is None or working_set["items"] is None or working_set["items"].empty:
+        return
+    items_data = working_set["items"]
+    st.write("**Order Items:**")
+
+    # Edits stay in the grid's widget state until saved; a refetch starts a fresh grid
+    grid = items_data[["OrderItemID"] + ORDER_ITEM_COLUMNS].astype({"Price": float})
+    edited = st.data_editor(
+        grid,
+        key=f"order_items_{order_id}_{working_set['fetched_at']}",
+        hide_index=True,
+        num_rows="fixed",
+        disabled=["OrderItemID"],
+        column_config={
+            "ProductID": st.column_config.NumberColumn(min_value=1, step=1),
+            "Quantity": st.column_config.NumberColumn(min_value=1, step=1),
+            "Price": st.column_config.NumberColumn(min_value=0.0, step=0.01, format="%.2f"),
+        },
+        use_container_width=True,
+    )
+    changed = (edited[ORDER_ITEM_COLUMNS] != grid[ORDER_ITEM_COLUMNS]).any(axis=1)
+    st.caption(f"{int(changed.sum())} of {len(grid)} items changed")
+
+    # Update Order Items Button
+    if st.button("Update Order Items", disabled=not changed.any()):
+        if edited.loc[changed, ORDER_ITEM_COLUMNS].isna().any(axis=None):
+            st.warning("Every item needs a product, quantity and price.")
+            return
+        updated_items = edited[changed].assign(Version=items_data.loc[changed, "Version"]).to_dict("records")
+        # Products whose reserved stock moves: the old and new product of every line
+        # whose product or quantity changed
+        restocked = (edited[["ProductID", "Quantity"]] != grid[["ProductID", "Quantity"]]).any(axis=1)
+        restocked_products = set(grid.loc[restocked, "ProductID"]) | set(edited.loc[restocked, "ProductID"])
+
+        try:
+            with fragment_connection(connection) as live:
+                run_in_transaction(
+                    live, lambda cursor: update_order_items(cursor, order_id, updated_items, restocked_products)
+                )
+            items_data.loc[changed, "Version"] += 1
+            for column in ORDER_ITEM_COLUMNS:
+                items_data.loc[changed, column] = edited.loc[changed, column]
+            st.success(f"{len(updated_items)} order items updated successfully!")
+        except ConcurrencyConflict as e:
+            session_cache_drop("order", order_id)
+            st.warning(str(e))
+        except InsufficientStock as e:
+            st.error(f"Order items not updated: {e}")
+        except Error as e:
+            st.error(f"Error updating order items: {e}")
+
+
+@page_fragment("Order Stock")
+def order_stock_panel(connection, order_id):
+    working_set = order_working_set(order_id)
+    if working_set is None or working_set["items"] is None or working_set["items"].empty:
+        return
+    st.write("**Stock for Order Items:**")
+    if st.button("Check Stock for Items"):
+        items = working_set["items"].groupby("ProductID", as_index=False)["Quantity"].sum()
+        placeholders = ", ".join(["%s"] * len(items))
+        query = f"""
+            SELECT 
+                Inventory.ProductID, 
+                SUM(Inventory.Quantity + COALESCE(Pending.Delta, 0)) AS AvailableStock
+            FROM Inventory
+            LEFT JOIN ({PENDING_MOVEMENTS_SUBQUERY}) AS Pending
+                ON Pending.ProductID = Inventory.ProductID AND Pending.LocationID = Inventory.LocationID
+            WHERE Inventory.ProductID IN ({placeholders})
+            GROUP BY Inventory.ProductID
+        """
+        try:
+            with fragment_connection(connection) as live:
+                stock = fetch_table_data(live, query, tuple(int(product) for product in items["ProductID"]))
+        except Error as e:
+            st.error(f"Error fetching stock: {e}")
+            return
+        if stock.empty:
+            stock = pd.DataFrame(columns=["ProductID", "AvailableStock"])
+        panel = items.merge(stock.astype({"AvailableStock": float}), on="ProductID", how="left").fillna({"AvailableStock": 0})
+        panel["Sufficient"] = panel["AvailableStock"] >= panel["Quantity"]
+        st.dataframe(panel, hide_index=True, use_container_width=True)
+
+
+# Change-data capture: row changes for CDC_TABLES are published in batches on a
+# process-wide ChangeEventBus. The binlog reader (python-mysql-replication) gives
+# exact inserts/updates/deletes; the polling fallback walks (UpdatedAt, primary key)
+# watermarks and reports every change as an upsert (it cannot see deletes).
+CDC_TABLES = {
+    "Inventory": ("ProductID", "LocationID"),
+    "Order": ("OrderID",),
+    "OrderItem": ("OrderItemID",),
+    "Sales": ("SalesID",),
+    "Discount": ("DiscountID",),
+    "Shipment": ("ShipmentID",),
+    "InventoryMovement": ("MovementID",),
+}
+CDC_MODE = os.environ.get("INVENTORY_CDC_MODE", "poll")  # "binlog", "poll" or "off"
+CDC_SERVER_ID = int(os.environ.get("INVENTORY_CDC_SERVER_ID", "4201"))
+CDC_POLL_INTERVAL = 2  # seconds
+CDC_POLL_LAG = 1  # seconds; rows newer than this may still belong to uncommitted transactions
+# UpdatedAt is when the statement ran, not when its transaction committed, so a row can
+# become visible with an UpdatedAt the watermark has already passed. Every poll re-reads
+# this window behind the watermark and publishes rows it has not seen. It covers the
+# longest write transaction: an ILP allocation plus lock waits of a few statements
+# (InnoDB's innodb_lock_wait_timeout, 50 s by default), run under FOR UPDATE.
+INNODB_LOCK_WAIT_TIMEOUT = 50  # seconds
+CDC_POLL_OVERLAP = ILP_TIME_LIMIT + 3 * INNODB_LOCK_WAIT_TIMEOUT  # seconds
+CDC_BATCH_SIZE = 1000
+CDC_CHANGE_LOG_SIZE = 50000  # remembered (table, key) -> last change time entries
+
+
+def ensure_index(connection, table, name, columns):
+    cursor = connection.cursor()
+    cursor.execute(
+        """
+            SELECT COUNT(*)
+            FROM INFORMATION_SCHEMA.STATISTICS
+            WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND INDEX_NAME = %s
+        """,
+        (table, name),
+    )
+    if cursor.fetchone()[0] == 0:
+        column_list = ", ".join(f"`{column}`" for column in columns)
+        cursor.execute(f"ALTER TABLE `{table}` ADD INDEX `{name}` ({column_list})")
+        connection.commit()
+
+
+def setup_change_capture(connection):
+    for table, key in CDC_TABLES.items():
+        ensure_column(
+            connection,
+            table,
+            "UpdatedAt",
+            "TIMESTAMP(6) NOT NULL DEFAULT CURRENT_TIMESTAMP(6) ON UPDATE CURRENT_TIMESTAMP(6)",
+        )
+        ensure_index(connection, table, f"idx_{table.lower()}_updated", ("UpdatedAt",) + key)
+
+
+class ChangeEventBus:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.subscribers = {}
+        self.errors = {}
+        self.event_counts = {}
+        self.last_changed = OrderedDict()
+
+    def subscribe(self, name, tables, callback):
+        # Subscribing again under the same name replaces the callback, so script reruns are harmless
+        with self.lock:
+            self.subscribers[name] = (set(tables), callback)
+
+    def publish(self, events):
+        if not events:
+            return
+        now = time.time()
+        with self.lock:
+            for event in events:
+                self.event_counts[event["table"]] = self.event_counts.get(event["table"], 0) + 1
+                self.last_changed[(event["table"], event["key"])] = now
+                self.last_changed.move_to_end((event["table"], event["key"]))
+                if event["table"] == "OrderItem":
+                    order_key = ("Order", (event["row"]["OrderID"],))
+                    self.last_changed[order_key] = now
+                    self.last_changed.move_to_end(order_key)
+            while len(self.last_changed) > CDC_CHANGE_LOG_SIZE:
+                self.last_changed.popitem(last=False)
+            subscribers = list(self.subscribers.items())
+
+        for name, (tables, callback) in subscribers:
+            batch = [event for event in events if event["table"] in tables]
+            if not batch:
+                continue
+            try:
+                callback(batch)
+            except Exception as e:
+                # One failing consumer must not stall the feed for the others
+                self.errors[name] = f"{datetime.now():%Y-%m-%d %H:%M:%S} {e}"
+
+    def changed_since(self, table, key, since):
+        return self.last_changed.get((table, key), 0) > since
+
+
+class ChangeDataCapture(threading.Thread):
+    def __init__(self, bus, mode=CDC_MODE):
+        super().__init__(name="change-data-capture", daemon=True)
+        self.bus = bus
+        self.mode = mode
+        self.stop_event = threading.Event()
+        self.watermarks = {}
+        self.recent = {}  # table -> {(key, UpdatedAt)} published within CDC_POLL_OVERLAP of the watermark
+        self.last_event_at = None
+        self.last_error = None
+
+    def run(self):
+        while not self.stop_event.is_set():
+            try:
+                if self.mode == "binlog":
+                    self.stream_binlog()
+                else:
+                    self.poll()
+            except Exception as e:
+                self.last_error = f"{datetime.now():%Y-%m-%d %H:%M:%S} {e}"
+                self.stop_event.wait(CDC_POLL_INTERVAL * 5)
+
+    def publish(self, events):
+        if events:
+            self.last_event_at = time.time()
+            self.bus.publish(events)
+
+    def stream_binlog(self):
+        from pymysqlreplication import BinLogStreamReader
+        from pymysqlreplication.row_event import DeleteRowsEvent, UpdateRowsEvent, WriteRowsEvent
+
+        settings = {
+            "host": DATABASE_CONFIG["host"],
+            "port": DATABASE_CONFIG.get("port", 3306),
+            "user": DATABASE_CONFIG["user"],
+            "passwd": DATABASE_CONFIG["password"],
+        }
+        stream = BinLogStreamReader(
+            connection_settings=settings,
+            server_id=CDC_SERVER_ID,
+            only_schemas=[DATABASE_CONFIG["database"]],
+            only_tables=list(CDC_TABLES),
+            only_events=[WriteRowsEvent, UpdateRowsEvent, DeleteRowsEvent],
+            blocking=False,
+            resume_stream=True,
+            log_file=self.watermarks.get("log_file"),
+            log_pos=self.watermarks.get("log_pos"),
+        )
+        try:
+            while not self.stop_event.is_set():
+                for event in stream:
+                    key_columns = CDC_TABLES[event.table]
+                    events = []
+                    for row in event.rows:
+                        if isinstance(event, WriteRowsEvent):
+                            op, before, after = "insert", None, row["values"]
+                        elif isinstance(event, UpdateRowsEvent):
+                            op, before, after = "update", row["before_values"], row["after_values"]
+                        else:
+                            op, before, after = "delete", row["values"], row["values"]
+                        events.append(
+                            {
+                                "table": event.table,
+                                "op": op,
+                                "key": tuple(after[column] for column in key_columns),
+                                "row": after,
+                                "before": before,
+                            }
+                        )
+                    self.publish(events)
+                    self.watermarks["log_file"], self.watermarks["log_pos"] = stream.log_file, stream.log_pos
+                    if self.stop_event.is_set():
+                        break
+                self.stop_event.wait(CDC_POLL_INTERVAL)
+        finally:
+            stream.close()
+
+    def poll(self):
+        connection = open_connection(autocommit=True)
+        try:
+            cursor = connection.cursor(dictionary=True)
+            for table, key_columns in CDC_TABLES.items():
+                if table not in self.watermarks:
+                    # Start from the current tail; consumers bootstrap from full queries
+                    order_by = ", ".join(f"`{column}` DESC" for column in key_columns)
+                    cursor.execute(f"SELECT * FROM `{table}` ORDER BY `UpdatedAt` DESC, {order_by} LIMIT 1")
+                    row = cursor.fetchone()
+                    self.watermarks[table] = (
+                        (row["UpdatedAt"],) + tuple(row[column] for column in key_columns) if row else None
+                    )
+                    # Rows already behind the starting point are the consumers' bootstrap, not news
+                    self.rescan_overlap(cursor, table, key_columns, publish=False)
+
+            while not self.stop_event.is_set():
+                for table, key_columns in CDC_TABLES.items():
+                    self.poll_table(cursor, table, key_columns)
+                self.stop_event.wait(CDC_POLL_INTERVAL)
+        finally:
+            connection.close()
+
+    def poll_table(self, cursor, table, key_columns):
+        columns = ("UpdatedAt",) + key_columns
+        column_list = ", ".join(f"`{column}`" for column in columns)
+        while True:
+            watermark = self.watermarks[table]
+            query = f"SELECT * FROM `{table}` WHERE `UpdatedAt` <= NOW(6) - INTERVAL {CDC_POLL_LAG} SECOND"
+            params = ()
+            if watermark is not None:
+                placeholders = ", ".join(["%s"] * len(columns))
+                query += f" AND ({column_list}) > ({placeholders})"
+                params = watermark
+            query += f" ORDER BY {column_list} LIMIT {CDC_BATCH_SIZE}"
+            cursor.execute(query, params)
+            rows = cursor.fetchall()
+            if rows:
+                self.publish_rows(table, key_columns, rows)
+                self.watermarks[table] = tuple(rows[-1][column] for column in columns)
+            if len(rows) < CDC_BATCH_SIZE:
+                break
+        self.rescan_overlap(cursor, table, key_columns)
+
+    def publish_rows(self, table, key_columns, rows, publish=True):
+        recent = self.recent.setdefault(table, set())
+        events = []
+        for row in rows:
+            key = tuple(row[column] for column in key_columns)
+            recent.add((key, row["UpdatedAt"]))
+            events.append({"table": table, "op": "upsert", "key": key, "row": row, "before": None})
+        if publish:
+            self.publish(events)
+
+    def rescan_overlap(self, cursor, table, key_columns, publish=True):
+        # Late commits: rows behind the watermark, within the overlap, not published yet
+        watermark = self.watermarks[table]
+        if watermark is None:
+            return
+        since = watermark[0] - timedelta(seconds=CDC_POLL_OVERLAP)
+        recent = self.recent.setdefault(table, set())
+        recent.difference_update([seen for seen in recent if seen[1] < since])
+
+        columns = ("UpdatedAt",) + key_columns
+        column_list = ", ".join(f"`{column}`" for column in columns)
+        placeholders = ", ".join(["%s"] * len(columns))
+        cursor.execute(
+            f"SELECT * FROM `{table}` WHERE `UpdatedAt` >= %s AND ({column_list}) <= ({placeholders})",
+            (since,) + tuple(watermark),
+        )
+        late = [
+            row for row in cursor.fetchall()
+            if (tuple(row[column] for column in key_columns), row["UpdatedAt"]) not in recent
+        ]
+        if late:
+            self.publish_rows(table, key_columns, late, publish)
+
+
+def replicate_current_orders(events):
+    # Keeps db.current_orders in Mongo as one document per order with its items embedded
+    from pymongo import DeleteOne, UpdateOne
+
+    operations = []
+    for event in events:
+        row = convert_types(dict(event["row"]))
+        row.pop("UpdatedAt", None)
+        if event["table"] == "Order":
+            if event["op"] == "delete":
+                operations.append(DeleteOne({"_id": row["OrderID"]}))
+            else:
+                operations.append(UpdateOne({"_id": row["OrderID"]}, {"$set": row}, upsert=True))
+        else:
+            operations.append(
+                UpdateOne({"_id": row["OrderID"]}, {"$pull": {"Items": {"OrderItemID": row["OrderItemID"]}}})
+            )
+            if event["op"] != "delete":
+                operations.append(UpdateOne({"_id": row["OrderID"]}, {"$push": {"Items": row}}, upsert=True))
+
+    if operations:
+        mongo_client()["inventory_db"]["current_orders"].bulk_write(operations, ordered=True)
+
+
+@st.cache_resource
+def change_feed():
+    bus = ChangeEventBus()
+    if ARCHIVE_BACKEND == "mongodb":
+        bus.subscribe("mongo-current-orders", ("Order", "OrderItem"), replicate_current_orders)
+    capture = None
+    if CDC_MODE != "off":
+        capture = ChangeDataCapture(bus)
+        capture.start()
+    return bus, capture
+
+
+def change_feed_status():
+    st.header("Change Feed")
+
+    bus, capture = change_feed()
+    st.write(f"**Mode:** {CDC_MODE}")
+    if capture is None:
+        st.info("Change capture is turned off (INVENTORY_CDC_MODE=off).")
+        return
+
+    if capture.last_event_at:
+        st.write(f"**Last event:** {time.time() - capture.last_event_at:.1f} s ago")
+    if capture.last_error:
+        st.error(f"Last capture error: {capture.last_error}")
+
+    st.write("Events per table:")
+    st.dataframe(
+        pd.DataFrame(sorted(bus.event_counts.items()), columns=["Table", "Events"]),
+        use_container_width=True,
+    )
+    st.write("Subscribers:")
+    st.dataframe(
+        pd.DataFrame(
+            [
+                {"Subscriber": name, "Tables": ", ".join(sorted(tables)), "LastError": bus.errors.get(name, "")}
+                for name, (tables, _) in bus.subscribers.items()
+            ]
+        ),
+        use_container_width=True,
+    )
+
+
+# Audit log: every write to AUDITED_TABLES that runs through run_in_transaction() is
+# recorded with its row before and after, the user and the page it came from.
+# AuditCursor wraps the transaction's cursor: UPDATE and DELETE read the rows they are
+# about to change by the statement's own WHERE clause (locking them, as the write
+# would), UPDATE and single-row INSERT read the result back by primary key, and
+# executemany() INSERT batches record the values they write without reading back.
+# On commit the records go to the AuditLog thread, which writes them every
+# AUDIT_FLUSH_INTERVAL as one gzip-compressed JSON-lines AuditSegment per hour plus
+# one AuditEntry index row per record (entity, user, time). Records still buffered
+# when the process is killed are lost; a normal exit flushes them.
+AUDITED_TABLES = dict(
+    CDC_TABLES,
+    Product=("ProductID",),
+    Supplier=("SupplierID",),
+    Customer=("CustomerID",),
+    Location=("LocationID",),
+    Category=("CategoryID",),
+    SalesAlert=("SourceTable", "SourceID", "AlertType"),
+    InventoryValuationCube=("SnapshotDate", "CategoryID", "LocationID", "SupplierID"),
+    CustomerSegment=("CustomerID",),
+)
+AUDIT_FLUSH_INTERVAL = 2  # seconds
+AUDIT_FLUSH_RECORDS = 1000  # flush early once this many records are buffered
+AUDIT_COMPRESSION_LEVEL = 6
+AUDIT_SEGMENT_CACHE = 64  # decompressed segments kept for the Audit Log page
+AUDIT_QUERY_LIMIT = 500
+# The updated table is the first after UPDATE; any JOIN before SET narrows the rows it touches
+AUDIT_UPDATE_PATTERN = re.compile(r"(?is)\s*UPDATE\s+`?(\w+)`?(.*?)\s+SET\s+.*?(?:\sWHERE\s+(.*))?$")
+AUDIT_DELETE_PATTERN = re.compile(r"(?is)\s*DELETE\s+FROM\s+`?(\w+)`?()\s+WHERE\s+(.*)")
+AUDIT_INSERT_PATTERN = re.compile(r"(?is)\s*INSERT\s+(IGNORE\s+)?INTO\s+`?(\w+)`?\s*\(([^)]*)\)\s*VALUES\s*\((.*)")
+
+
+def values_tuple(text):
+    # The comma-separated expressions of a VALUES (...) list, up to its closing parenthesis
+    tokens, depth, start = [], 0, 0
+    for position, char in enumerate(text):
+        if char == "(":
+            depth += 1
+        elif char == ")" and depth:
+            depth -= 1
+        elif char == ")" or (char == "," and depth == 0):
+            tokens.append(text[start:position].strip())
+            start = position + 1
+            if char == ")":
+                return tokens
+    return None
+
+
+@lru_cache(maxsize=512)
+def audited_statement(query):
+    # (operation, table, joins, WHERE clause, inserted columns, upsert) for a write to
+    # AUDITED_TABLES, None for anything else
+    match = AUDIT_UPDATE_PATTERN.match(query) or AUDIT_DELETE_PATTERN.match(query)
+    if match:
+        operation = "update" if match.re is AUDIT_UPDATE_PATTERN else "delete"
+        if match.group(1) in AUDITED_TABLES:
+            return operation, match.group(1), match.group(2).strip(), (match.group(3) or "").strip(), None, False
+        return None
+    match = AUDIT_INSERT_PATTERN.match(query)
+    if not match or match.group(2) not in AUDITED_TABLES:
+        return None
+    columns = [column.strip(" `\n\r\t") for column in match.group(3).split(",")]
+    tokens = values_tuple(match.group(4))
+    if tokens is None or len(tokens) != len(columns) or any("%s" in token and token != "%s" for token in tokens):
+        written = None  # values we cannot line up with their columns
+    else:
+        written = tuple(column for column, token in zip(columns, tokens) if token == "%s")
+    upsert = bool(match.group(1)) or bool(re.search(r"(?i)\bON\s+DUPLICATE\s+KEY\s+UPDATE\b", query))
+    return "insert", match.group(2), "", None, written, upsert
+
+
+@contextmanager
+def acting_as(user, name):
+    # Attributes writes made on this thread to another session's user and page
+    outer = getattr(page_scope, "user", None), getattr(page_scope, "name", None)
+    page_scope.user, page_scope.name = user, name
+    try:
+        yield
+    finally:
+        page_scope.user, page_scope.name = outer
+
+
+class AuditCursor:
+    def __init__(self, cursor, connection):
+        self.cursor = cursor
+        self.connection = connection
+        self.records = []
+        self.audit_ms = 0.0
+
+    def __getattr__(self, name):
+        return getattr(self.cursor, name)
+
+    def select(self, table, where, params, lock=False, joins=""):
+        reader = self.connection.cursor(dictionary=True)
+        reader.execute(
+            f"SELECT `{table}`.* FROM `{table}` {joins} WHERE {where or 'TRUE'}{' FOR UPDATE' if lock else ''}",
+            params,
+        )
+        return reader.fetchall()
+
+    def select_keys(self, table, keys, lock=False):
+        if not keys:
+            return []
+        match = "(" + " AND ".join(f"`{column}` = %s" for column in AUDITED_TABLES[table]) + ")"
+        return self.select(table, " OR ".join([match] * len(keys)), [value for key in keys for value in key], lock)
+
+    def record(self, table, before, after, operation=None):
+        key_columns = AUDITED_TABLES[table]
+
+        def key_of(row):
+            return tuple(row.get(column) for column in key_columns)
+
+        before = {key_of(row): row for row in before}
+        after = {key_of(row): row for row in after}
+        changed_at = datetime.now()
+        user, source = getattr(page_scope, "user", None) or "system", getattr(page_scope, "name", "Background")
+        for key in dict.fromkeys(list(before) + list(after)):
+            old, new = before.get(key), after.get(key)
+            if old == new:
+                continue  # matched but unchanged, e.g. an ignored INSERT IGNORE
+            self.records.append(
+                {
+                    "ChangedAt": changed_at,
+                    "User": user,
+                    "Source": source,
+                    "Table": table,
+                    "Key": "/".join("" if value is None else str(value) for value in key),
+                    "Operation": operation or ("insert" if old is None else "delete" if new is None else "update"),
+                    "Before": old,
+                    "After": new,
+                }
+            )
+
+    def execute(self, query, params=None):
+        statement = audited_statement(query)
+        if statement is None:
+            return self.cursor.execute(query, params)
+        operation, table, joins, where, written, upsert = statement
+        params = tuple(params or ())
+        started = time.perf_counter()
+        key_columns = AUDITED_TABLES[table]
+
+        # Every read here is a locking read: a plain SELECT would start the transaction's
+        # REPEATABLE READ snapshot, and later reads in it (stock checks in particular)
+        # would no longer see rows committed while it waited for a lock
+        if operation in ("update", "delete"):
+            # Joined tables take the statement's first parameters, the WHERE clause its last
+            where_params = params[:joins.count("%s")] + params[len(params) - where.count("%s"):]
+            before = self.select(table, where, where_params, lock=True, joins=joins)
+            run_started = time.perf_counter()
+            result = self.cursor.execute(query, params)
+            run_ms = (time.perf_counter() - run_started) * 1000
+            after = []
+            if operation == "update":
+                after = self.select_keys(table, [tuple(row[column] for column in key_columns) for row in before], lock=True)
+            self.record(table, before, after)
+        else:
+            values = dict(zip(written, params)) if written is not None else {}
+            keys = [tuple(values[column] for column in key_columns)] if all(column in values for column in key_columns) else []
+            before = self.select_keys(table, keys, lock=True) if keys and upsert else []
+            run_started = time.perf_counter()
+            result = self.cursor.execute(query, params)
+            run_ms = (time.perf_counter() - run_started) * 1000
+            if upsert:
+                after = self.select_keys(table, keys, lock=True) if keys else [values]
+            else:
+                # A plain insert wrote exactly its values; only a generated key needs filling in
+                if not keys and len(key_columns) == 1 and self.cursor.lastrowid:
+                    values = dict(values, **{key_columns[0]: self.cursor.lastrowid})
+                after = [values] if self.cursor.rowcount else []
+            self.record(table, before, after)
+        self.audit_ms += (time.perf_counter() - started) * 1000 - run_ms
+        return result
+
+    def executemany(self, query, seq_params):
+        statement = audited_statement(query)
+        if statement is None or (statement[0] == "insert" and statement[4] is None):
+            return self.cursor.executemany(query, seq_params)
+        operation, table, _, _, written, upsert = statement
+        seq_params = list(seq_params)
+        if operation != "insert":
+            for params in seq_params:
+                self.execute(query, params)
+            return None
+        result = self.cursor.executemany(query, seq_params)
+        started = time.perf_counter()
+        rows = [dict(zip(written, params)) for params in seq_params]
+        operation = "upsert" if upsert else "insert"
+        if all(column in written for column in AUDITED_TABLES[table]):
+            self.record(table, [], rows, operation)
+        else:
+            for row in rows:  # generated keys: one record per row rather than one per (missing) key
+                self.record(table, [], [row], operation)
+        self.audit_ms += (time.perf_counter() - started) * 1000
+        return result
+
+
+def setup_audit_log(connection):
+    cursor = connection.cursor()
+    cursor.execute(
+        """
+            CREATE TABLE IF NOT EXISTS AuditSegment (
+                SegmentID BIGINT AUTO_INCREMENT,
+                PeriodStart DATETIME NOT NULL,
+                FirstAt DATETIME(6) NOT NULL,
+                LastAt DATETIME(6) NOT NULL,
+                Records INT NOT NULL,
+                Payload MEDIUMBLOB NOT NULL,
+                PRIMARY KEY (SegmentID, PeriodStart),
+                INDEX idx_auditsegment_period (PeriodStart)
+            )
+        """
+    )
+    cursor.execute(
+        """
+            CREATE TABLE IF NOT EXISTS AuditEntry (
+                SegmentID BIGINT NOT NULL,
+                RecordIndex INT NOT NULL,
+                ChangedAt DATETIME(6) NOT NULL,
+                UserName VARCHAR(64) NOT NULL,
+                EntityTable VARCHAR(64) NOT NULL,
+                EntityKey VARCHAR(128) NOT NULL,
+                Operation VARCHAR(8) NOT NULL,
+                PRIMARY KEY (SegmentID, RecordIndex, ChangedAt),
+                INDEX idx_audit_entity (EntityTable, EntityKey, ChangedAt),
+                INDEX idx_audit_user (UserName, ChangedAt),
+                INDEX idx_audit_changed (ChangedAt)
+            )
+        """
+    )
+    connection.commit()
+
+
+class AuditLog(threading.Thread):
+    def __init__(self, interval=AUDIT_FLUSH_INTERVAL):
+        super().__init__(name="audit-log", daemon=True)
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.wake = threading.Event()
+        self.pending = []
+        self.connection = None
+        self.writes = 0
+        self.audit_ms = 0.0
+        self.segments = 0
+        self.records = 0
+        self.raw_bytes = 0
+        self.stored_bytes = 0
+        self.last_error = None
+        self.segment_cache = OrderedDict()
+
+    def append(self, records, audit_ms):
+        with self.lock:
+            self.pending.extend(records)
+            self.writes += 1
+            self.audit_ms += audit_ms
+            full = len(self.pending) >= AUDIT_FLUSH_RECORDS
+        if full:
+            self.wake.set()
+
+    def run(self):
+        while True:
+            self.wake.wait(self.interval)
+            self.wake.clear()
+            self.flush()
+
+    def flush(self):
+        with self.lock:
+            batch, self.pending = self.pending, []
+        if not batch:
+            return
+        try:
+            if self.connection is None or not self.connection.is_connected():
+                self.connection = open_connection()
+            segments, raw_bytes, stored_bytes = run_in_transaction(self.connection, lambda cursor: self.write(cursor, batch))
+        except Exception as e:
+            self.last_error = f"{datetime.now():%Y-%m-%d %H:%M:%S} {e}"
+            with self.lock:
+                self.pending[:0] = batch  # retried on the next flush
+            return
+        with self.lock:
+            self.segments += segments
+            self.records += len(batch)
+            self.raw_bytes += raw_bytes
+            self.stored_bytes += stored_bytes
+
+    def write(self, cursor, batch):
+        periods = {}
+        for record in batch:
+            periods.setdefault(record["ChangedAt"].replace(minute=0, second=0, microsecond=0), []).append(record)
+        raw_bytes = stored_bytes = 0
+        for period, records in periods.items():
+            lines = "\n".join(json.dumps(record, default=str) for record in records).encode()
+            payload = gzip.compress(lines, AUDIT_COMPRESSION_LEVEL)
+            changed = [record["ChangedAt"] for record in records]
+            cursor.execute(
+                "INSERT INTO AuditSegment (PeriodStart, FirstAt, LastAt, Records, Payload) VALUES (%s, %s, %s, %s, %s)",
+                (period, min(changed), max(changed), len(records), payload),
+            )
+            segment_id = cursor.lastrowid
+            cursor.executemany(
+                """
+                    INSERT INTO AuditEntry (SegmentID, RecordIndex, ChangedAt, UserName, EntityTable, EntityKey, Operation)
+                    VALUES (%s, %s, %s, %s, %s, %s, %s)
+                """,
+                [
+                    (segment_id, index, record["ChangedAt"], record["User"][:64], record["Table"], record["Key"][:128], record["Operation"])
+                    for index, record in enumerate(records)
+                ],
+            )
+            raw_bytes += len(lines)
+            stored_bytes += len(payload)
+        return len(periods), raw_bytes, stored_bytes
+
+    def read_segments(self, connection, segment_ids):
+        segments = {}
+        with self.lock:
+            for segment_id in segment_ids:
+                if segment_id in self.segment_cache:
+                    self.segment_cache.move_to_end(segment_id)
+                    segments[segment_id] = self.segment_cache[segment_id]
+        missing = [int(segment_id) for segment_id in segment_ids if segment_id not in segments]
+        if missing:
+            placeholders = ", ".join(["%s"] * len(missing))
+            payloads = fetch_table_data(
+                connection, f"SELECT SegmentID, Payload FROM AuditSegment WHERE SegmentID IN ({placeholders})", tuple(missing)
+            )
+            with self.lock:
+                for segment_id, payload in zip(payloads.get("SegmentID", []), payloads.get("Payload", [])):
+                    records = [json.loads(line) for line in gzip.decompress(payload).decode().splitlines()]
+                    segments[segment_id] = self.segment_cache[segment_id] = records
+                while len(self.segment_cache) > AUDIT_SEGMENT_CACHE:
+                    self.segment_cache.popitem(last=False)
+        return segments
+
+    def status(self):
+        with self.lock:
+            return {
+                "Buffered Records": len(self.pending),
+                "Audited Writes": self.writes,
+                "Audit ms per Write": round(self.audit_ms / self.writes, 2) if self.writes else 0.0,
+                "Records Stored": self.records,
+                "Segments Stored": self.segments,
+                "Compression Ratio": round(self.raw_bytes / self.stored_bytes, 1) if self.stored_bytes else 0.0,
+            }
+
+
+@st.cache_resource
+def audit_log():
+    log = AuditLog()
+    log.start()
+    atexit.register(log.flush)
+    return log
+
+
+def audit_entries(connection, table=None, key=None, user=None, start_date=None, end_date=None, limit=AUDIT_QUERY_LIMIT):
+    where, params = date_filter("ChangedAt", start_date, end_date)
+    for column, value in (("EntityTable", table), ("EntityKey", key), ("UserName", user)):
+        if value:
+            where += f" AND {column} = %s"
+            params.append(value)
+    entries = fetch_table_data(
+        connection,
+        f"""
+            SELECT SegmentID, RecordIndex, ChangedAt, UserName, EntityTable, EntityKey, Operation
+            FROM AuditEntry
+            WHERE {where}
+            ORDER BY ChangedAt DESC
+            LIMIT {int(limit)}
+        """,
+        tuple(params),
+    )
+    if entries.empty:
+        return []
+    segments = audit_log().read_segments(connection, entries["SegmentID"].unique().tolist())
+    return [
+        segments[segment_id][index]
+        for segment_id, index in zip(entries["SegmentID"], entries["RecordIndex"])
+        if segment_id in segments
+    ]
+
+
+def audit_changes(record):
+    if record["Before"] is None or record["After"] is None:
+        return ""
+    return ", ".join(
+        f"{column}: {record['Before'].get(column)} -> {value}"
+        for column, value in record["After"].items()
+        if column != "UpdatedAt" and record["Before"].get(column) != value
+    )
+
+
+def audit_log_page(connection):
+    st.header("Audit Log")
+
+    status = audit_log().status()
+    st.dataframe(pd.DataFrame([status]), hide_index=True, use_container_width=True)
+    if audit_log().last_error:
+        st.error(f"Last audit write error: {audit_log().last_error}")
+
+    table = st.selectbox("Table", ["All"] + sorted(AUDITED_TABLES))
+    key = st.text_input("Key", help="Primary key value; composite keys are joined with /, e.g. 12/3 for ProductID/LocationID.")
+    user = st.text_input("Changed By")
+    start_date = st.date_input("From", value=(pd.Timestamp.today() - pd.Timedelta(days=7)).date())
+    end_date = st.date_input("To", value=date.today())
+
+    records = audit_entries(connection, None if table == "All" else table, key.strip(), user.strip(), start_date, end_date)
+    if not records:
+        st.info("No changes recorded for these filters.")
+        return
+    st.dataframe(
+        pd.DataFrame(
+            [
+                {
+                    "ChangedAt": record["ChangedAt"],
+                    "User": record["User"],
+                    "Source": record["Source"],
+                    "Table": record["Table"],
+                    "Key": record["Key"],
+                    "Operation": record["Operation"],
+                    "Changes": audit_changes(record),
+                }
+                for record in records
+            ]
+        ),
+        hide_index=True,
+        use_container_width=True,
+    )
+    if len(records) == AUDIT_QUERY_LIMIT:
+        st.caption(f"Showing the latest {AUDIT_QUERY_LIMIT} changes; narrow the filters to see older ones.")
+
+    shown = st.selectbox(
+        "Row Images",
+        range(len(records)),
+        format_func=lambda index: f"{records[index]['ChangedAt']} {records[index]['Table']} {records[index]['Key']} ({records[index]['Operation']})",
+    )
+    before, after = st.columns(2)
+    before.write("**Before**")
+    before.json(records[shown]["Before"] or {}, expanded=True)
+    after.write("**After**")
+    after.json(records[shown]["After"] or {}, expanded=True)
+
+
+# Sales anomaly detection: new Sales and OrderItem rows from the change feed are
+# scored in micro-batches against exponentially weighted per-customer and per-product
+# statistics held in flat numpy arrays. Flags go to SalesAlert, one row per source row
+# and alert type, so replays of the feed after a restart do not duplicate them.
+ANOMALY_EWMA_ALPHA = 0.05
+ANOMALY_Z_THRESHOLD = 4.0
+ANOMALY_WARMUP = 5  # observations of a key before its statistics are trusted
+ANOMALY_QUANTITY_JUMP = 5.0  # OrderItem quantity over this multiple of the product's average
+ANOMALY_PRICE_TOLERANCE = 0.01
+ANOMALY_PRICE_REFRESH = 300  # seconds between reloads of list prices and active discounts
+ALERT_COLUMNS = ["SourceTable", "SourceID", "AlertType", "CustomerID", "ProductID", "Observed", "Expected", "Score"]
+
+
+def setup_sales_alerts(connection):
+    cursor = connection.cursor()
+    cursor.execute(
+        """
+            CREATE TABLE IF NOT EXISTS SalesAlert (
+                AlertID BIGINT AUTO_INCREMENT PRIMARY KEY,
+                SourceTable VARCHAR(16) NOT NULL,
+                SourceID BIGINT NOT NULL,
+                AlertType VARCHAR(32) NOT NULL,
+                CustomerID INT NULL,
+                ProductID INT NULL,
+                Observed DECIMAL(18, 2) NOT NULL,
+                Expected DECIMAL(18, 2) NOT NULL,
+                Score DOUBLE NOT NULL,
+                DetectedAt DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+                UNIQUE KEY uq_alert_source (SourceTable, SourceID, AlertType),
+                INDEX idx_alert_detected (DetectedAt),
+                INDEX idx_alert_type_detected (AlertType, DetectedAt)
+            )
+        """
+    )
+    connection.commit()
+
+
+class RollingStats:
+    def __init__(self, alpha):
+        self.alpha = alpha
+        self.slots = {}
+        # Exponentially weighted sums of 1, x and x^2; mean and variance follow from them
+        self.weight = np.zeros(0)
+        self.total = np.zeros(0)
+        self.squares = np.zeros(0)
+        self.count = np.zeros(0, dtype=np.int64)
+
+    def lookup(self, keys):
+        slots = np.fromiter(
+            (self.slots.setdefault(key, len(self.slots)) for key in keys), dtype=np.int64, count=len(keys)
+        )
+        if len(self.slots) > len(self.count):
+            grow = max(1024, 2 * len(self.slots)) - len(self.count)
+            self.weight = np.pad(self.weight, (0, grow))
+            self.total = np.pad(self.total, (0, grow))
+            self.squares = np.pad(self.squares, (0, grow))
+            self.count = np.pad(self.count, (0, grow))
+        return slots
+
+    def observe(self, keys, values):
+        # Returns each row's mean, standard deviation and observation count as they
+        # stood before this batch, then folds the whole batch in
+        slots = self.lookup(keys)
+        values = np.asarray(values, dtype=float)
+        weight = self.weight[slots]
+        mean = np.divide(self.total[slots], weight, out=np.zeros(len(slots)), where=weight > 0)
+        variance = np.divide(self.squares[slots], weight, out=np.zeros(len(slots)), where=weight > 0) - mean**2
+        std = np.sqrt(np.maximum(variance, 0.0))
+        count = self.count[slots]
+
+        # A key seen k times in the batch decays by (1-a)^k; its i-th row is weighted a(1-a)^(k-1-i)
+        order = np.argsort(slots, kind="stable")
+        ordered = slots[order]
+        starts = np.flatnonzero(np.r_[True, ordered[1:] != ordered[:-1]])
+        sizes = np.diff(np.r_[starts, len(ordered)])
+        rank = np.empty(len(slots), dtype=np.int64)
+        rank[order] = np.arange(len(slots)) - np.repeat(starts, sizes)
+        size = np.empty(len(slots), dtype=np.int64)
+        size[order] = np.repeat(sizes, sizes)
+        weights = self.alpha * (1 - self.alpha) ** (size - 1 - rank)
+
+        unique = ordered[starts]
+        decay = (1 - self.alpha) ** sizes
+        self.weight[unique] *= decay
+        self.total[unique] *= decay
+        self.squares[unique] *= decay
+        np.add.at(self.weight, slots, weights)
+        np.add.at(self.total, slots, weights * values)
+        np.add.at(self.squares, slots, weights * values**2)
+        np.add.at(self.count, slots, 1)
+        return mean, std, count
+
+
+def z_score_alerts(source, frame, value_column, stats, key_column, alert_type):
+    mean, std, count = stats.observe(frame[key_column].to_numpy(), frame[value_column].to_numpy())
+    # Keys with near-constant history would flag everything; floor the spread at 5% of the mean
+    spread = np.maximum(std, 0.05 * np.abs(mean))
+    observed = frame[value_column].to_numpy(dtype=float)
+    z = np.divide(observed - mean, spread, out=np.zeros(len(frame)), where=spread > 0)
+    flagged = (count >= ANOMALY_WARMUP) & (z > ANOMALY_Z_THRESHOLD)
+    return alert_frame(source, frame[flagged], alert_type, observed[flagged], mean[flagged], z[flagged])
+
+
+def alert_frame(source, rows, alert_type, observed, expected, score):
+    return pd.DataFrame(
+        {
+            "SourceTable": source,
+            "SourceID": rows[f"{source}ID"].to_numpy(),
+            "AlertType": alert_type,
+            "CustomerID": rows["CustomerID"].to_numpy() if "CustomerID" in rows else None,
+            "ProductID": rows["ProductID"].to_numpy(),
+            "Observed": observed,
+            "Expected": expected,
+            "Score": score,
+        },
+        columns=ALERT_COLUMNS,
+    )
+
+
+class SalesAnomalyDetector:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.customer_amounts = RollingStats(ANOMALY_EWMA_ALPHA)
+        self.product_amounts = RollingStats(ANOMALY_EWMA_ALPHA)
+        self.product_quantities = RollingStats(ANOMALY_EWMA_ALPHA)
+        self.seen = {"Sales": 0, "OrderItem": 0}
+        self.prices = pd.Series(dtype=float)  # ProductID -> lowest price allowed today
+        self.prices_loaded_at = 0.0
+        self.connection = None
+        self.rows_processed = 0
+        self.alerts_raised = 0
+        self.last_batch = None  # (rows, seconds)
+
+    def score_sales(self, sales):
+        if sales.empty:
+            return []
+        sales = sales.astype({"SaleAmount": float})
+        return [
+            z_score_alerts("Sales", sales, "SaleAmount", self.customer_amounts, "CustomerID", "Customer Spend Spike"),
+            z_score_alerts("Sales", sales, "SaleAmount", self.product_amounts, "ProductID", "Product Sales Spike"),
+        ]
+
+    def score_order_items(self, items):
+        if items.empty:
+            return []
+        items = items.astype({"Quantity": float, "Price": float})
+        mean, _, count = self.product_quantities.observe(items["ProductID"].to_numpy(), items["Quantity"].to_numpy())
+        quantity = items["Quantity"].to_numpy()
+        jumped = (count >= ANOMALY_WARMUP) & (quantity > ANOMALY_QUANTITY_JUMP * mean)
+        ratio = np.divide(quantity, mean, out=np.zeros(len(items)), where=mean > 0)
+
+        floor = self.prices.reindex(items["ProductID"]).to_numpy()
+        price = items["Price"].to_numpy()
+        underpriced = ~np.isnan(floor) & (price < floor * (1 - ANOMALY_PRICE_TOLERANCE))
+        shortfall = np.divide(floor - price, floor, out=np.zeros(len(items)), where=floor > 0)
+        return [
+            alert_frame("OrderItem", items[jumped], "Quantity Jump", quantity[jumped], mean[jumped], ratio[jumped]),
+            alert_frame(
+                "OrderItem", items[underpriced], "Below Discounted Price",
+                price[underpriced], floor[underpriced], shortfall[underpriced],
+            ),
+        ]
+
+    def database(self):
+        if self.connection is None or not self.connection.is_connected():
+            self.connection = open_connection()
+        return self.connection
+
+    def load_prices(self):
+        cursor = self.database().cursor()
+        cursor.execute(
+            """
+                SELECT Product.ProductID, Product.Price, COALESCE(MAX(Discount.DiscountPercent), 0)
+                FROM Product
+                LEFT JOIN Discount ON Discount.ProductID = Product.ProductID
+                    AND CURDATE() BETWEEN Discount.StartDate AND Discount.EndDate
+                GROUP BY Product.ProductID, Product.Price
+            """
+        )
+        prices = pd.DataFrame(cursor.fetchall(), columns=["ProductID", "Price", "DiscountPercent"]).set_index("ProductID")
+        self.database().rollback()
+        self.prices = pd.to_numeric(prices["Price"]) * (1 - pd.to_numeric(prices["DiscountPercent"]) / 100)
+        self.prices_loaded_at = time.time()
+
+    def new_rows(self, events, table, key):
+        rows = [
+            event["row"] for event in events
+            if event["table"] == table and event["op"] != "delete" and event["row"][key] > self.seen[table]
+        ]
+        if rows:
+            self.seen[table] = max(row[key] for row in rows)
+        return pd.DataFrame(rows)
+
+    def process(self, events):
+        with self.lock:
+            if any(event["table"] == "Discount" for event in events):
+                self.prices_loaded_at = 0.0
+            sales = self.new_rows(events, "Sales", "SalesID")
+            items = self.new_rows(events, "OrderItem", "OrderItemID")
+            if sales.empty and items.empty:
+                return
+
+            started = time.perf_counter()
+            if not items.empty and time.time() - self.prices_loaded_at > ANOMALY_PRICE_REFRESH:
+                self.load_prices()
+            alerts = [frame for frame in self.score_sales(sales) + self.score_order_items(items) if not frame.empty]
+            if alerts:
+                self.write_alerts(pd.concat(alerts, ignore_index=True))
+            self.rows_processed += len(sales) + len(items)
+            self.last_batch = (len(sales) + len(items), time.perf_counter() - started)
+
+    def write_alerts(self, alerts):
+        rows = [
+            (
+                row.SourceTable, int(row.SourceID), row.AlertType,
+                None if pd.isna(row.CustomerID) else int(row.CustomerID), int(row.ProductID),
+                round(float(row.Observed), 2), round(float(row.Expected), 2), float(row.Score),
+            )
+            for row in alerts.itertuples()
+        ]
+        run_in_transaction(
+            self.database(),
+            lambda cursor: cursor.executemany(
+                """
+                    INSERT IGNORE INTO SalesAlert
+                        (SourceTable, SourceID, AlertType, CustomerID, ProductID, Observed, Expected, Score)
+                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+                """,
+                rows,
+            ),
+        )
+        self.alerts_raised += len(rows)
+
+
+@st.cache_resource
+def sales_anomaly_detector():
+    detector = SalesAnomalyDetector()
+    bus, _ = change_feed()
+    bus.subscribe("sales-anomalies", ("Sales", "OrderItem", "Discount"), detector.process)
+    return detector
+
+
+def benchmark_anomaly_detector(rows=50000):
+    rng = np.random.default_rng(7)
+    sales = pd.DataFrame(
+        {
+            "SalesID": np.arange(1, rows + 1),
+            "CustomerID": rng.integers(1, 20000, rows),
+            "ProductID": rng.integers(1, 2000, rows),
+            "SaleAmount": rng.gamma(2.0, 50.0, rows),
+        }
+    )
+    detector = SalesAnomalyDetector()
+    started = time.perf_counter()
+    flagged = 0
+    for start in range(0, rows, 1000):
+        flagged += sum(len(frame) for frame in detector.score_sales(sales.iloc[start:start + 1000]))
+    elapsed = time.perf_counter() - started
+    return rows / elapsed, flagged
+
+
+def sales_alerts(connection):
+    st.header("Sales Alerts")
+
+    detector = sales_anomaly_detector()
+    col1, col2, col3 = st.columns(3)
+    col1.metric("Rows Scored", f"{detector.rows_processed:,}")
+    col2.metric("Alerts Raised", f"{detector.alerts_raised:,}")
+    if detector.last_batch is not None and detector.last_batch[1] > 0:
+        col3.metric("Last Batch", f"{detector.last_batch[0] / detector.last_batch[1]:,.0f} rows/s")
+
+    days = st.number_input("Last N Days", min_value=1, value=7, step=1)
+    alerts = fetch_table_data(
+        connection,
+        """
+            SELECT SalesAlert.DetectedAt, SalesAlert.AlertType, SalesAlert.SourceTable, SalesAlert.SourceID,
+                   Customer.CustomerName, Product.ProductName,
+                   SalesAlert.Observed, SalesAlert.Expected, SalesAlert.Score
+            FROM SalesAlert
+            LEFT JOIN Customer ON Customer.CustomerID = SalesAlert.CustomerID
+            LEFT JOIN Product ON Product.ProductID = SalesAlert.ProductID
+            WHERE SalesAlert.DetectedAt >= NOW() - INTERVAL %s DAY
+            ORDER BY SalesAlert.DetectedAt DESC
+            LIMIT 1000
+        """,
+        (int(days),),
+    )
+    if not alerts.empty:
+        counts = alerts.groupby("AlertType", as_index=False, observed=True).size().rename(columns={"size": "Alerts"})
+        st.bar_chart(counts, x="AlertType", y="Alerts", use_container_width=True)
+        alert_type = st.selectbox("Alert Type", ["All"] + counts["AlertType"].tolist())
+        if alert_type != "All":
+            alerts = alerts[alerts["AlertType"] == alert_type]
+        st.dataframe(alerts, use_container_width=True)
+    else:
+        st.info("No alerts in this period.")
+
+    with st.expander("Detector Benchmark"):
+        if st.button("Run Benchmark"):
+            rate, flagged = benchmark_anomaly_detector()
+            st.write(f"Scored 50,000 synthetic sales at **{rate:,.0f} rows/s** ({flagged} flagged).")
+
+
+# Narrative reports: a compact numeric summary per location and per supplier is
+# built from the insight queries, and the entities whose summary changed since they
+# were last narrated are sent to the LLM REPORT_BATCH_SIZE at a time, from
+# LLM_CONCURRENCY concurrent async calls paced to LLM_REQUESTS_PER_MINUTE.
+# Narratives are cached in LLMResponseCache by a hash of model, prompt version and
+# summary, so unchanged inputs are never billed twice. INVENTORY_LLM=stub runs the
+# whole pipeline offline against a deterministic stub model.
+LLM_BACKEND = os.environ.get("INVENTORY_LLM", "groq")  # "groq" or "stub"
+LLM_MODEL = os.environ.get("INVENTORY_LLM_MODEL", "llama-3.1-70b-versatile")
+LLM_CONCURRENCY = 4
+LLM_REQUESTS_PER_MINUTE = 30
+LLM_RETRIES = 3
+REPORT_BATCH_SIZE = 10
+REPORT_PERIOD_DAYS = 30
+REPORT_PROMPT_VERSION = 1
+REPORT_PROMPT = (
+    "You write short daily inventory briefings for store and purchasing managers. "
+    "For each entity in the JSON list below, write two or three plain sentences that call out what "
+    "needs attention, using only the numbers given. Answer with one JSON object mapping each entity's "
+    '"key" to its narrative and nothing else.\n\n'
+)
+
+
+def setup_narrative_reports(connection):
+    cursor = connection.cursor()
+    cursor.execute(
+        """
+            CREATE TABLE IF NOT EXISTS LLMResponseCache (
+                ContentHash CHAR(64) PRIMARY KEY,
+                Model VARCHAR(64) NOT NULL,
+                Response TEXT NOT NULL,
+                CreatedAt DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP
+            )
+        """
+    )
+    cursor.execute(
+        """
+            CREATE TABLE IF NOT EXISTS NarrativeReport (
+                ReportDate DATE NOT NULL,
+                EntityType VARCHAR(16) NOT NULL,
+                EntityID INT NOT NULL,
+                EntityName VARCHAR(255) NULL,
+                Summary TEXT NOT NULL,
+                Narrative TEXT NOT NULL,
+                ContentHash CHAR(64) NOT NULL,
+                PRIMARY KEY (ReportDate, EntityType, EntityID)
+            )
+        """
+    )
+    cursor.execute(
+        """
+            CREATE TABLE IF NOT EXISTS ReportRun (
+                RunID BIGINT AUTO_INCREMENT PRIMARY KEY,
+                StartedAt DATETIME NOT NULL,
+                Model VARCHAR(64) NOT NULL,
+                Entities INT NOT NULL,
+                CacheHits INT NOT NULL,
+                Failed INT NOT NULL DEFAULT 0,
+                Calls INT NOT NULL,
+                PromptTokens INT NOT NULL,
+                CompletionTokens INT NOT NULL,
+                MedianLatencyMs DOUBLE NULL,
+                MaxLatencyMs DOUBLE NULL,
+                ElapsedMs DOUBLE NOT NULL
+            )
+        """
+    )
+    connection.commit()
+    ensure_column(connection, "ReportRun", "Failed", "INT NOT NULL DEFAULT 0 AFTER CacheHits")
+
+
+def compact_record(record):
+    # Rounded plain numbers keep prompts short and hashes stable across float noise
+    compact = {}
+    for key, value in record.items():
+        if value is None or (not isinstance(value, str) and pd.isna(value)):
+            continue
+        if isinstance(value, (float, Decimal, np.floating)):
+            value = round(float(value), 1)
+        elif isinstance(value, np.integer):
+            value = int(value)
+        elif isinstance(value, (date, pd.Timestamp)):
+            value = str(value)[:10]
+        compact[key] = value
+    return compact
+
+
+def location_summaries(connection):
+    stock = fetch_table_data(
+        connection,
+        f"""
+            SELECT
+                Location.LocationID,
+                Location.LocationName AS Name,
+                COUNT(Inventory.ProductID) AS Products,
+                SUM(Inventory.Quantity + COALESCE(Pending.Delta, 0)) AS Units,
+                SUM((Inventory.Quantity + COALESCE(Pending.Delta, 0)) * Product.Price) AS StockValue,
+                SUM(CASE WHEN Inventory.Quantity + COALESCE(Pending.Delta, 0) <= 0 THEN 1 ELSE 0 END) AS OutOfStock,
+                MAX(Inventory.LastRestockDate) AS LastRestock
+            FROM Location
+            LEFT JOIN Inventory ON Inventory.LocationID = Location.LocationID
+            LEFT JOIN ({PENDING_MOVEMENTS_SUBQUERY}) AS Pending
+                ON Pending.ProductID = Inventory.ProductID AND Pending.LocationID = Inventory.LocationID
+            LEFT JOIN Product ON Product.ProductID = Inventory.ProductID
+            GROUP BY Location.LocationID, Location.LocationName
+        """,
+    )
+    if stock.empty:
+        return []
+    flows = fetch_table_data(
+        connection,
+        """
+            SELECT LocationID, MovementType, SUM(ABS(Quantity)) AS Units
+            FROM InventoryMovement
+            WHERE CreatedAt >= CURDATE() - INTERVAL %s DAY
+            GROUP BY LocationID, MovementType
+        """,
+        (REPORT_PERIOD_DAYS,),
+    )
+    if not flows.empty:
+        flows = flows.pivot(index="LocationID", columns="MovementType", values="Units").add_suffix(f"Units{REPORT_PERIOD_DAYS}d")
+        stock = stock.merge(flows, left_on="LocationID", right_index=True, how="left")
+    return [("Location", int(row.pop("LocationID")), compact_record(row)) for row in stock.to_dict("records")]
+
+
+def supplier_summaries(connection):
+    start_date = (pd.Timestamp.today() - pd.Timedelta(days=REPORT_PERIOD_DAYS)).date()
+    stats = supplier_lead_time_stats(connection)
+    orders = supplier_order_totals(connection, start_date, None)
+    if stats.empty and orders.empty:
+        return []
+    # Lead-time stats cover all orders; the order totals only the report period
+    orders = orders.rename(columns={column: f"{column}{REPORT_PERIOD_DAYS}d" for column in ("Orders", "UnitsOrdered", "OrderValue")})
+    if orders.empty:
+        merged = stats
+    elif stats.empty:
+        merged = orders
+    else:
+        merged = stats.merge(orders.drop(columns=["SupplierName"]), on="SupplierID", how="outer")
+    merged = merged.rename(columns={"SupplierName": "Name"})
+    return [("Supplier", int(row.pop("SupplierID")), compact_record(row)) for row in merged.to_dict("records")]
+
+
+def summary_hash(summary):
+    payload = json.dumps({"model": LLM_MODEL, "prompt": REPORT_PROMPT_VERSION, "summary": summary}, sort_keys=True)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+class StubChatModel:
+    # Answers like the real model would, from the numbers in the prompt, without a network call
+    async def ainvoke(self, prompt):
+        await asyncio.sleep(0.01)
+        entities = json.loads(prompt[len(REPORT_PROMPT):])
+        content = json.dumps(
+            {
+                entity["key"]: f"{entity['summary'].get('Name', entity['key'])}: "
+                + ", ".join(f"{name} {value}" for name, value in entity["summary"].items() if name != "Name")
+                + "."
+                for entity in entities
+            }
+        )
+        return SimpleNamespace(
+            content=content, usage_metadata={"input_tokens": len(prompt) // 4, "output_tokens": len(content) // 4}
+        )
+
+
+def report_model():
+    if LLM_BACKEND == "stub":
+        return StubChatModel()
+    from langchain_groq import ChatGroq
+
+    return ChatGroq(temperature=0, groq_api_key=os.environ.get("GROQ_API_KEY", ""), model=LLM_MODEL)
+
+
+class RateLimiter:
+    def __init__(self, per_minute):
+        self.interval = 60 / per_minute
+        self.next_at = 0.0
+        self.lock = asyncio.Lock()
+
+    async def wait(self):
+        async with self.lock:
+            now = time.monotonic()
+            delay = self.next_at - now
+            self.next_at = max(now, self.next_at) + self.interval
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+def parse_narratives(content):
+    content = content.strip()
+    if content.startswith("```"):
+        content = content.strip("`").partition("\n")[2]
+    start, end = content.find("{"), content.rfind("}")
+    try:
+        narratives = json.loads(content[start:end + 1])
+    except json.JSONDecodeError:
+        return {}
+    return {str(key): str(value) for key, value in narratives.items()} if isinstance(narratives, dict) else {}
+
+
+async def narrate_batches(model, batches, stats):
+    limiter = RateLimiter(LLM_REQUESTS_PER_MINUTE)
+    slots = asyncio.Semaphore(LLM_CONCURRENCY)
+
+    async def narrate(batch):
+        prompt = REPORT_PROMPT + json.dumps(
+            [{"key": key, "summary": summary} for key, summary in batch], separators=(",", ":")
+        )
+        async with slots:
+            for attempt in range(LLM_RETRIES + 1):
+                await limiter.wait()
+                started = time.perf_counter()
+                try:
+                    response = await model.ainvoke(prompt)
+                    break
+                except Exception:
+                    if attempt == LLM_RETRIES:
+                        raise
+                    await asyncio.sleep(2 ** attempt)  # rate limits and transient API errors
+        stats["latencies"].append((time.perf_counter() - started) * 1000)
+        usage = getattr(response, "usage_metadata", None) or {}
+        stats["calls"] += 1
+        stats["prompt_tokens"] += usage.get("input_tokens", 0)
+        stats["completion_tokens"] += usage.get("output_tokens", 0)
+        return parse_narratives(response.content)
+
+    # One failed batch must not discard the others: returns (narratives, {key: error}) where
+    # the errors also cover keys the model left out of its answer
+    results = await asyncio.gather(*(narrate(batch) for batch in batches), return_exceptions=True)
+    narratives, failed = {}, {}
+    for batch, result in zip(batches, results):
+        if isinstance(result, BaseException):
+            failed.update((key, f"{type(result).__name__}: {result}") for key, _ in batch)
+            continue
+        narratives.update(result)
+        failed.update((key, "missing from the model's answer") for key, _ in batch if key not in result)
+    return narratives, failed
+
+
+def generate_narrative_reports(connection, model=None, progress=None):
+    started = datetime.now()
+    entities = location_summaries(connection) + supplier_summaries(connection)
+    keyed = {f"{entity_type}:{entity_id}": (entity_type, entity_id, summary, summary_hash(summary))
+             for entity_type, entity_id, summary in entities}
+
+    cached = {}
+    hashes = list({content_hash for *_, content_hash in keyed.values()})
+    cursor = connection.cursor()
+    for start in range(0, len(hashes), 500):
+        chunk = hashes[start:start + 500]
+        cursor.execute(
+            f"SELECT ContentHash, Response FROM LLMResponseCache WHERE ContentHash IN ({', '.join(['%s'] * len(chunk))})",
+            tuple(chunk),
+        )
+        cached.update(cursor.fetchall())
+    connection.rollback()
+
+    stats = {"calls": 0, "prompt_tokens": 0, "completion_tokens": 0, "latencies": []}
+    missing = [(key, summary) for key, (_, _, summary, content_hash) in keyed.items() if content_hash not in cached]
+    if missing:
+        batches = [missing[start:start + REPORT_BATCH_SIZE] for start in range(0, len(missing), REPORT_BATCH_SIZE)]
+        narratives, failed = asyncio.run(narrate_batches(model or report_model(), batches, stats))
+        fresh = {keyed[key][3]: text for key, text in narratives.items() if key in keyed}
+        cached.update(fresh)
+    else:
+        fresh, failed = {}, {}
+    if progress:
+        progress(1, 2)
+
+    latencies = stats["latencies"]
+    run = (
+        started, LLM_MODEL, len(keyed), len(keyed) - len(missing), len(failed), stats["calls"], stats["prompt_tokens"],
+        stats["completion_tokens"], float(np.median(latencies)) if latencies else None,
+        max(latencies) if latencies else None, (datetime.now() - started).total_seconds() * 1000,
+    )
+
+    def store(cursor):
+        cursor.executemany(
+            "INSERT IGNORE INTO LLMResponseCache (ContentHash, Model, Response) VALUES (%s, %s, %s)",
+            [(content_hash, LLM_MODEL, text) for content_hash, text in fresh.items()],
+        )
+        cursor.executemany(
+            """
+                INSERT INTO NarrativeReport (ReportDate, EntityType, EntityID, EntityName, Summary, Narrative, ContentHash)
+                VALUES (%s, %s, %s, %s, %s, %s, %s)
+                ON DUPLICATE KEY UPDATE EntityName = VALUES(EntityName), Summary = VALUES(Summary),
+                    Narrative = VALUES(Narrative), ContentHash = VALUES(ContentHash)
+            """,
+            [
+                (started.date(), entity_type, entity_id, summary.get("Name"), json.dumps(summary), cached[content_hash], content_hash)
+                for entity_type, entity_id, summary, content_hash in keyed.values()
+                if content_hash in cached
+            ],
+        )
+        cursor.execute(
+            """
+                INSERT INTO ReportRun (StartedAt, Model, Entities, CacheHits, Failed, Calls, PromptTokens,
+                                       CompletionTokens, MedianLatencyMs, MaxLatencyMs, ElapsedMs)
+                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+            """,
+            run,
+        )
+
+    run_in_transaction(connection, store)
+    if progress:
+        progress(2, 2)
+    result = dict(zip(["StartedAt", "Model", "Entities", "CacheHits", "Failed", "Calls", "PromptTokens",
+                       "CompletionTokens", "MedianLatencyMs", "MaxLatencyMs", "ElapsedMs"], run))
+    result["Errors"] = failed
+    return result
+
+
+def narrative_report_job(context, params):
+    connection = open_connection()
+    try:
+        run = generate_narrative_reports(connection, progress=context.progress)
+        hit_rate = run["CacheHits"] / run["Entities"] if run["Entities"] else 0
+        summary = (
+            f"Narrated {run['Entities'] - run['Failed']} of {run['Entities']} entities with {run['Calls']} model calls "
+            f"({hit_rate:.0%} cached, {run['PromptTokens'] + run['CompletionTokens']} tokens)."
+        )
+        if run["Errors"]:
+            # The successes are stored and cached, so a retry only asks for the failed entities again
+            errors = "; ".join(f"{key} ({error})" for key, error in sorted(run["Errors"].items())[:10])
+            more = f" and {len(run['Errors']) - 10} more" if len(run["Errors"]) > 10 else ""
+            raise RuntimeError(f"{summary} Failed: {errors}{more}.")
+        return summary
+    finally:
+        connection.close()
+
+
+def narrative_reports_page(connection):
+    st.header("Daily Reports")
+    if st.button("Generate Today's Reports"):
+        job_id = job_scheduler().submit("narrative_reports", {}, current_user())
+        st.success(f"Report job {job_id} queued; follow it on the Jobs page.")
+
+    reports = fetch_table_data(
+        connection,
+        """
+            SELECT EntityType, EntityID, EntityName, Narrative, Summary
+            FROM NarrativeReport
+            WHERE ReportDate = (SELECT MAX(ReportDate) FROM NarrativeReport)
+            ORDER BY EntityType, EntityName
+        """,
+    )
+    if reports.empty:
+        st.info("No reports yet.")
+    else:
+        for entity_type, group in reports.groupby("EntityType"):
+            st.subheader(f"{entity_type}s")
+            for report in group.itertuples():
+                with st.expander(report.EntityName or f"{entity_type} {report.EntityID}"):
+                    st.write(report.Narrative)
+                    st.json(json.loads(report.Summary), expanded=False)
+
+    runs = fetch_table_data(connection, "SELECT * FROM ReportRun ORDER BY RunID DESC LIMIT 20")
+    if not runs.empty:
+        st.subheader("Runs")
+        runs["CacheHitRate"] = runs["CacheHits"] / runs["Entities"].where(runs["Entities"] > 0)
+        st.dataframe(runs, hide_index=True, use_container_width=True)
+
+
+# Supplier Details
+def supplier_details(connection):
+    st.header("Supplier Details")
+
+    # Query to fetch supplier details with associated products and categories
+    query = """
+        SELECT 
+            Supplier.SupplierID,
+            Supplier.SupplierName,
+            Supplier.ContactInfo,
+            Product.ProductName,
+            Category.CategoryName,
+            Product.Price,
+            Product.Quantity
+        FROM Supplier
+        LEFT JOIN Product ON Supplier.SupplierID = Product.ProductID
+        LEFT JOIN Category ON Product.CategoryID = Category.CategoryID
+        ORDER BY Supplier.SupplierName
+    """
+    supplier_data = fetch_table_data(connection, query)
+
+    if not supplier_data.empty:
+        st.dataframe(supplier_data, use_container_width=True)
+    else:
+        st.info("No supplier details found.")
+
+def get_supplier_details(connection):
+    st.header("View Supplier Details")
+
+    supplier_data = reference_data(connection, "Supplier")
+
+    if not supplier_data.empty:
+        try:
+            lead_times = supplier_lead_time_stats(connection)
+        except Error as e:
+            st.warning(f"Lead times unavailable: {e}")
+            lead_times = pd.DataFrame()
+        if not lead_times.empty:
+            supplier_data = supplier_data.merge(
+                lead_times[["SupplierID", "P50", "P90", "FillRate", "LateShipments"]], on="SupplierID", how="left"
+            )
+        st.dataframe(supplier_data, use_container_width=True)
+    else:
+        st.info("No supplier details found.")
+
+def add_supplier(connection):
+    st.header("Add Supplier")
+
+    supplier_name = st.text_input("Supplier Name")
+    contact_info = st.text_input("Contact Information")
+
+    if st.button("Add Supplier"):
+        if supplier_name and contact_info:
+            query = """
+                INSERT INTO Supplier (SupplierName, ContactInfo)
+                VALUES (%s, %s)
+            """
+
+            def insert_supplier(cursor):
+                cursor.execute(query, (supplier_name, contact_info))
+                return cursor.lastrowid
+
+            key = request_key("add_supplier", [supplier_name, contact_info])
+            try:
+                supplier_id, replayed = run_idempotent(connection, key, "add_supplier", insert_supplier)
+                cached_reference_data.clear()
+                if replayed:
+                    st.info(f"Supplier '{supplier_name}' was already added (Supplier ID {supplier_id}).")
+                else:
+                    st.success(f"Supplier '{supplier_name}' added successfully!")
+            except (Error, IdempotencyConflict) as e:
+                st.error(f"Error executing query: {e}")
+        else:
+            st.error("Please fill in all fields.")
+
+    if st.button("Start New Supplier", help="Add another supplier with the same details"):
+        new_request("add_supplier")
+
+def delete_supplier(connection):
+    st.header("Delete Supplier")
+
+    supplier_id = st.number_input("Enter Supplier ID to Delete", min_value=1, step=1)
+
+    if st.button("Delete Supplier"):
+        query = "DELETE FROM Supplier WHERE SupplierID = %s"
+        if execute_query(connection, query, (supplier_id,)):
+            cached_reference_data.clear()
+            st.success(f"Supplier ID {supplier_id} deleted successfully!")
+        else:
+            st.error("Failed to delete supplier. Please check the Supplier ID.")
+
+# Sales and Order/OrderItem history can be split by month, either with native MySQL
+# RANGE partitioning (pruned by the date filters below) or into separate shard
+# databases listed in INVENTORY_SHARDS, e.g.
+#   [{"database": "inventory_2024", "start": "2024-01-01", "end": "2025-01-01"}, ...]
+# Each shard holds the Sales, Order and OrderItem rows of its date range; reference
+# tables stay on the primary. Shard queries return partial aggregates that are merged here.
+# The audit log tables can be partitioned the same way but are never sharded. Order is
+# only ever sharded: OrderItem and Shipment reference it by foreign key, which native
+# partitioning does not allow.
+PARTITIONED_TABLES = {"Sales": "SaleDate", "AuditSegment": "PeriodStart", "AuditEntry": "ChangedAt"}
+SHARD_CONFIGS = json.loads(os.environ.get("INVENTORY_SHARDS", "[]"))
+SHARD_QUERY_WORKERS = 8
+
+
+def date_filter(column, start_date=None, end_date=None):
+    clauses, params = [], []
+    if start_date:
+        clauses.append(f"{column} >= %s")
+        params.append(start_date)
+    if end_date:
+        clauses.append(f"{column} < %s + INTERVAL 1 DAY")
+        params.append(end_date)
+    return " AND ".join(clauses) or "1 = 1", params
+
+
+def shards_for_range(start_date=None, end_date=None):
+    return [
+        shard
+        for shard in SHARD_CONFIGS
+        if (end_date is None or date.fromisoformat(shard["start"]) <= end_date)
+        and (start_date is None or date.fromisoformat(shard["end"]) > start_date)
+    ]
+
+
+def run_shard_query(shard, query, params):
+    settings = dict(DATABASE_CONFIG, **{key: shard[key] for key in ("host", "port", "user", "password", "database") if key in shard})
+    connection = mysql.connector.connect(**settings)
+    try:
+        cursor = connection.cursor(dictionary=True)
+        cursor.execute(query, params)
+        return pd.DataFrame(cursor.fetchall())
+    finally:
+        connection.close()
+
+
+def scatter_gather(connection, query, params, start_date, end_date, keys, aggregates):
+    # query must aggregate by `keys`; the columns in `aggregates` are merged with
+    # the given pandas reducers (COUNT and SUM partials both merge with "sum")
+    if analytics_mode_enabled() or not SHARD_CONFIGS:
+        return run_insight_query(connection, query, params)
+
+    shards = shards_for_range(start_date, end_date)
+    if not shards:
+        return pd.DataFrame()
+    with ThreadPoolExecutor(max_workers=min(SHARD_QUERY_WORKERS, len(shards))) as pool:
+        partials = list(pool.map(lambda shard: run_shard_query(shard, query, params), shards))
+
+    frames = [partial for partial in partials if not partial.empty]
+    if not frames:
+        return pd.DataFrame()
+    combined = pd.concat(frames, ignore_index=True)
+    for column in aggregates:
+        combined[column] = pd.to_numeric(combined[column])
+    return combined.groupby(keys, as_index=False).agg(aggregates)
+
+
+# Charts: bar_chart() and line_chart() reduce a frame to what the screen can show
+# before it is sent to the browser. Bar charts keep the largest CHART_MAX_BARS - 1
+# labels and fold the rest into one "Other" bar. Line charts are downsampled to
+# CHART_MAX_POINTS, either with LTTB (keeps the visual shape) or with the min and max
+# of each bucket (keeps every spike).
+CHART_MAX_BARS = 20
+CHART_MAX_POINTS = 1000  # about one point per horizontal pixel of a wide chart
+CHART_CACHE_TTL = 300  # seconds a reduced series is reused
+CHART_OTHER_LABEL = "Other"
+DOWNSAMPLING_METHODS = ("LTTB", "Min/Max")
+
+
+def top_n_bars(frame, x, y, limit=CHART_MAX_BARS, other="sum"):
+    columns = [y] if isinstance(y, str) else list(y)
+    if len(frame) <= limit:
+        return frame[[x] + columns]
+    ranked = frame[[x] + columns].assign(**{column: pd.to_numeric(frame[column]) for column in columns})
+    ranked = ranked.sort_values(columns[0], ascending=False)
+    rest = ranked.iloc[limit - 1:]
+    other_row = {x: f"{CHART_OTHER_LABEL} ({len(rest)})", **rest[columns].agg(other).to_dict()}
+    return pd.concat([ranked.head(limit - 1), pd.DataFrame([other_row])], ignore_index=True)
+
+
+def lttb(x, y, threshold):
+    # Largest-triangle-three-buckets: keeps the first and last point and, per bucket,
+    # the point forming the largest triangle with the previous pick and the next bucket's mean
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+    edges = np.linspace(1, n - 1, threshold - 1).astype(np.int64)
+    picked = np.empty(threshold, dtype=np.int64)
+    picked[0], picked[-1] = 0, n - 1
+    previous = 0
+    for bucket in range(threshold - 2):
+        start, end = edges[bucket], edges[bucket + 1]
+        if bucket + 2 < len(edges):
+            next_x, next_y = x[end:edges[bucket + 2]].mean(), y[end:edges[bucket + 2]].mean()
+        else:
+            next_x, next_y = x[-1], y[-1]
+        area = np.abs(
+            (x[previous] - next_x) * (y[start:end] - y[previous])
+            - (x[previous] - x[start:end]) * (next_y - y[previous])
+        )
+        previous = start + int(np.argmax(area))
+        picked[bucket + 1] = previous
+    return picked
+
+
+def min_max_downsample(y, threshold):
+    n = len(y)
+    if threshold >= n:
+        return np.arange(n)
+    buckets = pd.Series(y).groupby(np.arange(n) * max(threshold // 2, 1) // n)
+    return np.union1d(buckets.idxmin().to_numpy(), buckets.idxmax().to_numpy())
+
+
+def downsample(frame, x, y, limit=CHART_MAX_POINTS, method="LTTB"):
+    frame = frame[[x, y]].dropna().sort_values(x).reset_index(drop=True)
+    if len(frame) <= limit:
+        return frame
+    values = pd.to_numeric(frame[y]).to_numpy(dtype=float)
+    if method == "Min/Max":
+        keep = min_max_downsample(values, limit)
+    else:
+        positions = frame[x]
+        if not pd.api.types.is_numeric_dtype(positions):
+            positions = pd.to_datetime(positions).astype("int64")
+        keep = lttb(positions.to_numpy(dtype=float), values, limit)
+    return frame.iloc[keep].reset_index(drop=True)
+
+
+def bar_chart(frame, x, y, limit=CHART_MAX_BARS, other="sum"):
+    reduced = top_n_bars(frame, x, y, limit, other)
+    st.bar_chart(reduced, x=x, y=y, use_container_width=True)
+    if len(reduced) < len(frame):
+        st.caption(f"Largest {limit - 1} of {len(frame):,} shown; the rest are grouped as {CHART_OTHER_LABEL}.")
+
+
+def line_chart(frame, x, y, limit=CHART_MAX_POINTS, method="LTTB"):
+    reduced = downsample(frame, x, y, limit, method)
+    st.line_chart(reduced, x=x, y=y, use_container_width=True)
+    if len(reduced) < len(frame):
+        st.caption(f"{len(reduced):,} of {len(frame):,} points shown ({method}).")
+
+
+def sales_period_inputs(key):
+    col1, col2 = st.columns(2)
+    start_date = col1.date_input("From", value=None, key=f"{key}_from")
+    end_date = col2.date_input("To", value=None, key=f"{key}_to")
+    return start_date, end_date
+
+
+def customer_sales_totals(connection, start_date=None, end_date=None):
+    where, params = date_filter("Sales.SaleDate", start_date, end_date)
+    query = f"""
+        SELECT
+            Sales.CustomerID,
+            SUM(Sales.SaleAmount) AS TotalSpent,
+            COUNT(Sales.SalesID) AS TotalOrders
+        FROM Sales
+        WHERE {where}
+        GROUP BY Sales.CustomerID
+    """
+    totals = scatter_gather(
+        connection, query, params, start_date, end_date, ["CustomerID"], {"TotalSpent": "sum", "TotalOrders": "sum"}
+    )
+    customers = run_insight_query(connection, "SELECT CustomerID, CustomerName AS Customer FROM Customer")
+    if customers.empty:
+        return pd.DataFrame()
+    if totals.empty:
+        totals = pd.DataFrame(columns=["CustomerID", "TotalSpent", "TotalOrders"])
+
+    # Customers without sales in the period still appear, as the old LEFT JOIN did
+    merged = customers.merge(totals, on="CustomerID", how="left")
+    merged["TotalSpent"] = pd.to_numeric(merged["TotalSpent"]).fillna(0.0)
+    merged["TotalOrders"] = pd.to_numeric(merged["TotalOrders"]).fillna(0).astype(int)
+    return merged.groupby("Customer", as_index=False)[["TotalSpent", "TotalOrders"]].sum()
+
+
+def supplier_order_totals(connection, start_date=None, end_date=None):
+    where, params = date_filter("`Order`.OrderDate", start_date, end_date)
+    query = f"""
+        SELECT
+            `Order`.SupplierID,
+            COUNT(DISTINCT `Order`.OrderID) AS Orders,
+            SUM(OrderItem.Quantity) AS UnitsOrdered,
+            SUM(OrderItem.Quantity * OrderItem.Price) AS OrderValue
+        FROM `Order`
+        JOIN OrderItem ON OrderItem.OrderID = `Order`.OrderID
+        WHERE {where}
+        GROUP BY `Order`.SupplierID
+    """
+    # An order and its items always live in the same shard, so distinct order counts add up
+    totals = scatter_gather(
+        connection,
+        query,
+        params,
+        start_date,
+        end_date,
+        ["SupplierID"],
+        {"Orders": "sum", "UnitsOrdered": "sum", "OrderValue": "sum"},
+    )
+    if totals.empty:
+        return totals
+    suppliers = reference_data(connection, "Supplier")[["SupplierID", "SupplierName"]]
+    return suppliers.merge(totals, on="SupplierID").sort_values("OrderValue", ascending=False)
+
+
+@st.cache_resource(ttl=CHART_CACHE_TTL, show_spinner=False)
+def sales_trend(_connection, start_date, end_date, method, analytics):
+    # One row per day is summed by the database (or each shard), then downsampled once
+    # and shared by every session asking for the same period. analytics only keys the
+    # cache; scatter_gather reads the mode itself.
+    where, params = date_filter("Sales.SaleDate", start_date, end_date)
+    query = f"""
+        SELECT
+            Sales.SaleDate,
+            SUM(Sales.SaleAmount) AS Revenue
+        FROM Sales
+        WHERE {where}
+        GROUP BY Sales.SaleDate
+    """
+    daily = scatter_gather(_connection, query, params, start_date, end_date, ["SaleDate"], {"Revenue": "sum"})
+    if daily.empty:
+        return daily, 0
+    daily["SaleDate"] = pd.to_datetime(daily["SaleDate"])
+    daily["Revenue"] = pd.to_numeric(daily["Revenue"]).astype(float)
+    return downsample(daily, "SaleDate", "Revenue", CHART_MAX_POINTS, method), len(daily)
+
+
+def partition_month_clause(month):
+    next_month = (month.replace(day=1) + pd.DateOffset(months=1)).date()
+    return f"PARTITION p{month:%Y%m} VALUES LESS THAN (TO_DAYS('{next_month:%Y-%m-%d}'))"
+
+
+def partitioning_blockers(connection, table):
+    # Native partitioning needs the date column in every unique key and no foreign keys on
+    # or to the table; returns what stands in the way, empty when the table qualifies
+    column = PARTITIONED_TABLES[table]
+    cursor = connection.cursor()
+    cursor.execute(
+        """
+            SELECT INDEX_NAME
+            FROM INFORMATION_SCHEMA.STATISTICS
+            WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND NON_UNIQUE = 0
+            GROUP BY INDEX_NAME
+            HAVING SUM(COLUMN_NAME = %s) = 0
+            ORDER BY INDEX_NAME
+        """,
+        (table, column),
+    )
+    blockers = [f"unique key {name} does not include {column}" for (name,) in cursor.fetchall()]
+    cursor.execute(
+        """
+            SELECT DISTINCT CONSTRAINT_NAME, TABLE_NAME, REFERENCED_TABLE_NAME
+            FROM INFORMATION_SCHEMA.KEY_COLUMN_USAGE
+            WHERE TABLE_SCHEMA = DATABASE() AND REFERENCED_TABLE_NAME IS NOT NULL
+              AND (TABLE_NAME = %s OR REFERENCED_TABLE_NAME = %s)
+            ORDER BY CONSTRAINT_NAME
+        """,
+        (table, table),
+    )
+    blockers += [f"foreign key {name} from {child} to {parent}" for name, child, parent in cursor.fetchall()]
+    return blockers
+
+
+def partition_by_month(connection, table, first_month, months):
+    blockers = partitioning_blockers(connection, table)
+    if blockers:
+        raise ValueError(f"{table} cannot be partitioned: {'; '.join(blockers)}.")
+    column = PARTITIONED_TABLES[table]
+    clauses = [
+        partition_month_clause((pd.Timestamp(first_month) + pd.DateOffset(months=offset)).date())
+        for offset in range(months)
+    ]
+    clauses.append("PARTITION pmax VALUES LESS THAN MAXVALUE")
+    cursor = connection.cursor()
+    cursor.execute(f"ALTER TABLE `{table}` PARTITION BY RANGE (TO_DAYS(`{column}`)) ({', '.join(clauses)})")
+
+
+def table_partitions(connection, table):
+    return fetch_table_data(
+        connection,
+        """
+            SELECT PARTITION_NAME AS PartitionName, PARTITION_DESCRIPTION AS UpperBound, TABLE_ROWS AS ApproxRows
+            FROM INFORMATION_SCHEMA.PARTITIONS
+            WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND PARTITION_NAME IS NOT NULL
+            ORDER BY PARTITION_ORDINAL_POSITION
+        """,
+        (table,),
+    )
+
+
+def add_next_month_partition(connection, table):
+    partitions = table_partitions(connection, table)
+    months = sorted(name for name in partitions["PartitionName"] if name != "pmax")
+    next_month = (pd.Timestamp(datetime.strptime(months[-1], "p%Y%m")) + pd.DateOffset(months=1)).date()
+    cursor = connection.cursor()
+    cursor.execute(
+        f"""
+            ALTER TABLE `{table}` REORGANIZE PARTITION pmax INTO (
+                {partition_month_clause(next_month)},
+                PARTITION pmax VALUES LESS THAN MAXVALUE
+            )
+        """
+    )
+    return next_month
+
+
+def partition_manager(connection):
+    st.header("Partitions")
+
+    if STORAGE_BACKEND == "sqlite":
+        st.info("Partitioning is only available on the MySQL backend.")
+        return
+
+    if SHARD_CONFIGS:
+        st.write("Shard databases:")
+        st.dataframe(pd.DataFrame(SHARD_CONFIGS), use_container_width=True)
+
+    table = st.selectbox("Table", list(PARTITIONED_TABLES))
+    partitions = table_partitions(connection, table)
+    if not partitions.empty:
+        st.dataframe(partitions, use_container_width=True)
+        if st.button("Add Next Month"):
+            try:
+                st.success(f"Added partition for {add_next_month_partition(connection, table):%B %Y}.")
+            except Error as e:
+                st.error(f"Error adding partition: {e}")
+    else:
+        st.info(f"{table} is not partitioned.")
+        try:
+            blockers = partitioning_blockers(connection, table)
+        except Error as e:
+            st.error(f"Error checking {table}'s keys: {e}")
+            return
+        if blockers:
+            st.warning(f"{table} cannot be partitioned by month: " + "; ".join(blockers) + ".")
+        first_month = st.date_input("First Month", value=date.today().replace(day=1))
+        months = st.number_input("Months", min_value=1, max_value=240, value=24, step=1)
+        if st.button("Partition by Month", disabled=bool(blockers)):
+            try:
+                partition_by_month(connection, table, first_month, months)
+                st.success(f"{table} partitioned into {months} monthly partitions.")
+            except (Error, ValueError) as e:
+                st.error(f"Error partitioning {table}: {e}")
+
+
+# Analytics mode answers the insight pages from a local DuckDB snapshot instead of
+# the OLTP MySQL instance. "append" tables are copied incrementally by primary-key
+# watermark, "updated" tables by (UpdatedAt, key) watermark (rows are replaced by key),
+# and small reference tables are copied in full. Keyed tables are reconciled against the
+# source's keys now and then, which drops deleted rows and fills in late-committed ones.
+ANALYTICS_STORE_PATH = os.environ.get("INVENTORY_ANALYTICS_PATH", "analytics.duckdb")
+ANALYTICS_TABLES = {
+    "Sales": ("SalesID", "append"),
+    "InventoryMovement": ("MovementID", "append"),
+    "Order": ("OrderID", "updated"),
+    "OrderItem": ("OrderItemID", "updated"),
+    "Shipment": ("ShipmentID", "updated"),
+    "Discount": ("DiscountID", "updated"),
+    "Inventory": (None, "full"),
+    "Customer": (None, "full"),
+    "Product": (None, "full"),
+    "Category": (None, "full"),
+    "Location": (None, "full"),
+    "Supplier": (None, "full"),
+}
+ANALYTICS_REFRESH_INTERVAL = 900  # seconds
+ANALYTICS_CHUNK_SIZE = 50000
+ANALYTICS_COMMIT_LAG = CDC_POLL_OVERLAP  # seconds; "updated" rows younger than this may still have commits pending
+ANALYTICS_RECONCILE_INTERVAL = 86400  # seconds between key reconciles per server process
+ANALYTICS_RECONCILE_BATCH = 1000  # missing rows fetched per query
+
+# Ad-hoc dashboards that only ever run against the snapshot: name -> (query, label column, value column)
+ANALYTICS_DASHBOARDS = {
+    "Category Sales": (
+        """
+            SELECT Category.CategoryName, SUM(Sales.SaleAmount) AS Revenue, COUNT(*) AS SalesCount
+            FROM Sales
+            JOIN Product ON Sales.ProductID = Product.ProductID
+            JOIN Category ON Product.CategoryID = Category.CategoryID
+            GROUP BY Category.CategoryName
+            ORDER BY Revenue DESC
+        """,
+        "CategoryName",
+        "Revenue",
+    ),
+    "Location Turnover": (
+        """
+            WITH UnitsOut AS (
+                SELECT LocationID, -SUM(Quantity) AS UnitsOut
+                FROM InventoryMovement
+                WHERE MovementType = 'Reservation'
+                GROUP BY LocationID
+            ), OnHand AS (
+                SELECT LocationID, SUM(Quantity) AS UnitsOnHand
+                FROM Inventory
+                GROUP BY LocationID
+            )
+            SELECT
+                Location.LocationName,
+                COALESCE(UnitsOut.UnitsOut, 0) AS UnitsOut,
+                COALESCE(OnHand.UnitsOnHand, 0) AS UnitsOnHand,
+                COALESCE(UnitsOut.UnitsOut, 0) / NULLIF(OnHand.UnitsOnHand, 0) AS Turnover
+            FROM Location
+            LEFT JOIN UnitsOut ON UnitsOut.LocationID = Location.LocationID
+            LEFT JOIN OnHand ON OnHand.LocationID = Location.LocationID
+            ORDER BY Turnover DESC NULLS LAST
+        """,
+        "LocationName",
+        "Turnover",
+    ),
+    "Discount Effectiveness": (
+        """
+            SELECT
+                Product.ProductName,
+                Discount.DiscountPercent,
+                Discount.StartDate,
+                Discount.EndDate,
+                SUM(CASE WHEN Sales.SaleDate BETWEEN Discount.StartDate AND Discount.EndDate
+                    THEN Sales.SaleAmount ELSE 0 END) AS RevenueDuring,
+                SUM(CASE WHEN Sales.SaleDate >= Discount.StartDate - (Discount.EndDate - Discount.StartDate + 1)
+                          AND Sales.SaleDate < Discount.StartDate
+                    THEN Sales.SaleAmount ELSE 0 END) AS RevenueBefore,
+                RevenueDuring / NULLIF(RevenueBefore, 0) - 1 AS Uplift
+            FROM Discount
+            JOIN Product ON Discount.ProductID = Product.ProductID
+            LEFT JOIN Sales ON Sales.ProductID = Discount.ProductID
+            GROUP BY Discount.DiscountID, Product.ProductName, Discount.DiscountPercent, Discount.StartDate, Discount.EndDate
+            ORDER BY Uplift DESC NULLS LAST
+        """,
+        "ProductName",
+        "Uplift",
+    ),
+}
+
+
+@st.cache_resource
+def analytics_store():
+    import duckdb
+
+    store = duckdb.connect(ANALYTICS_STORE_PATH)
+    # MySQL's DATEDIFF(end, start); DuckDB's own datediff takes a date part first
+    store.execute("CREATE OR REPLACE MACRO mysql_datediff(a, b) AS date_diff('day', CAST(b AS DATE), CAST(a AS DATE))")
+    store.execute(
+        """
+            CREATE TABLE IF NOT EXISTS snapshot_state (
+                table_name VARCHAR PRIMARY KEY,
+                watermark VARCHAR,
+                rows_copied BIGINT,
+                refreshed_at TIMESTAMP
+            )
+        """
+    )
+    return {"connection": store, "lock": threading.Lock(), "last_refresh": 0.0, "last_reconcile": 0.0}
+
+
+def analytics_mode_enabled():
+    return bool(st.session_state.get("analytics_mode"))
+
+
+# The MySQL dialect the insight queries use, rewritten for the DuckDB snapshot
+DUCKDB_REWRITES = [
+    (r"`", '"'),
+    (r"%s", "?"),
+    (r"\bCURDATE\(\)", "current_date"),
+    (r"\bDATEDIFF\(", "mysql_datediff("),
+]
+
+
+@lru_cache(maxsize=1024)
+def to_duckdb_sql(query):
+    for pattern, replacement in DUCKDB_REWRITES:
+        query = re.sub(pattern, replacement, query)
+    return query
+
+
+def analytics_query(query, params=None):
+    # DuckDB connections are not shared across threads; each caller gets its own cursor
+    cursor = analytics_store()["connection"].cursor()
+    try:
+        return cursor.execute(to_duckdb_sql(query), list(params or [])).df()
+    finally:
+        cursor.close()
+
+
+def run_insight_query(connection, query, params=None):
+    if analytics_mode_enabled():
+        import duckdb
+
+        try:
+            return analytics_query(query, params)
+        except duckdb.Error:
+            pass  # not answerable from the snapshot (missing table, dialect gap); ask MySQL
+    return fetch_table_data(connection, query, params)
+
+
+def columnar_frame(rows):
+    frame = pd.DataFrame(rows)
+    # Decimal columns arrive as Python objects; DuckDB wants native numerics
+    for column in frame.columns:
+        non_null = frame[column].dropna()
+        if not non_null.empty and isinstance(non_null.iloc[0], Decimal):
+            frame[column] = pd.to_numeric(frame[column])
+    return frame
+
+
+def store_snapshot_rows(store, table, frame, key=None, replace=False):
+    store.register("snapshot_batch", frame)
+    try:
+        if replace:
+            store.execute(f'CREATE OR REPLACE TABLE "{table}" AS SELECT * FROM snapshot_batch')
+            return
+        store.execute(f'CREATE TABLE IF NOT EXISTS "{table}" AS SELECT * FROM snapshot_batch LIMIT 0')
+        if key is not None:
+            store.execute(f'DELETE FROM "{table}" WHERE "{key}" IN (SELECT "{key}" FROM snapshot_batch)')
+        store.execute(f'INSERT INTO "{table}" BY NAME SELECT * FROM snapshot_batch')
+    finally:
+        store.unregister("snapshot_batch")
+
+
+def reconcile_snapshot_table(source, store, table, key):
+    # Deletes snapshot rows gone from the source and copies source rows the snapshot lacks;
+    # returns (copied, deleted)
+    source.execute(f"SELECT `{key}` FROM `{table}`")
+    source_keys = pd.DataFrame([row[key] for row in source.fetchall()], columns=[key])
+    store.register("source_keys", source_keys)
+    try:
+        deleted = store.execute(
+            f'DELETE FROM "{table}" WHERE "{key}" NOT IN (SELECT "{key}" FROM source_keys)'
+        ).fetchone()[0]
+        missing = [
+            row[0] for row in store.execute(
+                f'SELECT "{key}" FROM source_keys WHERE "{key}" NOT IN (SELECT "{key}" FROM "{table}")'
+            ).fetchall()
+        ]
+    finally:
+        store.unregister("source_keys")
+    for start in range(0, len(missing), ANALYTICS_RECONCILE_BATCH):
+        batch = missing[start:start + ANALYTICS_RECONCILE_BATCH]
+        source.execute(f"SELECT * FROM `{table}` WHERE `{key}` IN ({', '.join(['%s'] * len(batch))})", batch)
+        rows = source.fetchall()
+        if rows:
+            store_snapshot_rows(store, table, columnar_frame(rows), key=key)
+    return len(missing), deleted
+
+
+def refresh_analytics_snapshot(connection):
+    state = analytics_store()
+    store = state["connection"].cursor()
+    copied = {}
+    with state["lock"]:
+        source = read_connection(connection).cursor(dictionary=True)
+        reconcile = time.time() - state["last_reconcile"] >= ANALYTICS_RECONCILE_INTERVAL
+        for table, (key, mode) in ANALYTICS_TABLES.items():
+            row = store.execute("SELECT watermark FROM snapshot_state WHERE table_name = ?", [table]).fetchone()
+            watermark = row[0] if row else None
+            copied[table] = 0
+
+            if mode == "full":
+                source.execute(f"SELECT * FROM `{table}`")
+                rows = source.fetchall()
+                if rows:
+                    store_snapshot_rows(store, table, columnar_frame(rows), replace=True)
+                copied[table] = len(rows)
+            elif mode == "append":
+                while True:
+                    query = f"SELECT * FROM `{table}`"
+                    params = ()
+                    if watermark is not None:
+                        query += f" WHERE `{key}` > %s"
+                        params = (watermark,)
+                    source.execute(query + f" ORDER BY `{key}` LIMIT {ANALYTICS_CHUNK_SIZE}", params)
+                    rows = source.fetchall()
+                    if not rows:
+                        break
+                    store_snapshot_rows(store, table, columnar_frame(rows))
+                    watermark = str(rows[-1][key])
+                    copied[table] += len(rows)
+                    if len(rows) < ANALYTICS_CHUNK_SIZE:
+                        break
+            else:
+                # Pages on (UpdatedAt, key) so rows sharing the boundary timestamp are not skipped,
+                # and stops short of rows whose writers may not have committed yet
+                cursor_position = json.loads(watermark) if watermark and watermark.startswith("[") else None
+                while True:
+                    query = f"SELECT * FROM `{table}` WHERE `UpdatedAt` < NOW() - INTERVAL {ANALYTICS_COMMIT_LAG} SECOND"
+                    params = ()
+                    if cursor_position is not None:
+                        query += f" AND (`UpdatedAt`, `{key}`) > (%s, %s)"
+                        params = tuple(cursor_position)
+                    source.execute(query + f" ORDER BY `UpdatedAt`, `{key}` LIMIT {ANALYTICS_CHUNK_SIZE}", params)
+                    rows = source.fetchall()
+                    if not rows:
+                        break
+                    store_snapshot_rows(store, table, columnar_frame(rows), key=key)
+                    cursor_position = [str(rows[-1]["UpdatedAt"]), rows[-1][key]]
+                    copied[table] += len(rows)
+                    if len(rows) < ANALYTICS_CHUNK_SIZE:
+                        break
+                watermark = json.dumps(cursor_position) if cursor_position is not None else None
+
+            if reconcile and key is not None and watermark is not None:
+                missing, _ = reconcile_snapshot_table(source, store, table, key)
+                copied[table] += missing
+
+            store.execute(
+                "INSERT OR REPLACE INTO snapshot_state VALUES (?, ?, ?, current_timestamp)",
+                [table, watermark, copied[table]],
+            )
+        state["last_refresh"] = time.time()
+        if reconcile:
+            state["last_reconcile"] = state["last_refresh"]
+    store.close()
+    return copied
+
+
+def maybe_refresh_analytics_snapshot(connection):
+    if time.time() - analytics_store()["last_refresh"] < ANALYTICS_REFRESH_INTERVAL:
+        return
+    try:
+        refresh_analytics_snapshot(connection)
+    except Error as e:
+        st.warning(f"Analytics snapshot refresh failed, showing the previous snapshot: {e}")
+
+
+def time_query(run, repeat=3):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        run()
+        timings.append((time.perf_counter() - started) * 1000)
+    return float(np.median(timings))
+
+
+def analytics_dashboard(connection):
+    st.header("Analytics")
+
+    if st.button("Refresh Snapshot"):
+        with st.spinner("Copying changes from MySQL..."):
+            try:
+                copied = refresh_analytics_snapshot(connection)
+                st.success(f"Copied {sum(copied.values())} rows.")
+            except Error as e:
+                st.error(f"Error refreshing snapshot: {e}")
+
+    snapshot = analytics_query("SELECT * FROM snapshot_state ORDER BY table_name")
+    if snapshot.empty:
+        st.info("No snapshot yet. Refresh it to enable analytics mode.")
+        return
+    with st.expander("Snapshot Status"):
+        st.dataframe(snapshot, use_container_width=True)
+
+    tabs = st.tabs(list(ANALYTICS_DASHBOARDS) + ["Latency"])
+    for tab, (name, (query, label, value)) in zip(tabs, ANALYTICS_DASHBOARDS.items()):
+        with tab:
+            try:
+                data = analytics_query(query)
+            except Exception as e:
+                st.error(f"Error running {name}: {e}")
+                continue
+            if not data.empty:
+                bar_chart(data, x=label, y=value)
+                st.dataframe(data, use_container_width=True)
+            else:
+                st.info(f"No data available for {name.lower()}.")
+
+    with tabs[-1]:
+        st.write("Median of three runs of the customer totals query used by Customer Insights.")
+        if st.button("Compare Latency"):
+            where, params = date_filter("Sales.SaleDate")
+            query = f"""
+                SELECT Sales.CustomerID, SUM(Sales.SaleAmount) AS TotalSpent, COUNT(Sales.SalesID) AS TotalOrders
+                FROM Sales
+                WHERE {where}
+                GROUP BY Sales.CustomerID
+            """
+            results = pd.DataFrame(
+                [
+                    {"Engine": "MySQL", "MedianMs": time_query(lambda: fetch_table_data(connection, query, params))},
+                    {"Engine": "DuckDB", "MedianMs": time_query(lambda: analytics_query(query, params))},
+                ]
+            )
+            st.bar_chart(results, x="Engine", y="MedianMs", use_container_width=True)
+            st.dataframe(results, use_container_width=True)
+
+
+# Inventory valuation cube: quantity and value (Quantity x Product.Price) of available
+# stock by Category x Location x Supplier, built in one pass and then kept current from
+# InventoryMovement events on the change feed. A product's supplier is the supplier it
+# was most recently ordered from (0 when it has never been ordered). One row per cube
+# cell and day is persisted to InventoryValuationCube for the history view.
+VALUATION_CUBE_REBUILD_INTERVAL = 3600  # seconds; also picks up price and catalog changes
+VALUATION_DIMENSIONS = {"Category": "CategoryID", "Location": "LocationID", "Supplier": "SupplierID"}
+
+
+def setup_valuation_cube(connection):
+    cursor = connection.cursor()
+    cursor.execute(
+        """
+            CREATE TABLE IF NOT EXISTS InventoryValuationCube (
+                SnapshotDate DATE NOT NULL,
+                CategoryID INT NOT NULL,
+                LocationID INT NOT NULL,
+                SupplierID INT NOT NULL,
+                Quantity BIGINT NOT NULL,
+                Value DECIMAL(18, 2) NOT NULL,
+                PRIMARY KEY (SnapshotDate, CategoryID, LocationID, SupplierID)
+            )
+        """
+    )
+    connection.commit()
+
+
+def product_supplier_map(connection):
+    suppliers = fetch_table_data(
+        connection,
+        """
+            SELECT OrderItem.ProductID, `Order`.SupplierID, MAX(`Order`.OrderDate) AS LastOrdered
+            FROM OrderItem
+            JOIN `Order` ON OrderItem.OrderID = `Order`.OrderID
+            GROUP BY OrderItem.ProductID, `Order`.SupplierID
+        """,
+    )
+    if suppliers.empty:
+        return pd.Series(dtype="int64", name="SupplierID")
+    latest = suppliers.sort_values("LastOrdered").drop_duplicates("ProductID", keep="last")
+    return latest.set_index("ProductID")["SupplierID"]
+
+
+class ValuationCube:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.products = None  # ProductID -> CategoryID, SupplierID, Price
+        self.cells = None  # (CategoryID, LocationID, SupplierID) -> Quantity, Value
+        # Movements below settled_below are in the cells; above it, applied ones are listed
+        # (MovementID -> CreatedAt) so late commits of lower IDs are still applied once
+        self.settled_below = 1
+        self.applied = {}
+        self.built_at = 0.0
+
+    def rebuild(self, connection):
+        reader = read_connection(connection)
+        reader.rollback()  # start a fresh snapshot so the watermark and the stock agree
+        cursor = reader.cursor(dictionary=True)
+        # IDs up to the last movement older than the overlap have all committed; newer ones may still land
+        cursor.execute(
+            "SELECT COALESCE(MAX(MovementID), 0) AS Settled FROM InventoryMovement WHERE CreatedAt < NOW() - INTERVAL %s SECOND",
+            (CDC_POLL_OVERLAP,),
+        )
+        settled = cursor.fetchone()["Settled"]
+        cursor.execute("SELECT MovementID, CreatedAt FROM InventoryMovement WHERE MovementID > %s", (settled,))
+        recent = {row["MovementID"]: row["CreatedAt"] for row in cursor.fetchall()}
+        cursor.execute(
+            f"""
+                SELECT Inventory.ProductID, Inventory.LocationID,
+                       Inventory.Quantity + COALESCE(Pending.Delta, 0) AS Quantity
+                FROM Inventory
+                LEFT JOIN ({PENDING_MOVEMENTS_SUBQUERY}) AS Pending
+                    ON Pending.ProductID = Inventory.ProductID AND Pending.LocationID = Inventory.LocationID
+            """
+        )
+        stock = pd.DataFrame(cursor.fetchall(), columns=["ProductID", "LocationID", "Quantity"])
+        cursor.execute("SELECT ProductID, CategoryID, Price FROM Product")
+        products = pd.DataFrame(cursor.fetchall(), columns=["ProductID", "CategoryID", "Price"]).set_index("ProductID")
+        reader.rollback()
+
+        products["Price"] = pd.to_numeric(products["Price"]).fillna(0.0)
+        products["CategoryID"] = products["CategoryID"].fillna(0).astype("int64")
+        products["SupplierID"] = product_supplier_map(connection).reindex(products.index).fillna(0).astype("int64")
+        cells = self.contributions(products, stock)
+
+        with self.lock:
+            self.products = products
+            self.cells = cells
+            self.settled_below = settled + 1
+            self.applied = recent
+            self.built_at = time.time()
+
+    @staticmethod
+    def contributions(products, stock):
+        stock = stock.astype({"Quantity": "int64"})
+        dims = products.reindex(stock["ProductID"])
+        frame = pd.DataFrame(
+            {
+                "CategoryID": dims["CategoryID"].fillna(0).astype("int64").to_numpy(),
+                "LocationID": stock["LocationID"].astype("int64").to_numpy(),
+                "SupplierID": dims["SupplierID"].fillna(0).astype("int64").to_numpy(),
+                "Quantity": stock["Quantity"].to_numpy(),
+                "Value": stock["Quantity"].to_numpy() * dims["Price"].fillna(0.0).to_numpy(),
+            }
+        )
+        return frame.groupby(list(VALUATION_DIMENSIONS.values())).sum()
+
+    def apply_movements(self, events):
+        with self.lock:
+            if self.cells is None:
+                return
+            rows = [
+                event["row"] for event in events
+                if event["op"] != "delete"
+                and event["row"]["MovementID"] >= self.settled_below
+                and event["row"]["MovementID"] not in self.applied
+            ]
+            if not rows:
+                return
+            movements = pd.DataFrame(rows)[["ProductID", "LocationID", "Quantity", "MovementID"]]
+            cells = self.cells.add(self.contributions(self.products, movements), fill_value=0)
+            self.cells = cells.astype({"Quantity": "int64"})
+
+            self.applied.update((row["MovementID"], row["CreatedAt"]) for row in rows)
+            # Anything inserted more than CDC_POLL_OVERLAP before the newest movement has committed
+            cutoff = max(self.applied.values()) - timedelta(seconds=CDC_POLL_OVERLAP)
+            settled = [movement_id for movement_id, created_at in self.applied.items() if created_at < cutoff]
+            if settled:
+                self.settled_below = max(self.settled_below, max(settled) + 1)
+                self.applied = {
+                    movement_id: created_at for movement_id, created_at in self.applied.items()
+                    if movement_id >= self.settled_below
+                }
 
-# Supplier Details
-def supplier_details(connection):
-    st.header("Supplier Details")
+    def rollup(self, levels, filters=None):
+        with self.lock:
+            cells = self.cells
+        if cells is None:
+            return pd.DataFrame()
+        frame = cells.reset_index()
+        for column, value in (filters or {}).items():
+            frame = frame[frame[column] == value]
+        return frame.groupby(levels, as_index=False)[["Quantity", "Value"]].sum()
+
+
+@st.cache_resource
+def valuation_cube():
+    cube = ValuationCube()
+    bus, _ = change_feed()
+    bus.subscribe("valuation-cube", ("InventoryMovement",), cube.apply_movements)
+    return cube
+
+
+def persist_valuation_snapshot(connection, cube):
+    cells = cube.rollup(list(VALUATION_DIMENSIONS.values()))
+    today = date.today()
+    rows = [
+        (today, int(row.CategoryID), int(row.LocationID), int(row.SupplierID), int(row.Quantity), round(float(row.Value), 2))
+        for row in cells.itertuples()
+    ]
+    run_in_transaction(
+        connection,
+        lambda cursor: cursor.executemany(
+            """
+                INSERT INTO InventoryValuationCube (SnapshotDate, CategoryID, LocationID, SupplierID, Quantity, Value)
+                VALUES (%s, %s, %s, %s, %s, %s)
+                ON DUPLICATE KEY UPDATE Quantity = VALUES(Quantity), Value = VALUES(Value)
+            """,
+            rows,
+        ),
+    )
+    return len(cells)
+
+
+def valuation_snapshot_job(context, params):
+    connection = open_connection()
+    try:
+        cube = valuation_cube()
+        context.progress(0, 2)
+        cube.rebuild(connection)
+        context.progress(1, 2)
+        cells = persist_valuation_snapshot(connection, cube)
+        context.progress(2, 2)
+        return f"Stored {cells} valuation cells for {date.today()}."
+    finally:
+        connection.close()
 
-    # Query to fetch supplier details with associated products and categories
-    query = """
-        SELECT 
-            Supplier.SupplierID,
-            Supplier.SupplierName,
-            Supplier.ContactInfo,
-            Product.ProductName,
-            Category.CategoryName,
-            Product.Price,
-            Product.Quantity
-        FROM Supplier
-        LEFT JOIN Product ON Supplier.SupplierID = Product.ProductID
-        LEFT JOIN Category ON Product.CategoryID = Category.CategoryID
-        ORDER BY Supplier.SupplierName
-    """
-    supplier_data = fetch_table_data(connection, query)
 
-    if not supplier_data.empty:
-        st.dataframe(supplier_data, use_container_width=True)
+def dimension_names(connection, dimension):
+    if dimension == "Supplier":
+        names = reference_data(connection, "Supplier").set_index("SupplierID")["SupplierName"]
+    elif dimension == "Location":
+        names = reference_data(connection, "Location").set_index("LocationID")["LocationName"]
     else:
-        st.info("No supplier details found.")
+        names = reference_data(connection, "Category").set_index("CategoryID")["CategoryName"]
+    return names
 
-def get_supplier_details(connection):
-    st.header("View Supplier Details")
 
-    query = """
-        SELECT 
-            SupplierID,
-            SupplierName,
-            ContactInfo
-        FROM Supplier
-        ORDER BY SupplierName
-    """
-    supplier_data = fetch_table_data(connection, query)
+def inventory_valuation(connection):
+    st.header("Inventory Valuation")
 
-    if not supplier_data.empty:
-        st.dataframe(supplier_data, use_container_width=True)
-    else:
-        st.info("No supplier details found.")
+    cube = valuation_cube()
+    if cube.cells is None or time.time() - cube.built_at > VALUATION_CUBE_REBUILD_INTERVAL:
+        with st.spinner("Building valuation cube..."):
+            cube.rebuild(connection)
 
-def add_supplier(connection):
-    st.header("Add Supplier")
+    tab1, tab2 = st.tabs(["Drill Down", "History"])
 
-    supplier_name = st.text_input("Supplier Name")
-    contact_info = st.text_input("Contact Information")
+    with tab1:
+        path = st.multiselect("Drill Path", list(VALUATION_DIMENSIONS), default=list(VALUATION_DIMENSIONS))
+        if not path:
+            st.info("Choose at least one dimension.")
+        else:
+            started = time.perf_counter()
+            filters = {}
+            # Every level but the last narrows the cube to one member
+            for dimension in path[:-1]:
+                column = VALUATION_DIMENSIONS[dimension]
+                members = cube.rollup([column], filters)
+                names = dimension_names(connection, dimension)
+                choice = st.selectbox(
+                    dimension,
+                    members[column],
+                    format_func=lambda member, names=names: names.get(member, "Unknown"),
+                    key=f"valuation_{dimension}",
+                )
+                if choice is None:
+                    break
+                filters[column] = choice
+
+            dimension = path[-1]
+            column = VALUATION_DIMENSIONS[dimension]
+            result = cube.rollup([column], filters)
+            names = dimension_names(connection, dimension).astype(object)  # a categorical cannot take "Unknown"
+            result.insert(0, dimension, result[column].map(names).fillna("Unknown"))
+            elapsed_ms = (time.perf_counter() - started) * 1000
+
+            st.write(f"**Total Value:** {result['Value'].sum():,.2f} ({result['Quantity'].sum():,} units)")
+            bar_chart(result, x=dimension, y="Value")
+            st.dataframe(result.sort_values("Value", ascending=False), use_container_width=True)
+            st.caption(f"Answered from the cube in {elapsed_ms:.1f} ms.")
 
-    if st.button("Add Supplier"):
-        if supplier_name and contact_info:
-            query = """
-                INSERT INTO Supplier (SupplierName, ContactInfo)
-                VALUES (%s, %s)
+    with tab2:
+        history = fetch_table_data(
+            connection,
             """
-            if execute_query(connection, query, (supplier_name, contact_info)):
-                st.success(f"Supplier '{supplier_name}' added successfully!")
+                SELECT SnapshotDate, SUM(Quantity) AS Quantity, SUM(Value) AS Value
+                FROM InventoryValuationCube
+                GROUP BY SnapshotDate
+                ORDER BY SnapshotDate
+            """,
+        )
+        if not history.empty:
+            line_chart(history, x="SnapshotDate", y="Value")
+            st.dataframe(history, use_container_width=True)
         else:
-            st.error("Please fill in all fields.")
-
-def delete_supplier(connection):
-    st.header("Delete Supplier")
+            st.info("No daily valuation snapshots yet. Run the valuation_snapshot job to store one.")
 
-    supplier_id = st.number_input("Enter Supplier ID to Delete", min_value=1, step=1)
+        if st.button("Store Today's Snapshot"):
+            try:
+                st.success(f"Stored {persist_valuation_snapshot(connection, cube)} valuation cells.")
+            except Error as e:
+                st.error(f"Error storing valuation snapshot: {e}")
 
-    if st.button("Delete Supplier"):
-        query = "DELETE FROM Supplier WHERE SupplierID = %s"
-        if execute_query(connection, query, (supplier_id,)):
-            st.success(f"Supplier ID {supplier_id} deleted successfully!")
-        else:
-            st.error("Failed to delete supplier. Please check the Supplier ID.")
 
 def customer_insights(connection):
     st.header("Customer Purchase Insights")
@@ -441,12 +4996,435 @@ def customer_insights(connection):
     """
     customer_data = fetch_table_data(connection, query)
     if not customer_data.empty:
-        st.bar_chart(customer_data, x="CustomerName", y="TotalSpent", use_container_width=True)
+        bar_chart(customer_data, x="CustomerName", y="TotalSpent")
         st.write("Detailed Insights:")
         st.dataframe(customer_data, use_container_width=True)
     else:
         st.info("No customer purchase data available.")
 
+# Supplier lead times: one fact row per order (supplier, order date, units ordered and
+# first shipment date) is cached per process and topped up from OrderID/ShipmentID
+# watermarks; per-supplier lead-time percentiles, fill rates and late counts are
+# recomputed from the cached facts in one grouped pass. Orders count towards fill rate
+# once shipped or older than SUPPLIER_LATE_DAYS.
+SUPPLIER_LATE_DAYS = 7
+SUPPLIER_FACTS_REBUILD_INTERVAL = 86400  # full reload drops archived orders
+LEAD_TIME_PERCENTILES = {"P50": 0.5, "P90": 0.9, "P95": 0.95}
+REORDER_LEAD_PERCENTILE = "P90"
+REORDER_DEFAULT_LEAD_DAYS = 14  # for products never ordered or suppliers never shipped
+REORDER_DEMAND_DAYS = 90
+REORDER_SERVICE_Z = 1.65  # ~95% chance of not running out during a lead time
+SUPPLIER_ORDER_FACTS_QUERY = """
+    SELECT
+        `Order`.OrderID,
+        `Order`.SupplierID,
+        `Order`.OrderDate,
+        (SELECT COALESCE(SUM(OrderItem.Quantity), 0) FROM OrderItem WHERE OrderItem.OrderID = `Order`.OrderID) AS Units,
+        (SELECT MIN(Shipment.ShipmentDate) FROM Shipment WHERE Shipment.OrderID = `Order`.OrderID) AS FirstShipmentDate
+    FROM `Order`
+    WHERE ({where}) AND `Order`.Status <> 'Draft'
+"""
+
+
+class SupplierLeadTimes:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.facts = None
+        self.order_watermark = 0
+        self.shipment_watermark = 0
+        self.built_at = 0.0
+
+    def refresh(self, connection):
+        with self.lock:
+            cursor = connection.cursor()
+            cursor.execute("SELECT (SELECT COALESCE(MAX(OrderID), 0) FROM `Order`), (SELECT COALESCE(MAX(ShipmentID), 0) FROM Shipment)")
+            order_watermark, shipment_watermark = cursor.fetchone()
+
+            if self.facts is None or time.time() - self.built_at > SUPPLIER_FACTS_REBUILD_INTERVAL:
+                facts = fetch_table_data(connection, SUPPLIER_ORDER_FACTS_QUERY.format(where="1 = 1"))
+                self.built_at = time.time()
+            else:
+                if order_watermark == self.order_watermark and shipment_watermark == self.shipment_watermark:
+                    return
+                changed = fetch_table_data(
+                    connection,
+                    SUPPLIER_ORDER_FACTS_QUERY.format(
+                        where="`Order`.OrderID > %s OR `Order`.OrderID IN (SELECT OrderID FROM Shipment WHERE ShipmentID > %s)"
+                    ),
+                    (self.order_watermark, self.shipment_watermark),
+                )
+                facts = pd.concat([self.facts, changed], ignore_index=True).drop_duplicates("OrderID", keep="last")
+
+            self.facts = facts
+            self.order_watermark = order_watermark
+            self.shipment_watermark = shipment_watermark
+
+    def stats(self):
+        with self.lock:
+            facts = self.facts
+        if facts is None or facts.empty:
+            return pd.DataFrame()
+
+        order_date = pd.to_datetime(facts["OrderDate"])
+        shipped_date = pd.to_datetime(facts["FirstShipmentDate"])
+        units = pd.to_numeric(facts["Units"]).fillna(0)
+        lead_days = (shipped_date - order_date).dt.days.clip(lower=0)
+        age_days = (pd.Timestamp(date.today()) - order_date).dt.days
+        shipped = shipped_date.notna()
+        due = shipped | (age_days > SUPPLIER_LATE_DAYS)
+        frame = pd.DataFrame(
+            {
+                "SupplierID": facts["SupplierID"],
+                "LeadDays": lead_days,
+                "Shipped": shipped,
+                "Late": shipped & (lead_days > SUPPLIER_LATE_DAYS),
+                "Overdue": ~shipped & (age_days > SUPPLIER_LATE_DAYS),
+                "DueUnits": units.where(due, 0),
+                "ShippedUnits": units.where(shipped & due, 0),
+            }
+        )
+
+        grouped = frame.groupby("SupplierID")
+        stats = grouped.agg(
+            Orders=("Shipped", "size"),
+            Shipped=("Shipped", "sum"),
+            LateShipments=("Late", "sum"),
+            OverdueOrders=("Overdue", "sum"),
+            DueUnits=("DueUnits", "sum"),
+            ShippedUnits=("ShippedUnits", "sum"),
+            MeanLeadDays=("LeadDays", "mean"),
+        )
+        percentiles = grouped["LeadDays"].quantile(list(LEAD_TIME_PERCENTILES.values())).unstack()
+        percentiles.columns = list(LEAD_TIME_PERCENTILES)
+        stats = stats.join(percentiles)
+        stats["FillRate"] = np.divide(
+            stats["ShippedUnits"], stats["DueUnits"], out=np.full(len(stats), np.nan), where=stats["DueUnits"] > 0
+        )
+        return stats.drop(columns=["DueUnits", "ShippedUnits"]).reset_index()
+
+
+@st.cache_resource
+def supplier_lead_times():
+    return SupplierLeadTimes()
+
+
+def supplier_lead_time_stats(connection):
+    lead_times = supplier_lead_times()
+    lead_times.refresh(connection)
+    stats = lead_times.stats()
+    if stats.empty:
+        return stats
+    names = reference_data(connection, "Supplier")[["SupplierID", "SupplierName"]]
+    return names.merge(stats, on="SupplierID", how="right")
+
+
+def supplier_lead_time_lookup(connection, percentile=REORDER_LEAD_PERCENTILE):
+    stats = supplier_lead_time_stats(connection)
+    if stats.empty:
+        return pd.Series(dtype=float)
+    return stats.set_index("SupplierID")[percentile].dropna()
+
+
+def product_lead_times(connection):
+    # Each product takes the lead time of the supplier it was last ordered from
+    suppliers = product_supplier_map(connection)
+    lead_days = suppliers.map(supplier_lead_time_lookup(connection))
+    return lead_days.fillna(REORDER_DEFAULT_LEAD_DAYS)
+
+
+def reorder_points(connection):
+    available = fetch_table_data(
+        connection,
+        f"""
+            SELECT Product.ProductID, Product.ProductName,
+                   COALESCE(SUM(Inventory.Quantity + COALESCE(Pending.Delta, 0)), 0) AS Available
+            FROM Product
+            LEFT JOIN Inventory ON Inventory.ProductID = Product.ProductID
+            LEFT JOIN ({PENDING_MOVEMENTS_SUBQUERY}) AS Pending
+                ON Pending.ProductID = Inventory.ProductID AND Pending.LocationID = Inventory.LocationID
+            GROUP BY Product.ProductID, Product.ProductName
+        """,
+    )
+    if available.empty:
+        return available
+    demand = fetch_table_data(
+        connection,
+        """
+            SELECT ProductID, DATEDIFF(CURDATE(), DATE(CreatedAt)) AS DaysAgo, -SUM(Quantity) AS Units
+            FROM InventoryMovement
+            WHERE MovementType = 'Reservation' AND CreatedAt >= CURDATE() - INTERVAL %s DAY
+            GROUP BY ProductID, DaysAgo
+        """,
+        (REORDER_DEMAND_DAYS,),
+    )
+
+    # Daily demand as a product x day matrix, zero on days without reservations
+    products = available["ProductID"].to_numpy()
+    daily = np.zeros((len(products), REORDER_DEMAND_DAYS + 1))
+    if not demand.empty:
+        rows = pd.Index(products).get_indexer(demand["ProductID"])
+        known = rows >= 0
+        np.add.at(
+            daily,
+            (rows[known], demand["DaysAgo"].to_numpy(dtype=int)[known].clip(0, REORDER_DEMAND_DAYS)),
+            pd.to_numeric(demand["Units"]).to_numpy(dtype=float)[known],
+        )
+    lead_days = product_lead_times(connection).reindex(products).fillna(REORDER_DEFAULT_LEAD_DAYS).to_numpy()
+
+    points = available.assign(
+        Available=pd.to_numeric(available["Available"]),
+        DailyDemand=daily.mean(axis=1),
+        LeadDays=lead_days,
+    )
+    points["SafetyStock"] = REORDER_SERVICE_Z * daily.std(axis=1) * np.sqrt(lead_days)
+    points["ReorderPoint"] = np.ceil(points["DailyDemand"] * lead_days + points["SafetyStock"])
+    points["BelowReorderPoint"] = (points["Available"] <= points["ReorderPoint"]) & (points["DailyDemand"] > 0)
+    return points
+
+
+def reorder_points_page(connection):
+    st.header("Reorder Points")
+    st.caption(
+        f"Demand over the last {REORDER_DEMAND_DAYS} days; lead time is the {REORDER_LEAD_PERCENTILE} "
+        f"of the product's last supplier ({REORDER_DEFAULT_LEAD_DAYS} days when unknown)."
+    )
+    try:
+        points = reorder_points(connection)
+    except Error as e:
+        st.error(f"Error fetching data: {e}")
+        return
+    if points.empty:
+        st.info("No products found.")
+        return
+
+    below_only = st.checkbox("Only products at or below their reorder point", value=True)
+    if below_only:
+        points = points[points["BelowReorderPoint"]]
+    st.dataframe(points.sort_values("Available"), use_container_width=True)
+
+
+# Replenishment: products whose stock plus open replenishment orders is at or below
+# their reorder point are ordered back up to the reorder point plus
+# REPLENISH_COVER_DAYS of demand, from the supplier they were last ordered from, at
+# today's discounted price. The plan is computed for the whole catalog in one pass
+# over a few set-based queries; the replenishment job writes it as one Draft order
+# per supplier, REPLENISH_ORDERS_PER_TRANSACTION orders per transaction. Orders it
+# created count as on order until they are Delivered.
+REPLENISH_COVER_DAYS = 30
+REPLENISH_ORDERS_PER_TRANSACTION = 200
+ORDER_STATUSES = ["Draft", "Pending", "Shipped", "Delivered"]
+
+
+def setup_replenishment(connection):
+    cursor = connection.cursor()
+    cursor.execute(
+        """
+            CREATE TABLE IF NOT EXISTS ReplenishmentOrder (
+                OrderID INT PRIMARY KEY,
+                RunID CHAR(32) NOT NULL,
+                CreatedAt DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+                INDEX idx_replenishment_run (RunID)
+            )
+        """
+    )
+    connection.commit()
+
+
+def discounted_prices(connection):
+    prices = fetch_table_data(
+        connection,
+        """
+            SELECT Product.ProductID, Product.Price, COALESCE(MAX(Discount.DiscountPercent), 0) AS DiscountPercent
+            FROM Product
+            LEFT JOIN Discount ON Discount.ProductID = Product.ProductID
+                AND CURDATE() BETWEEN Discount.StartDate AND Discount.EndDate
+            GROUP BY Product.ProductID, Product.Price
+        """,
+    )
+    if prices.empty:
+        return pd.Series(dtype=float)
+    prices = prices.set_index("ProductID")
+    return (pd.to_numeric(prices["Price"]) * (1 - pd.to_numeric(prices["DiscountPercent"]) / 100)).round(2)
+
+
+def open_replenishment_units(connection):
+    on_order = fetch_table_data(
+        connection,
+        """
+            SELECT OrderItem.ProductID, SUM(OrderItem.Quantity) AS Units
+            FROM ReplenishmentOrder
+            JOIN `Order` ON `Order`.OrderID = ReplenishmentOrder.OrderID
+            JOIN OrderItem ON OrderItem.OrderID = `Order`.OrderID
+            WHERE `Order`.Status <> 'Delivered'
+            GROUP BY OrderItem.ProductID
+        """,
+    )
+    if on_order.empty:
+        return pd.Series(dtype=float)
+    return pd.to_numeric(on_order.set_index("ProductID")["Units"])
+
+
+def replenishment_plan(connection, cover_days=REPLENISH_COVER_DAYS):
+    points = reorder_points(connection)
+    if points.empty:
+        return points
+    products = points["ProductID"]
+    plan = points.assign(
+        OnOrder=products.map(open_replenishment_units(connection)).fillna(0).to_numpy(),
+        SupplierID=products.map(product_supplier_map(connection)).to_numpy(),
+        UnitPrice=products.map(discounted_prices(connection)).to_numpy(),
+    )
+    position = plan["Available"] + plan["OnOrder"]
+    target = np.ceil(plan["ReorderPoint"] + plan["DailyDemand"] * cover_days)
+    short = (plan["DailyDemand"] > 0) & (position <= plan["ReorderPoint"])
+    plan = plan[short].assign(OrderQuantity=np.maximum(target - position, 1)[short].astype(np.int64))
+    plan["LineValue"] = plan["OrderQuantity"] * plan["UnitPrice"]
+    return plan.sort_values(["SupplierID", "ProductID"]).reset_index(drop=True)
+
+
+def create_replenishment_orders(connection, plan, run_id, progress=None):
+    # plan rows without a known supplier or price are left for a buyer
+    lines = plan.dropna(subset=["SupplierID", "UnitPrice"])
+    suppliers = lines.groupby("SupplierID", sort=True)
+    supplier_ids = list(suppliers.groups)
+    order_date = date.today()
+    created = 0
+    for start in range(0, len(supplier_ids), REPLENISH_ORDERS_PER_TRANSACTION):
+        chunk = supplier_ids[start:start + REPLENISH_ORDERS_PER_TRANSACTION]
+
+        def place_orders(cursor):
+            order_ids, items = [], []
+            for supplier_id in chunk:
+                cursor.execute(
+                    "INSERT INTO `Order` (SupplierID, OrderDate, Status) VALUES (%s, %s, 'Draft')",
+                    (int(supplier_id), order_date),
+                )
+                order_id = cursor.lastrowid
+                order_ids.append((order_id, run_id))
+                group = suppliers.get_group(supplier_id)
+                items.extend(
+                    zip(
+                        [order_id] * len(group),
+                        group["ProductID"].astype(int).tolist(),
+                        group["OrderQuantity"].astype(int).tolist(),
+                        group["UnitPrice"].astype(float).tolist(),
+                    )
+                )
+            cursor.executemany(
+                "INSERT INTO OrderItem (OrderID, ProductID, Quantity, Price) VALUES (%s, %s, %s, %s)", items
+            )
+            cursor.executemany("INSERT INTO ReplenishmentOrder (OrderID, RunID) VALUES (%s, %s)", order_ids)
+            return len(order_ids)
+
+        created += run_in_transaction(connection, place_orders)
+        if progress:
+            progress(start + len(chunk), len(supplier_ids))
+    return created, len(lines), len(plan) - len(lines)
+
+
+def replenishment_job(context, params):
+    connection = open_connection()
+    try:
+        plan = replenishment_plan(connection, int(params.get("cover_days", REPLENISH_COVER_DAYS)))
+        if plan.empty:
+            return "No products need replenishing."
+        orders, lines, skipped = create_replenishment_orders(connection, plan, uuid.uuid4().hex, context.progress)
+        message = f"Created {orders} draft orders with {lines} lines."
+        if skipped:
+            message += f" {skipped} products have no known supplier or price."
+        return message
+    finally:
+        connection.close()
+
+
+def replenishment_page(connection):
+    st.header("Replenishment")
+    cover_days = st.number_input("Days of Demand to Order", min_value=1, step=1, value=REPLENISH_COVER_DAYS)
+
+    try:
+        started = time.perf_counter()
+        plan = replenishment_plan(connection, cover_days)
+        elapsed_ms = (time.perf_counter() - started) * 1000
+    except Error as e:
+        st.error(f"Error fetching data: {e}")
+        return
+    if plan.empty:
+        st.info("No products need replenishing.")
+    else:
+        unassigned = plan["SupplierID"].isna() | plan["UnitPrice"].isna()
+        st.write(
+            f"**{len(plan):,} products below their reorder point** across "
+            f"{plan['SupplierID'].nunique():,} suppliers, worth {plan['LineValue'].sum():,.2f} "
+            f"(planned in {elapsed_ms:.0f} ms)."
+        )
+        if unassigned.any():
+            st.warning(f"{int(unassigned.sum())} products have never been ordered from a supplier and are left out.")
+        st.dataframe(
+            plan[["SupplierID", "ProductID", "ProductName", "Available", "OnOrder", "ReorderPoint", "OrderQuantity",
+                  "UnitPrice", "LineValue"]],
+            hide_index=True,
+            use_container_width=True,
+        )
+        if st.button("Create Draft Orders"):
+            job_id = job_scheduler().submit("replenishment", {"cover_days": int(cover_days)}, current_user())
+            st.success(f"Replenishment job {job_id} queued.")
+
+    st.subheader("Draft Orders")
+    drafts = fetch_table_data(
+        connection,
+        """
+            SELECT `Order`.OrderID, `Order`.SupplierID, `Order`.OrderDate,
+                   COUNT(OrderItem.OrderItemID) AS Lines, SUM(OrderItem.Quantity * OrderItem.Price) AS OrderValue
+            FROM ReplenishmentOrder
+            JOIN `Order` ON `Order`.OrderID = ReplenishmentOrder.OrderID
+            LEFT JOIN OrderItem ON OrderItem.OrderID = `Order`.OrderID
+            WHERE `Order`.Status = 'Draft'
+            GROUP BY `Order`.OrderID, `Order`.SupplierID, `Order`.OrderDate
+            ORDER BY `Order`.OrderID
+        """,
+    )
+    if drafts.empty:
+        st.info("No draft orders.")
+        return
+    st.dataframe(drafts, hide_index=True, use_container_width=True)
+    approve = st.multiselect("Orders to Release", drafts["OrderID"].tolist())
+    if st.button("Release to Suppliers", disabled=not approve):
+        placeholders = ", ".join(["%s"] * len(approve))
+
+        def release(cursor):
+            cursor.execute(
+                f"""
+                    UPDATE `Order` SET Status = 'Pending', OrderDate = CURDATE(), Version = Version + 1
+                    WHERE Status = 'Draft' AND OrderID IN ({placeholders})
+                """,
+                tuple(int(order_id) for order_id in approve),
+            )
+            return cursor.rowcount
+
+        try:
+            released = run_in_transaction(connection, release)
+            st.success(f"{released} orders released.")
+        except Error as e:
+            st.error(f"Error releasing orders: {e}")
+
+
+@page_fragment("Supplier Orders")
+def supplier_orders_chart(connection):
+    st.subheader("Orders Placed")
+    start_date, end_date = sales_period_inputs("supplier_performance")
+    try:
+        with fragment_connection(connection) as live:
+            order_totals = supplier_order_totals(live, start_date, end_date)
+    except Error as e:
+        st.error(f"Error fetching data: {e}")
+        order_totals = pd.DataFrame()
+    if not order_totals.empty:
+        bar_chart(order_totals, x="SupplierName", y="OrderValue")
+        st.dataframe(order_totals, use_container_width=True)
+    else:
+        st.info("No orders placed in this period.")
+
+
 def supplier_performance_dashboard(connection):
     st.header("Supplier Performance")
     query = """
@@ -461,65 +5439,388 @@ def supplier_performance_dashboard(connection):
     """
     supplier_data = fetch_table_data(connection, query)
     if not supplier_data.empty:
-        st.bar_chart(supplier_data, x="SupplierName", y="TotalQuantity", use_container_width=True)
+        bar_chart(supplier_data, x="SupplierName", y="TotalQuantity")
         st.dataframe(supplier_data, use_container_width=True)
     else:
         st.info("No supplier data available.")
 
+    supplier_orders_chart(connection)
+
+    st.subheader("Lead Times")
+    try:
+        lead_times = supplier_lead_time_stats(connection)
+    except Error as e:
+        st.error(f"Error fetching data: {e}")
+        lead_times = pd.DataFrame()
+    if not lead_times.empty:
+        bar_chart(lead_times, x="SupplierName", y=list(LEAD_TIME_PERCENTILES), other="mean")
+        st.dataframe(lead_times, use_container_width=True)
+    else:
+        st.info("No shipments recorded yet.")
+
+# RFM segmentation: every customer with sales gets recency (days since last sale),
+# frequency and monetary features, scored 1-5 against quintile edges of the whole
+# population and mapped to a named segment. A full rebuild recalibrates the edges
+# (rfm_rebuild job); between rebuilds only customers with sales past the stored
+# SalesID watermark are rescored against the existing edges, and everyone else's
+# recency is aged from their stored LastSaleDate once a day. Both run in rfm_rebuild
+# jobs; the segmentation page only reads CustomerSegment.
+RFM_BATCH_SIZE = 5000
+RFM_REFRESH_INTERVAL = 300  # seconds between background refreshes per server process
+RFM_MEMBER_LIMIT = 1000
+RFM_SEGMENTS = [
+    "Champions",
+    "Loyal Customers",
+    "Potential Loyalists",
+    "New Customers",
+    "Need Attention",
+    "At Risk",
+    "Hibernating",
+]
+RFM_FEATURES_QUERY = """
+    SELECT
+        Sales.CustomerID,
+        DATEDIFF(CURDATE(), MAX(Sales.SaleDate)) AS Recency,
+        MAX(Sales.SaleDate) AS LastSaleDate,
+        COUNT(Sales.SalesID) AS Frequency,
+        SUM(Sales.SaleAmount) AS Monetary,
+        MAX(Sales.SalesID) AS LastSalesID
+    FROM Sales
+    WHERE {where}
+    GROUP BY Sales.CustomerID
+"""
+RFM_AGGREGATES = {"Recency": "min", "LastSaleDate": "max", "Frequency": "sum", "Monetary": "sum", "LastSalesID": "max"}
+
+
+def setup_customer_segments(connection):
+    cursor = connection.cursor()
+    cursor.execute(
+        """
+            CREATE TABLE IF NOT EXISTS CustomerSegment (
+                CustomerID INT PRIMARY KEY,
+                Recency INT NOT NULL,
+                Frequency INT NOT NULL,
+                Monetary DECIMAL(18, 2) NOT NULL,
+                RScore TINYINT NOT NULL,
+                FScore TINYINT NOT NULL,
+                MScore TINYINT NOT NULL,
+                Segment VARCHAR(32) NOT NULL,
+                LastSaleDate DATE NULL,
+                UpdatedAt TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+                INDEX idx_segment_monetary (Segment, Monetary)
+            )
+        """
+    )
+    ensure_column(connection, "CustomerSegment", "LastSaleDate", "DATE NULL")
+    # Rows scored before LastSaleDate was stored: their Recency was counted from the day they were written
+    cursor.execute(
+        "UPDATE CustomerSegment SET LastSaleDate = DATE(UpdatedAt) - INTERVAL Recency DAY WHERE LastSaleDate IS NULL"
+    )
+    cursor.execute(
+        """
+            CREATE TABLE IF NOT EXISTS SegmentationState (
+                StateID TINYINT PRIMARY KEY,
+                SalesWatermark BIGINT NOT NULL,
+                Thresholds TEXT NOT NULL,
+                RebuiltAt DATETIME NOT NULL
+            )
+        """
+    )
+    connection.commit()
+
+
+def rfm_thresholds(features):
+    quintiles = [0.2, 0.4, 0.6, 0.8]
+    return {
+        column: np.quantile(features[column].to_numpy(dtype=float), quintiles).tolist()
+        for column in ("Recency", "Frequency", "Monetary")
+    }
+
+
+def score_rfm(features, thresholds):
+    def score(column):
+        return 1 + np.searchsorted(thresholds[column], features[column].to_numpy(dtype=float), side="left")
+
+    r = 6 - score("Recency")  # fewer days since the last sale scores higher
+    f = score("Frequency")
+    m = score("Monetary")
+    segment = np.select(
+        [
+            (r >= 4) & (f >= 4),
+            f >= 4,
+            (r >= 4) & (f <= 1),
+            r >= 4,
+            (r <= 2) & (f >= 3),
+            r <= 2,
+        ],
+        ["Champions", "Loyal Customers", "New Customers", "Potential Loyalists", "At Risk", "Hibernating"],
+        default="Need Attention",
+    )
+    return features.assign(RScore=r, FScore=f, MScore=m, Segment=segment)
+
+
+def rfm_features(connection, customer_ids=None):
+    if customer_ids is None:
+        where, params = "1 = 1", []
+    else:
+        where = f"Sales.CustomerID IN ({', '.join(['%s'] * len(customer_ids))})"
+        params = [int(customer_id) for customer_id in customer_ids]
+    features = scatter_gather(
+        connection, RFM_FEATURES_QUERY.format(where=where), params, None, None, ["CustomerID"], RFM_AGGREGATES
+    )
+    for column in RFM_AGGREGATES:
+        if column in features and column != "LastSaleDate":
+            features[column] = pd.to_numeric(features[column])
+    if "LastSaleDate" in features:
+        features["LastSaleDate"] = pd.to_datetime(features["LastSaleDate"]).dt.date
+    return features
+
+
+def store_customer_segments(connection, scored, progress=None):
+    rows = [
+        (int(row.CustomerID), int(row.Recency), int(row.Frequency), round(float(row.Monetary), 2),
+         int(row.RScore), int(row.FScore), int(row.MScore), row.Segment, row.LastSaleDate)
+        for row in scored.itertuples()
+    ]
+    for start in range(0, len(rows), RFM_BATCH_SIZE):
+        run_in_transaction(
+            connection,
+            lambda cursor: cursor.executemany(
+                """
+                    INSERT INTO CustomerSegment
+                        (CustomerID, Recency, Frequency, Monetary, RScore, FScore, MScore, Segment, LastSaleDate)
+                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
+                    ON DUPLICATE KEY UPDATE
+                        Recency = VALUES(Recency), Frequency = VALUES(Frequency), Monetary = VALUES(Monetary),
+                        RScore = VALUES(RScore), FScore = VALUES(FScore), MScore = VALUES(MScore),
+                        Segment = VALUES(Segment), LastSaleDate = VALUES(LastSaleDate)
+                """,
+                rows[start:start + RFM_BATCH_SIZE],
+            ),
+        )
+        if progress is not None:
+            progress(min(start + RFM_BATCH_SIZE, len(rows)), len(rows))
+
+
+def segmentation_state(connection):
+    cursor = connection.cursor(dictionary=True)
+    cursor.execute("SELECT SalesWatermark, Thresholds, RebuiltAt FROM SegmentationState WHERE StateID = 1")
+    state = cursor.fetchone()
+    if state is not None:
+        state["Thresholds"] = json.loads(state["Thresholds"])
+    return state
+
+
+def rebuild_customer_segments(connection, progress=None):
+    cursor = connection.cursor()
+    # Read the watermark first: sales landing during the rebuild are rescored by the next refresh
+    cursor.execute("SELECT COALESCE(MAX(SalesID), 0) FROM Sales")
+    watermark = cursor.fetchone()[0]
+    features = rfm_features(connection)
+    if features.empty:
+        return 0
+    thresholds = rfm_thresholds(features)
+    store_customer_segments(connection, score_rfm(features, thresholds), progress)
+    cursor.execute(
+        """
+            INSERT INTO SegmentationState (StateID, SalesWatermark, Thresholds, RebuiltAt)
+            VALUES (1, %s, %s, NOW())
+            ON DUPLICATE KEY UPDATE
+                SalesWatermark = VALUES(SalesWatermark), Thresholds = VALUES(Thresholds), RebuiltAt = VALUES(RebuiltAt)
+        """,
+        (watermark, json.dumps(thresholds)),
+    )
+    connection.commit()
+    return len(features)
+
+
+def age_customer_segments(connection, thresholds):
+    # Recency grows every day without a sale; rescore the customers whose stored Recency is behind
+    cursor = connection.cursor(dictionary=True)
+    cursor.execute(
+        """
+            SELECT CustomerID, DATEDIFF(CURDATE(), LastSaleDate) AS Recency, LastSaleDate, Frequency, Monetary
+            FROM CustomerSegment
+            WHERE Recency <> DATEDIFF(CURDATE(), LastSaleDate)
+        """
+    )
+    stale = pd.DataFrame(
+        cursor.fetchall(), columns=["CustomerID", "Recency", "LastSaleDate", "Frequency", "Monetary"]
+    )
+    if stale.empty:
+        return 0
+    stale["Monetary"] = pd.to_numeric(stale["Monetary"])
+    store_customer_segments(connection, score_rfm(stale, thresholds))
+    return len(stale)
+
+
+def refresh_customer_segments(connection):
+    state = segmentation_state(connection)
+    if state is None:
+        return rebuild_customer_segments(connection)
+    age_customer_segments(connection, state["Thresholds"])
+
+    changed = scatter_gather(
+        connection,
+        "SELECT Sales.CustomerID, MAX(Sales.SalesID) AS LastSalesID FROM Sales WHERE Sales.SalesID > %s GROUP BY Sales.CustomerID",
+        [state["SalesWatermark"]],
+        None,
+        None,
+        ["CustomerID"],
+        {"LastSalesID": "max"},
+    )
+    if changed.empty:
+        return 0
+
+    customer_ids = changed["CustomerID"].tolist()
+    for start in range(0, len(customer_ids), RFM_BATCH_SIZE):
+        features = rfm_features(connection, customer_ids[start:start + RFM_BATCH_SIZE])
+        store_customer_segments(connection, score_rfm(features, state["Thresholds"]))
+
+    cursor = connection.cursor()
+    cursor.execute(
+        "UPDATE SegmentationState SET SalesWatermark = GREATEST(SalesWatermark, %s) WHERE StateID = 1",
+        (int(pd.to_numeric(changed["LastSalesID"]).max()),),
+    )
+    connection.commit()
+    return len(customer_ids)
+
+
+def rfm_rebuild_job(context, params):
+    # params: {"refresh": true} ages and rescores since the last run (rebuilding only if
+    # there never was one); otherwise everything is rebuilt and recalibrated
+    connection = open_connection()
+    try:
+        if params.get("refresh"):
+            return f"Rescored {refresh_customer_segments(connection)} customers."
+        customers = rebuild_customer_segments(connection, context.progress)
+        return f"Segmented {customers} customers."
+    finally:
+        connection.close()
+
+
+@st.cache_resource
+def rfm_refresh_state():
+    return {"last_submit": 0.0, "job_id": None}
+
+
+def maybe_refresh_customer_segments():
+    state = rfm_refresh_state()
+    if time.time() - state["last_submit"] < RFM_REFRESH_INTERVAL:
+        return state["job_id"]
+    state["last_submit"] = time.time()
+    state["job_id"] = job_scheduler().submit("rfm_rebuild", {"refresh": True})
+    return state["job_id"]
+
+
+def customer_segmentation(connection):
+    job_id = maybe_refresh_customer_segments()
+    try:
+        state = segmentation_state(connection)
+    except Error as e:
+        st.error(f"Error reading customer segments: {e}")
+        return
+
+    if state is None:
+        st.info(f"No customer segments yet; rfm_rebuild job #{job_id} builds them from the sales recorded so far.")
+        return
+    st.caption(
+        f"Segments recalibrated {state['RebuiltAt']}; customers with new sales are rescored in the background "
+        f"every {RFM_REFRESH_INTERVAL // 60} minutes."
+    )
+
+    counts = fetch_table_data(
+        connection,
+        """
+            SELECT Segment, COUNT(*) AS Customers, SUM(Monetary) AS Revenue
+            FROM CustomerSegment
+            GROUP BY Segment
+        """,
+    )
+    if counts.empty:
+        st.info("No data available for customer segmentation.")
+        return
+    counts["Segment"] = pd.Categorical(counts["Segment"], categories=RFM_SEGMENTS, ordered=True)
+    counts = counts.sort_values("Segment")
+    st.bar_chart(counts, x="Segment", y="Customers", use_container_width=True)
+    st.dataframe(counts, use_container_width=True)
+
+    segment = st.selectbox("Segment Members", counts["Segment"].astype(str))
+    members = fetch_table_data(
+        connection,
+        f"""
+            SELECT Customer.CustomerName AS Customer, CustomerSegment.Recency, CustomerSegment.Frequency,
+                   CustomerSegment.Monetary, CustomerSegment.RScore, CustomerSegment.FScore, CustomerSegment.MScore
+            FROM CustomerSegment
+            JOIN Customer ON Customer.CustomerID = CustomerSegment.CustomerID
+            WHERE CustomerSegment.Segment = %s
+            ORDER BY CustomerSegment.Monetary DESC
+            LIMIT {RFM_MEMBER_LIMIT}
+        """,
+        (segment,),
+    )
+    st.dataframe(members, use_container_width=True)
+
+    if st.button("Recalibrate Segments"):
+        job_id = job_scheduler().submit("rfm_rebuild", {}, current_user())
+        st.success(f"Submitted rfm_rebuild job #{job_id}.")
+
+
+@page_fragment("Top Customers")
+def top_customers_chart(connection):
+    st.subheader("Top Customers by Revenue")
+    start_date, end_date = sales_period_inputs("customer_insights")
+    try:
+        with fragment_connection(connection) as live:
+            customer_totals = customer_sales_totals(live, start_date, end_date)
+    except Error as e:
+        st.error(f"Error fetching data: {e}")
+        customer_totals = pd.DataFrame()
+    if not customer_totals.empty:
+        top_customers = customer_totals.sort_values("TotalSpent", ascending=False).head(10)
+        st.bar_chart(data=top_customers, x="Customer", y="TotalSpent", use_container_width=True)
+        st.dataframe(top_customers, use_container_width=True)
+    else:
+        st.info("No data available for top customers.")
+
+
+@page_fragment("Sales Trend")
+def sales_trend_chart(connection):
+    st.subheader("Revenue per Day")
+    start_date, end_date = sales_period_inputs("sales_trend")
+    method = st.radio("Downsampling", DOWNSAMPLING_METHODS, horizontal=True, key="sales_trend_method")
+    try:
+        with fragment_connection(connection) as live:
+            trend, days = sales_trend(live, start_date, end_date, method, analytics_mode_enabled())
+    except Error as e:
+        st.error(f"Error fetching data: {e}")
+        return
+    if not trend.empty:
+        st.line_chart(trend, x="SaleDate", y="Revenue", use_container_width=True)
+        if len(trend) < days:
+            st.caption(f"{len(trend):,} of {days:,} days shown ({method}).")
+    else:
+        st.info("No sales in this period.")
+
+
 def customer_insights(connection):
     st.header("Customer Insights")
 
     # Tabs for different insights
-    tab1, tab2 = st.tabs(["Top Customers","Customer Segmentation"])
+    tab1, tab2, tab3 = st.tabs(["Top Customers", "Customer Segmentation", "Sales Trend"])
 
-    # Tab 1: Top Customers by Revenue
+    # Tab 1: Top Customers by Revenue (its period inputs rerun only this tab)
     with tab1:
-        st.subheader("Top Customers by Revenue")
-        query = """
-            SELECT 
-                Customer.CustomerName AS Customer,
-                SUM(Sales.SaleAmount) AS TotalSpent,
-                COUNT(Sales.SalesID) AS TotalOrders
-            FROM Customer
-            LEFT JOIN Sales ON Customer.CustomerID = Sales.CustomerID
-            GROUP BY Customer.CustomerName
-            ORDER BY TotalSpent DESC
-            LIMIT 10
-        """
-        top_customers = fetch_table_data(connection, query)
+        top_customers_chart(connection)
 
-        if not top_customers.empty:
-            st.bar_chart(data=top_customers, x="Customer", y="TotalSpent", use_container_width=True)
-            st.dataframe(top_customers, use_container_width=True)
-        else:
-            st.info("No data available for top customers.")
-
-    # Tab 2: Customer Segmentation
+    # Tab 2: Customer Segmentation (RFM, over all sales rather than the selected period)
     with tab2:
         st.subheader("Customer Segmentation")
-        query = """
-            SELECT 
-                Customer.CustomerName AS Customer,
-                COUNT(Sales.SalesID) AS TotalOrders,
-                CASE 
-                    WHEN COUNT(Sales.SalesID) >= 5 THEN 'Regular'
-                    ELSE 'Occasional'
-                END AS CustomerType
-            FROM Customer
-            LEFT JOIN Sales ON Customer.CustomerID = Sales.CustomerID
-            GROUP BY Customer.CustomerName
-        """
-        segmentation_data = fetch_table_data(connection, query)
+        customer_segmentation(connection)
 
-        if not segmentation_data.empty:
-            st.dataframe(segmentation_data, use_container_width=True)
-            regular_customers = segmentation_data[segmentation_data["CustomerType"] == "Regular"]
-            occasional_customers = segmentation_data[segmentation_data["CustomerType"] == "Occasional"]
-
-            st.write(f"**Number of Regular Customers:** {len(regular_customers)}")
-            st.write(f"**Number of Occasional Customers:** {len(occasional_customers)}")
-        else:
-            st.info("No data available for customer segmentation.")
+    # Tab 3: Revenue over time, downsampled to the chart width
+    with tab3:
+        sales_trend_chart(connection)
 
 # def main():
 #     st.title("Inventory Management System")
@@ -798,19 +6099,801 @@ def customer_insights(connection):
 #     main()
 # from langchain_groq import ChatGroq
 
+# Background jobs run on a thread pool owned by the server process. Job state lives in
+# a small SQLite file so the Jobs page survives reruns and restarts; jobs that were
+# running when the process died are queued again on startup.
+JOB_STORE_PATH = os.environ.get("INVENTORY_JOB_STORE", "jobs.db")
+JOB_FILES_DIR = os.environ.get("INVENTORY_JOB_FILES", "job_files")
+JOB_WORKERS = 4
+JOB_RETRY_DELAY = 30  # seconds, doubled for every further attempt
+JOB_PROGRESS_INTERVAL = 0.5  # seconds between progress writes
+IMPORTABLE_TABLES = ("Product", "Customer", "Supplier", "Sales", "Inventory", "Discount", "Shipment")
+IMPORT_CHUNK_SIZE = 5000
+PURGE_BATCH_SIZE = 200
+
+# job type -> {"run": run(context, params), "concurrency": ..., "retries": ...}
+JOB_TYPES = {}
+
+
+class JobCancelled(Exception):
+    pass
+
+
+def register_job_type(name, run, concurrency=1, retries=0):
+    JOB_TYPES[name] = {"run": run, "concurrency": concurrency, "retries": retries}
+
+
+class JobContext:
+    def __init__(self, scheduler, job_id, cancel_event):
+        self.scheduler = scheduler
+        self.job_id = job_id
+        self.cancel_event = cancel_event
+        self.last_report = 0.0
+
+    def progress(self, done, total=None, message=None):
+        # Jobs call this between units of work; it is also where cancellation takes effect
+        if self.cancel_event.is_set():
+            raise JobCancelled()
+        if time.time() - self.last_report >= JOB_PROGRESS_INTERVAL or (total and done >= total):
+            self.last_report = time.time()
+            self.scheduler.update(self.job_id, done=done, total=total, message=message)
+
+
+class JobScheduler:
+    def __init__(self, path=JOB_STORE_PATH, workers=JOB_WORKERS):
+        self.path = path
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="job")
+        self.cancel_events = {}
+        self.running_by_type = {}
+        with self.store() as store:
+            store.execute(
+                """
+                    CREATE TABLE IF NOT EXISTS jobs (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        job_type TEXT NOT NULL,
+                        params TEXT NOT NULL,
+                        status TEXT NOT NULL,
+                        attempts INTEGER NOT NULL DEFAULT 0,
+                        done INTEGER NOT NULL DEFAULT 0,
+                        total INTEGER,
+                        message TEXT,
+                        submitted_by TEXT,
+                        created_at REAL NOT NULL,
+                        not_before REAL NOT NULL DEFAULT 0,
+                        started_at REAL,
+                        finished_at REAL
+                    )
+                """
+            )
+            store.execute("UPDATE jobs SET status = 'queued' WHERE status = 'running'")
+        self.dispatch()
+
+    @contextmanager
+    def store(self):
+        store = sqlite3.connect(self.path, timeout=30)
+        try:
+            with store:
+                yield store
+        finally:
+            store.close()
+
+    def submit(self, job_type, params, submitted_by=None):
+        with self.store() as store:
+            job_id = store.execute(
+                "INSERT INTO jobs (job_type, params, status, submitted_by, created_at) VALUES (?, ?, 'queued', ?, ?)",
+                (job_type, json.dumps(params, default=str), submitted_by, time.time()),
+            ).lastrowid
+        self.dispatch()
+        return job_id
+
+    def update(self, job_id, **fields):
+        fields = {key: value for key, value in fields.items() if value is not None}
+        if not fields:
+            return
+        assignments = ", ".join(f"{key} = ?" for key in fields)
+        with self.store() as store:
+            store.execute(f"UPDATE jobs SET {assignments} WHERE id = ?", (*fields.values(), job_id))
+
+    def dispatch(self):
+        # Starts queued jobs while their type is under its concurrency limit
+        with self.lock, self.store() as store:
+            queued = store.execute(
+                "SELECT id, job_type, params, attempts, submitted_by FROM jobs WHERE status = 'queued' AND not_before <= ? ORDER BY id",
+                (time.time(),),
+            ).fetchall()
+            for job_id, job_type, params, attempts, submitted_by in queued:
+                job = JOB_TYPES.get(job_type)
+                if job is None:
+                    continue
+                if self.running_by_type.get(job_type, 0) >= job["concurrency"]:
+                    continue
+                self.running_by_type[job_type] = self.running_by_type.get(job_type, 0) + 1
+                self.cancel_events[job_id] = threading.Event()
+                store.execute(
+                    "UPDATE jobs SET status = 'running', attempts = ?, started_at = ?, message = NULL WHERE id = ?",
+                    (attempts + 1, time.time(), job_id),
+                )
+                self.executor.submit(self.execute, job_id, job_type, json.loads(params), attempts + 1, submitted_by)
+
+    def execute(self, job_id, job_type, params, attempt, submitted_by=None):
+        job = JOB_TYPES[job_type]
+        context = JobContext(self, job_id, self.cancel_events[job_id])
+        try:
+            # Audit records name the submitting user and the job
+            with acting_as(submitted_by, f"Job: {job_type}"):
+                message = job["run"](context, params)
+            self.update(job_id, status="succeeded", message=message, finished_at=time.time())
+        except JobCancelled:
+            self.update(job_id, status="cancelled", finished_at=time.time())
+        except Exception as e:
+            if attempt <= job["retries"]:
+                delay = JOB_RETRY_DELAY * 2 ** (attempt - 1)
+                self.update(job_id, status="queued", message=f"Retrying after error: {e}", not_before=time.time() + delay)
+                threading.Timer(delay, self.dispatch).start()
+            else:
+                self.update(job_id, status="failed", message=str(e), finished_at=time.time())
+        finally:
+            with self.lock:
+                self.running_by_type[job_type] -= 1
+                self.cancel_events.pop(job_id, None)
+            self.dispatch()
+
+    def cancel(self, job_id):
+        with self.lock:
+            event = self.cancel_events.get(job_id)
+            if event is not None:
+                event.set()
+                return True
+        with self.store() as store:
+            return store.execute(
+                "UPDATE jobs SET status = 'cancelled', finished_at = ? WHERE id = ? AND status = 'queued'",
+                (time.time(), job_id),
+            ).rowcount == 1
+
+    def jobs(self, limit=100):
+        with self.store() as store:
+            frame = pd.read_sql_query("SELECT * FROM jobs ORDER BY id DESC LIMIT ?", store, params=(limit,))
+        elapsed = frame["finished_at"].fillna(time.time()) - frame["started_at"]
+        frame["Progress"] = (frame["done"] / frame["total"]).clip(upper=1.0)
+        frame["ItemsPerSecond"] = (frame["done"] / elapsed.where(elapsed > 0)).round(1)
+        for column in ("created_at", "started_at", "finished_at"):
+            frame[column] = pd.to_datetime(frame[column], unit="s")
+        return frame
+
+
+@st.cache_resource
+def job_scheduler():
+    os.makedirs(JOB_FILES_DIR, exist_ok=True)
+    return JobScheduler()
+
+
+def import_csv_job(context, params):
+    table = params["table"]
+    if table not in IMPORTABLE_TABLES:
+        raise ValueError(f"{table} cannot be bulk imported.")
+    total = sum(1 for _ in open(params["path"])) - 1
+    connection = open_connection()
+    try:
+        done = 0
+        for index, chunk in enumerate(pd.read_csv(params["path"], chunksize=IMPORT_CHUNK_SIZE)):
+            chunk = chunk.astype(object).where(chunk.notna(), None)
+            columns = ", ".join(f"`{column}`" for column in chunk.columns)
+            placeholders = ", ".join(["%s"] * len(chunk.columns))
+            rows = list(chunk.itertuples(index=False, name=None))
+
+            def insert_chunk(cursor):
+                cursor.executemany(f"INSERT INTO `{table}` ({columns}) VALUES ({placeholders})", rows)
+                return len(rows)
+
+            # Keyed per chunk, so retries (of a lost commit or of the whole job) skip chunks already imported
+            key = hashlib.sha256(f"import:{context.job_id}:{params['path']}:{index}".encode()).hexdigest()
+            run_idempotent(connection, key, "import_csv", insert_chunk)
+            done += len(chunk)
+            context.progress(done, total)
+        return f"Imported {done} rows into {table}."
+    finally:
+        connection.close()
+
+
+def archive_purge_job(context, params):
+    # Archives (to MongoDB or the file archive) and deletes orders dated before params["before"]
+    connection = open_connection()
+    try:
+        cursor = connection.cursor()
+        cursor.execute("SELECT OrderID FROM `Order` WHERE OrderDate < %s ORDER BY OrderID", (params["before"],))
+        order_ids = [row[0] for row in cursor.fetchall()]
+        mongodb = archive_database()
+        for done, order_id in enumerate(order_ids, start=1):
+            archive_and_delete_order(connection, mongodb, order_id)
+            if done % PURGE_BATCH_SIZE == 0 or done == len(order_ids):
+                context.progress(done, len(order_ids))
+        return f"Archived and deleted {len(order_ids)} orders."
+    finally:
+        connection.close()
+
+
+def export_table_job(context, params):
+    table = params["table"]
+    path = os.path.join(JOB_FILES_DIR, f"{table}-{datetime.now():%Y%m%d-%H%M%S}.csv")
+    connection = open_connection()
+    try:
+        cursor = connection.cursor()
+        cursor.execute(f"SELECT COUNT(*) FROM `{table}`")
+        total = cursor.fetchone()[0]
+        cursor.execute(f"SELECT * FROM `{table}`")
+        columns = cursor.column_names
+        done = 0
+        with open(path, "w", newline="") as output:
+            while True:
+                rows = cursor.fetchmany(IMPORT_CHUNK_SIZE)
+                if not rows:
+                    break
+                pd.DataFrame(rows, columns=columns).to_csv(output, header=done == 0, index=False)
+                done += len(rows)
+                context.progress(done, total)
+        return path
+    finally:
+        connection.close()
+
+
+def analytics_refresh_job(context, params):
+    connection = open_connection()
+    try:
+        context.progress(0, 1)
+        copied = refresh_analytics_snapshot(connection)
+        context.progress(1, 1)
+        return f"Copied {sum(copied.values())} rows into the analytics snapshot."
+    finally:
+        connection.close()
+
+
+def sync_table_upstream(local, upstream, table, key_columns):
+    # Copies rows changed since the stored (UpdatedAt, key) watermark, one upstream
+    # transaction per batch; the watermark only moves after the batch has committed
+    cursor = local.cursor(dictionary=True)
+    cursor.execute("SELECT Watermark FROM SyncState WHERE TableName = %s", (table,))
+    state = cursor.fetchone()
+    watermark = json.loads(state["Watermark"]) if state else None
+    local.rollback()
+
+    columns = ("UpdatedAt",) + key_columns
+    column_list = ", ".join(f"`{column}`" for column in columns)
+    copied = 0
+    while True:
+        query = f"SELECT * FROM `{table}`"
+        params = ()
+        if watermark is not None:
+            query += f" WHERE ({column_list}) > ({', '.join(['%s'] * len(columns))})"
+            params = tuple(watermark)
+        cursor.execute(query + f" ORDER BY {column_list} LIMIT {SYNC_BATCH_SIZE}", params)
+        rows = cursor.fetchall()
+        local.rollback()
+        if not rows:
+            return copied
+
+        # Upstream keeps its own UpdatedAt so its change feed sees the synced rows
+        names = [name for name in rows[0] if name != "UpdatedAt"]
+        upstream.cursor().executemany(
+            f"""
+                INSERT INTO `{table}` ({", ".join(f"`{name}`" for name in names)})
+                VALUES ({", ".join(["%s"] * len(names))})
+                ON DUPLICATE KEY UPDATE {", ".join(f"`{name}` = VALUES(`{name}`)" for name in names)}
+            """,
+            [tuple(row[name] for name in names) for row in rows],
+        )
+        upstream.commit()
+
+        last = rows[-1]
+        watermark = [sqlite_timestamp(last["UpdatedAt"]) if isinstance(last["UpdatedAt"], datetime) else last["UpdatedAt"]]
+        watermark += [last[column] for column in key_columns]
+        cursor.execute(
+            "INSERT INTO SyncState (TableName, Watermark) VALUES (%s, %s) ON DUPLICATE KEY UPDATE Watermark = VALUES(Watermark)",
+            (table, json.dumps(watermark)),
+        )
+        local.commit()
+        copied += len(rows)
+
+
+def upstream_sync_job(context, params):
+    if STORAGE_BACKEND != "sqlite" or not UPSTREAM_CONFIG:
+        raise ValueError("Upstream sync needs INVENTORY_BACKEND=sqlite and INVENTORY_UPSTREAM.")
+    local = open_connection()
+    upstream = mysql.connector.connect(**UPSTREAM_CONFIG)
+    try:
+        copied = {}
+        for done, (table, key_columns) in enumerate(CDC_TABLES.items(), start=1):
+            copied[table] = sync_table_upstream(local, upstream, table, key_columns)
+            context.progress(done, len(CDC_TABLES))
+        return ", ".join(f"{table}: {rows}" for table, rows in copied.items())
+    finally:
+        upstream.close()
+        local.close()
+
+
+def cache_rebuild_job(context, params):
+    connection = open_connection()
+    try:
+        cached_reference_data.clear()
+        for done, table in enumerate(REFERENCE_QUERIES, start=1):
+            cached_reference_data(connection, table)
+            context.progress(done, len(REFERENCE_QUERIES) + 1)
+        compact_inventory_ledger(connection)
+        purged = purge_idempotency_keys(connection)
+        context.progress(len(REFERENCE_QUERIES) + 1, len(REFERENCE_QUERIES) + 1)
+        return f"Reference data reloaded, inventory ledger compacted and {purged} expired request keys purged."
+    finally:
+        connection.close()
+
+
+register_job_type("bulk_import", import_csv_job, concurrency=2, retries=0)
+register_job_type("archive_purge", archive_purge_job, concurrency=1, retries=2)
+register_job_type("export", export_table_job, concurrency=2, retries=1)
+register_job_type("analytics_refresh", analytics_refresh_job, concurrency=1, retries=2)
+register_job_type("cache_rebuild", cache_rebuild_job, concurrency=1, retries=1)
+register_job_type("valuation_snapshot", valuation_snapshot_job, concurrency=1, retries=2)
+register_job_type("rfm_rebuild", rfm_rebuild_job, concurrency=1, retries=1)
+register_job_type("upstream_sync", upstream_sync_job, concurrency=1, retries=3)
+register_job_type("replenishment", replenishment_job, concurrency=1, retries=1)
+register_job_type("narrative_reports", narrative_report_job, concurrency=1, retries=1)
+
+
+def jobs_page(connection):
+    st.header("Jobs")
+    scheduler = job_scheduler()
+
+    with st.expander("Submit Job"):
+        job_type = st.selectbox("Job Type", list(JOB_TYPES))
+        params = {}
+        if job_type == "bulk_import":
+            params["table"] = st.selectbox("Table", IMPORTABLE_TABLES)
+            upload = st.file_uploader("CSV File", type="csv")
+            if upload is not None:
+                params["path"] = os.path.join(JOB_FILES_DIR, f"import-{time.time():.0f}-{upload.name}")
+        elif job_type == "archive_purge":
+            params["before"] = st.date_input("Archive Orders Dated Before")
+        elif job_type == "export":
+            params["table"] = st.selectbox("Table", IMPORTABLE_TABLES + ("Order", "OrderItem", "InventoryMovement"))
+
+        if st.button("Submit"):
+            if job_type == "bulk_import" and upload is None:
+                st.error("Please choose a CSV file.")
+            else:
+                if job_type == "bulk_import":
+                    with open(params["path"], "wb") as saved:
+                        saved.write(upload.getbuffer())
+                job_id = scheduler.submit(job_type, params, current_user())
+                st.success(f"Job {job_id} queued.")
+
+    jobs = scheduler.jobs()
+    if jobs.empty:
+        st.info("No jobs yet.")
+        return
+
+    st.button("Refresh")
+    st.dataframe(
+        jobs[["id", "job_type", "status", "Progress", "done", "total", "ItemsPerSecond", "attempts", "message",
+              "submitted_by", "created_at", "started_at", "finished_at"]],
+        column_config={"Progress": st.column_config.ProgressColumn("Progress", min_value=0.0, max_value=1.0)},
+        use_container_width=True,
+    )
+
+    active = jobs[jobs["status"].isin(["queued", "running"])]
+    if not active.empty:
+        job_id = st.selectbox("Job to Cancel", active["id"])
+        if st.button("Cancel Job"):
+            if scheduler.cancel(int(job_id)):
+                st.success(f"Cancellation requested for job {job_id}.")
+            else:
+                st.warning(f"Job {job_id} already finished.")
+
+    exports = jobs[(jobs["job_type"] == "export") & (jobs["status"] == "succeeded")]
+    for export in exports.head(5).itertuples():
+        if os.path.exists(export.message):
+            with open(export.message, "rb") as exported:
+                st.download_button(
+                    f"Download {os.path.basename(export.message)}", exported, file_name=os.path.basename(export.message)
+                )
+
+
+def import_time_profile(module="dashboard"):
+    # Runs a fresh interpreter with -X importtime and returns one row per imported module
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        capture_output=True,
+        text=True,
+    )
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        rows.append(
+            {
+                "Module": name.strip(),
+                "Depth": (len(name) - len(name.lstrip()) - 1) // 2,
+                "SelfMs": int(self_us) / 1000,
+                "CumulativeMs": int(cumulative_us) / 1000,
+            }
+        )
+    return pd.DataFrame(rows)
+
+
+def diagnostics(connection):
+    st.header("Diagnostics")
+
+    st.subheader("Cold Start")
+    if st.button("Profile Imports"):
+        profile = import_time_profile()
+        if not profile.empty:
+            total_ms = profile.loc[profile["Module"] == "dashboard", "CumulativeMs"].sum()
+            st.write(f"**Import time:** {total_ms:.0f} ms (budget {COLD_START_BUDGET_MS} ms)")
+            if total_ms <= COLD_START_BUDGET_MS:
+                st.success("Cold start is within budget.")
+            else:
+                st.error("Cold start is over budget.")
+
+            top_level = profile[profile["Depth"] <= 1].sort_values("CumulativeMs", ascending=False)
+            st.dataframe(top_level.head(25), use_container_width=True)
+        else:
+            st.error("Could not profile imports.")
+
+    st.subheader("Session Memory")
+    report = session_memory_report()
+    st.write(f"**This session:** {report['Bytes'].sum() / 1024:.1f} KiB")
+    st.dataframe(report.sort_values("Bytes", ascending=False), use_container_width=True)
+
+    shared = sum(estimate_size(reference_data(connection, table)) for table in REFERENCE_QUERIES)
+    st.write(f"**Shared reference data (all sessions):** {shared / 1024:.1f} KiB")
+
+    st.subheader("Frame Memory")
+    report = frame_memory_report()
+    if not report.empty:
+        saved = report["BytesBefore"].sum() - report["BytesAfter"].sum()
+        st.write(f"**Saved by compact dtypes:** {saved / 1024:.1f} KiB across {report['Frames'].sum()} fetched frames")
+        st.dataframe(report, hide_index=True, use_container_width=True)
+        st.dataframe(name_dictionary().report(), hide_index=True, use_container_width=True)
+    else:
+        st.info("No frames fetched in this server process yet.")
+
+    st.subheader("Query Governor")
+    st.dataframe(query_governor().report(), hide_index=True, use_container_width=True)
+
+    st.subheader("Prepared Statements")
+    report = statement_report()
+    if not report.empty:
+        st.dataframe(report, use_container_width=True)
+    else:
+        st.info("No prepared statements have run in this server process yet.")
+
+    order_id = st.number_input("Benchmark Order ID", min_value=1, step=1)
+    if st.button("Benchmark Repeated Lookups"):
+        try:
+            text_ms, prepared_ms = benchmark_statement_cache(connection, order_id)
+            st.write(f"**200 lookups, text protocol:** {text_ms:.0f} ms")
+            st.write(f"**200 lookups, prepared statement:** {prepared_ms:.0f} ms ({text_ms / prepared_ms:.1f}x)")
+        except Error as e:
+            st.error(f"Benchmark failed: {e}")
+
+    st.subheader("Rerun Times")
+    report = rerun_report()
+    if not report.empty:
+        # Page rows are full script runs; fragment rows are what a widget change inside that fragment costs
+        st.dataframe(report, hide_index=True, use_container_width=True)
+    else:
+        st.info("No page runs recorded in this server process yet.")
+
+
+# The whole schema for the SQLite backend: the base tables plus everything the
+# setup_* functions add on MySQL. Keep the two in step. UpdatedAt is maintained by
+# triggers where MySQL uses ON UPDATE CURRENT_TIMESTAMP.
+SQLITE_NOW = "(strftime('%Y-%m-%d %H:%M:%f', 'now', 'localtime'))"
+SQLITE_SCHEMA = f"""
+    CREATE TABLE IF NOT EXISTS Category (
+        CategoryID INTEGER PRIMARY KEY,
+        CategoryName VARCHAR(255) NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS Location (
+        LocationID INTEGER PRIMARY KEY,
+        LocationName VARCHAR(255) NOT NULL,
+        Address VARCHAR(255)
+    );
+    CREATE TABLE IF NOT EXISTS Supplier (
+        SupplierID INTEGER PRIMARY KEY,
+        SupplierName VARCHAR(255) NOT NULL,
+        ContactInfo VARCHAR(255)
+    );
+    CREATE TABLE IF NOT EXISTS Customer (
+        CustomerID INTEGER PRIMARY KEY,
+        CustomerName VARCHAR(255) NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS Product (
+        ProductID INTEGER PRIMARY KEY,
+        ProductName VARCHAR(255) NOT NULL,
+        CategoryID INT REFERENCES Category (CategoryID),
+        Price DECIMAL(10, 2) NOT NULL DEFAULT 0,
+        Quantity INT NOT NULL DEFAULT 0
+    );
+    CREATE TABLE IF NOT EXISTS Inventory (
+        ProductID INT NOT NULL REFERENCES Product (ProductID),
+        LocationID INT NOT NULL REFERENCES Location (LocationID),
+        Quantity INT NOT NULL DEFAULT 0,
+        LastRestockDate DATE,
+        Version INT NOT NULL DEFAULT 0,
+        UpdatedAt TIMESTAMP NOT NULL DEFAULT {SQLITE_NOW},
+        PRIMARY KEY (ProductID, LocationID)
+    );
+    CREATE TABLE IF NOT EXISTS `Order` (
+        OrderID INTEGER PRIMARY KEY,
+        SupplierID INT REFERENCES Supplier (SupplierID),
+        OrderDate DATE NOT NULL,
+        Status VARCHAR(32) NOT NULL DEFAULT 'Pending',
+        Version INT NOT NULL DEFAULT 0,
+        UpdatedAt TIMESTAMP NOT NULL DEFAULT {SQLITE_NOW}
+    );
+    CREATE TABLE IF NOT EXISTS OrderItem (
+        OrderItemID INTEGER PRIMARY KEY,
+        OrderID INT NOT NULL REFERENCES `Order` (OrderID),
+        ProductID INT NOT NULL REFERENCES Product (ProductID),
+        Quantity INT NOT NULL,
+        Price DECIMAL(10, 2) NOT NULL,
+        Version INT NOT NULL DEFAULT 0,
+        UpdatedAt TIMESTAMP NOT NULL DEFAULT {SQLITE_NOW}
+    );
+    CREATE INDEX IF NOT EXISTS idx_orderitem_order ON OrderItem (OrderID);
+    CREATE TABLE IF NOT EXISTS Sales (
+        SalesID INTEGER PRIMARY KEY,
+        CustomerID INT REFERENCES Customer (CustomerID),
+        ProductID INT REFERENCES Product (ProductID),
+        SaleDate DATE NOT NULL,
+        SaleAmount DECIMAL(10, 2) NOT NULL,
+        UpdatedAt TIMESTAMP NOT NULL DEFAULT {SQLITE_NOW}
+    );
+    CREATE INDEX IF NOT EXISTS idx_sales_customer ON Sales (CustomerID);
+    CREATE INDEX IF NOT EXISTS idx_sales_date ON Sales (SaleDate);
+    CREATE TABLE IF NOT EXISTS Discount (
+        DiscountID INTEGER PRIMARY KEY,
+        ProductID INT NOT NULL REFERENCES Product (ProductID),
+        DiscountPercent DECIMAL(5, 2) NOT NULL,
+        StartDate DATE NOT NULL,
+        EndDate DATE NOT NULL,
+        UpdatedAt TIMESTAMP NOT NULL DEFAULT {SQLITE_NOW}
+    );
+    CREATE TABLE IF NOT EXISTS Shipment (
+        ShipmentID INTEGER PRIMARY KEY,
+        OrderID INT NOT NULL REFERENCES `Order` (OrderID),
+        ShipmentDate DATE,
+        TrackingNumber VARCHAR(255),
+        UpdatedAt TIMESTAMP NOT NULL DEFAULT {SQLITE_NOW}
+    );
+    CREATE INDEX IF NOT EXISTS idx_shipment_order ON Shipment (OrderID);
+
+    CREATE TABLE IF NOT EXISTS InventoryMovement (
+        MovementID INTEGER PRIMARY KEY,
+        ProductID INT NOT NULL,
+        LocationID INT NOT NULL,
+        MovementType VARCHAR(16) NOT NULL CHECK (MovementType IN ('Reservation', 'Receipt', 'Adjustment', 'Release')),
+        Quantity INT NOT NULL,
+        OrderID INT NULL,
+        CreatedAt DATETIME NOT NULL DEFAULT {SQLITE_NOW},
+        UpdatedAt TIMESTAMP NOT NULL DEFAULT {SQLITE_NOW}
+    );
+    CREATE INDEX IF NOT EXISTS idx_movement_product_location ON InventoryMovement (ProductID, LocationID, MovementID);
+    CREATE INDEX IF NOT EXISTS idx_movement_order ON InventoryMovement (OrderID);
+    CREATE INDEX IF NOT EXISTS idx_movement_created ON InventoryMovement (CreatedAt);
+    CREATE TABLE IF NOT EXISTS InventoryLedgerState (
+        StateID INTEGER PRIMARY KEY,
+        CompactedThrough BIGINT NOT NULL DEFAULT 0
+    );
+    INSERT OR IGNORE INTO InventoryLedgerState (StateID, CompactedThrough) VALUES (1, 0);
+    CREATE TABLE IF NOT EXISTS InventoryValuationCube (
+        SnapshotDate DATE NOT NULL,
+        CategoryID INT NOT NULL,
+        LocationID INT NOT NULL,
+        SupplierID INT NOT NULL,
+        Quantity BIGINT NOT NULL,
+        Value DECIMAL(18, 2) NOT NULL,
+        PRIMARY KEY (SnapshotDate, CategoryID, LocationID, SupplierID)
+    );
+    CREATE TABLE IF NOT EXISTS CustomerSegment (
+        CustomerID INTEGER PRIMARY KEY,
+        Recency INT NOT NULL,
+        Frequency INT NOT NULL,
+        Monetary DECIMAL(18, 2) NOT NULL,
+        RScore TINYINT NOT NULL,
+        FScore TINYINT NOT NULL,
+        MScore TINYINT NOT NULL,
+        Segment VARCHAR(32) NOT NULL,
+        LastSaleDate DATE,
+        UpdatedAt TIMESTAMP NOT NULL DEFAULT {SQLITE_NOW}
+    );
+    CREATE INDEX IF NOT EXISTS idx_segment_monetary ON CustomerSegment (Segment, Monetary);
+    CREATE TABLE IF NOT EXISTS SegmentationState (
+        StateID INTEGER PRIMARY KEY,
+        SalesWatermark BIGINT NOT NULL,
+        Thresholds TEXT NOT NULL,
+        RebuiltAt DATETIME NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS SalesAlert (
+        AlertID INTEGER PRIMARY KEY,
+        SourceTable VARCHAR(16) NOT NULL,
+        SourceID BIGINT NOT NULL,
+        AlertType VARCHAR(32) NOT NULL,
+        CustomerID INT NULL,
+        ProductID INT NULL,
+        Observed DECIMAL(18, 2) NOT NULL,
+        Expected DECIMAL(18, 2) NOT NULL,
+        Score DOUBLE NOT NULL,
+        DetectedAt DATETIME NOT NULL DEFAULT {SQLITE_NOW},
+        UNIQUE (SourceTable, SourceID, AlertType)
+    );
+    CREATE INDEX IF NOT EXISTS idx_alert_detected ON SalesAlert (DetectedAt);
+    CREATE INDEX IF NOT EXISTS idx_alert_type_detected ON SalesAlert (AlertType, DetectedAt);
+    CREATE TABLE IF NOT EXISTS IdempotencyKey (
+        RequestKey CHAR(64) PRIMARY KEY,
+        Operation VARCHAR(32) NOT NULL,
+        Result TEXT NULL,
+        CreatedAt DATETIME NOT NULL DEFAULT {SQLITE_NOW}
+    );
+    CREATE INDEX IF NOT EXISTS idx_idempotency_created ON IdempotencyKey (CreatedAt);
+    CREATE TABLE IF NOT EXISTS ReceivingBatch (
+        BatchID VARCHAR(64) PRIMARY KEY,
+        Scans INT NOT NULL,
+        Units INT NOT NULL,
+        AppliedAt DATETIME NOT NULL DEFAULT {SQLITE_NOW}
+    );
+    CREATE INDEX IF NOT EXISTS idx_receiving_applied ON ReceivingBatch (AppliedAt);
+    CREATE TABLE IF NOT EXISTS ReplenishmentOrder (
+        OrderID INTEGER PRIMARY KEY,
+        RunID CHAR(32) NOT NULL,
+        CreatedAt DATETIME NOT NULL DEFAULT {SQLITE_NOW}
+    );
+    CREATE INDEX IF NOT EXISTS idx_replenishment_run ON ReplenishmentOrder (RunID);
+    CREATE TABLE IF NOT EXISTS LLMResponseCache (
+        ContentHash CHAR(64) PRIMARY KEY,
+        Model VARCHAR(64) NOT NULL,
+        Response TEXT NOT NULL,
+        CreatedAt DATETIME NOT NULL DEFAULT {SQLITE_NOW}
+    );
+    CREATE TABLE IF NOT EXISTS NarrativeReport (
+        ReportDate DATE NOT NULL,
+        EntityType VARCHAR(16) NOT NULL,
+        EntityID INT NOT NULL,
+        EntityName VARCHAR(255) NULL,
+        Summary TEXT NOT NULL,
+        Narrative TEXT NOT NULL,
+        ContentHash CHAR(64) NOT NULL,
+        PRIMARY KEY (ReportDate, EntityType, EntityID)
+    );
+    CREATE TABLE IF NOT EXISTS ReportRun (
+        RunID INTEGER PRIMARY KEY,
+        StartedAt DATETIME NOT NULL,
+        Model VARCHAR(64) NOT NULL,
+        Entities INT NOT NULL,
+        CacheHits INT NOT NULL,
+        Failed INT NOT NULL DEFAULT 0,
+        Calls INT NOT NULL,
+        PromptTokens INT NOT NULL,
+        CompletionTokens INT NOT NULL,
+        MedianLatencyMs DOUBLE NULL,
+        MaxLatencyMs DOUBLE NULL,
+        ElapsedMs DOUBLE NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS AuditSegment (
+        SegmentID INTEGER PRIMARY KEY,
+        PeriodStart DATETIME NOT NULL,
+        FirstAt DATETIME NOT NULL,
+        LastAt DATETIME NOT NULL,
+        Records INT NOT NULL,
+        Payload BLOB NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS idx_auditsegment_period ON AuditSegment (PeriodStart);
+    CREATE TABLE IF NOT EXISTS AuditEntry (
+        SegmentID INT NOT NULL,
+        RecordIndex INT NOT NULL,
+        ChangedAt DATETIME NOT NULL,
+        UserName VARCHAR(64) NOT NULL,
+        EntityTable VARCHAR(64) NOT NULL,
+        EntityKey VARCHAR(128) NOT NULL,
+        Operation VARCHAR(8) NOT NULL,
+        PRIMARY KEY (SegmentID, RecordIndex)
+    );
+    CREATE INDEX IF NOT EXISTS idx_audit_entity ON AuditEntry (EntityTable, EntityKey, ChangedAt);
+    CREATE INDEX IF NOT EXISTS idx_audit_user ON AuditEntry (UserName, ChangedAt);
+    CREATE INDEX IF NOT EXISTS idx_audit_changed ON AuditEntry (ChangedAt);
+    CREATE TABLE IF NOT EXISTS SyncState (
+        TableName VARCHAR(64) PRIMARY KEY,
+        Watermark TEXT NOT NULL
+    );
+"""
+
+
+# Columns added to tables after they were first created: (table, column, definition, backfill)
+SQLITE_ADDED_COLUMNS = [
+    (
+        "CustomerSegment", "LastSaleDate", "DATE",
+        "UPDATE CustomerSegment SET LastSaleDate = date(UpdatedAt, '-' || Recency || ' days')",
+    ),
+    ("ReportRun", "Failed", "INT NOT NULL DEFAULT 0", None),
+]
+
+
+def setup_sqlite_schema(connection):
+    connection.commit()
+    with sqlite_errors():
+        connection.raw.executescript(SQLITE_SCHEMA)
+        for table, column, definition, backfill in SQLITE_ADDED_COLUMNS:
+            columns = [row[1] for row in connection.raw.execute(f"PRAGMA table_info(`{table}`)")]
+            if column not in columns:
+                connection.raw.execute(f"ALTER TABLE `{table}` ADD COLUMN `{column}` {definition}")
+                if backfill:
+                    connection.raw.execute(backfill)
+        for table, key in CDC_TABLES.items():
+            condition = " AND ".join(f"`{column}` = NEW.`{column}`" for column in key)
+            connection.raw.execute(
+                f"""
+                    CREATE TRIGGER IF NOT EXISTS trg_{table.lower()}_updated
+                    AFTER UPDATE ON `{table}` FOR EACH ROW WHEN NEW.UpdatedAt = OLD.UpdatedAt
+                    BEGIN
+                        UPDATE `{table}` SET UpdatedAt = {SQLITE_NOW} WHERE {condition};
+                    END
+                """
+            )
+            connection.raw.execute(
+                f"CREATE INDEX IF NOT EXISTS idx_{table.lower()}_updated ON `{table}` (UpdatedAt, {', '.join(key)})"
+            )
+
+
+# Idempotent schema changes, applied once per server process
+SCHEMA_SETUP = [setup_sqlite_schema] if STORAGE_BACKEND == "sqlite" else [
+    setup_concurrency_control,
+    setup_inventory_ledger,
+    setup_change_capture,
+    setup_valuation_cube,
+    setup_customer_segments,
+    setup_sales_alerts,
+    setup_idempotency,
+    setup_receiving,
+    setup_replenishment,
+    setup_narrative_reports,
+    setup_audit_log,
+]
+
+
+@st.cache_resource
+def applied_schema_setup():
+    return set()
+
+
+def setup_schema(connection):
+    applied = applied_schema_setup()
+    for setup in SCHEMA_SETUP:
+        if setup.__name__ not in applied:
+            setup(connection)
+            applied.add(setup.__name__)
+
+
 def main():
+    started = time.perf_counter()
     st.title("Inventory Management System")
 
     # Connect to the database
     connection = connect_to_database()
-    mongodb_connection = connect_to_mongodb() 
 
-    if connection is not None and mongodb_connection is not None:
+    if connection is not None:
+        setup_schema(connection)
+        change_feed()
+        sales_anomaly_detector()
+        receiving_buffer()
+        maybe_compact_inventory_ledger(connection)
+        maybe_purge_idempotency_keys(connection)
+
         # Sidebar menu
         st.sidebar.title("Menu")
-        main_menu = st.sidebar.selectbox(
-            "Select Main Menu", ["Inventory", "Orders", "Discounts", "Shipments", "Suppliers", "Customer Insights", "Insights"]
-        )
+        allowed_menus = user_sidebar()
+        main_menu = st.sidebar.selectbox("Select Main Menu", allowed_menus)
+        page_scope.name, page_scope.user = f"Page: {main_menu}", current_user()
 
         # # Manual Query Assistant
         # st.sidebar.header("Manual Query Assistant")
@@ -831,17 +6914,19 @@ def main():
         # Dashboard menu
         if main_menu == "Inventory":
             st.header("Inventory")
-            submenu = st.sidebar.radio("Options", ["View Inventory"])
+            submenu = st.sidebar.radio("Options", ["View Inventory", "Inventory Valuation", "Reorder Points", "Replenishment", "Receiving", "Adjust Stock", "Stock History"])
 
             if submenu == "View Inventory":
-                query = """
+                query = f"""
                     SELECT 
                         Product.ProductName, 
-                        Inventory.Quantity, 
+                        Inventory.Quantity + COALESCE(Pending.Delta, 0) AS Quantity, 
                         Location.LocationName, 
                         Location.Address, 
                         Inventory.LastRestockDate
                     FROM Inventory
+                    LEFT JOIN ({PENDING_MOVEMENTS_SUBQUERY}) AS Pending
+                        ON Pending.ProductID = Inventory.ProductID AND Pending.LocationID = Inventory.LocationID
                     LEFT JOIN Product ON Inventory.ProductID = Product.ProductID
                     LEFT JOIN Location ON Inventory.LocationID = Location.LocationID
                 """
@@ -851,6 +6936,24 @@ def main():
                 else:
                     st.info("No inventory records found.")
 
+            elif submenu == "Inventory Valuation":
+                inventory_valuation(connection)
+
+            elif submenu == "Reorder Points":
+                reorder_points_page(connection)
+
+            elif submenu == "Replenishment":
+                replenishment_page(connection)
+
+            elif submenu == "Receiving":
+                receiving_page(connection)
+
+            elif submenu == "Adjust Stock":
+                adjust_stock(connection)
+
+            elif submenu == "Stock History":
+                stock_history(connection)
+
         elif main_menu == "Orders":
             st.header("Orders")
             submenu = st.sidebar.radio("Options", ["Add Order", "Delete Order", "Check Stock Availability", "Track Order", "Modify Order"])
@@ -859,44 +6962,12 @@ def main():
                 add_order(connection)
 
             elif submenu == "Delete Order":
-                delete_order(connection, mongodb_connection)
+                mongodb_connection = connect_to_archive()
+                if mongodb_connection is not None:
+                    delete_order(connection, mongodb_connection)
 
             elif submenu == "Check Stock Availability":
-                st.header("Check Stock Availability")
-                product_id = st.number_input("Enter Product ID", min_value=1, step=1)
-                required_quantity = st.number_input("Enter Required Quantity", min_value=1, step=1)
-
-                if st.button("Check Availability"):
-                    query = """
-                        SELECT 
-                            Product.ProductName, 
-                            Inventory.Quantity AS AvailableStock, 
-                            Location.LocationName, 
-                            Location.Address
-                        FROM Inventory
-                        LEFT JOIN Product ON Inventory.ProductID = Product.ProductID
-                        LEFT JOIN Location ON Inventory.LocationID = Location.LocationID
-                        WHERE Inventory.ProductID = %s
-                    """
-                    cursor = connection.cursor(dictionary=True)
-                    cursor.execute(query, (product_id,))
-                    stock_data = cursor.fetchall()
-
-                    if stock_data:
-                        stock_df = pd.DataFrame(stock_data)
-                        total_stock = stock_df['AvailableStock'].sum()
-                        sufficient_stock = total_stock >= required_quantity
-
-                        st.write("Stock Details:")
-                        st.dataframe(stock_df)
-
-                        st.write(f"Total Available Stock: **{total_stock}**")
-                        if sufficient_stock:
-                            st.success("Sufficient stock is available.")
-                        else:
-                            st.error("Insufficient stock.")
-                    else:
-                        st.warning("Product not found in inventory.")
+                check_stock_availability(connection)
 
             elif submenu == "Track Order":
                 track_order(connection)
@@ -979,7 +7050,18 @@ def main():
                                 SET DiscountPercent = %s, StartDate = %s, EndDate = %s
                                 WHERE DiscountID = %s
                             """
-                            if execute_query(connection, update_query, (new_discount_percent, new_start_date, new_end_date, discount_id)):
+                            queued = write_queue().submit(
+                                update_query, ("Discount", discount_id), (new_discount_percent, new_start_date, new_end_date, discount_id)
+                            )
+                            try:
+                                updated = queued.result(timeout=WRITE_QUEUE_TIMEOUT)
+                            except FutureTimeout:
+                                updated = False
+                                st.warning("Discount update is queued and will be applied shortly.")
+                            except Error as e:
+                                updated = False
+                                st.error(f"Error executing query: {e}")
+                            if updated:
                                 st.success("Discount updated successfully!")
 
                                 # Refresh the data after updating
@@ -989,8 +7071,6 @@ def main():
                                     st.dataframe(refreshed_data, use_container_width=True)
                                 else:
                                     st.info("No discounts available.")
-                            else:
-                                st.error("Failed to update the discount.")
                     else:
                         st.warning("Discount ID not found. Please enter a valid Discount ID.")
         
@@ -1008,17 +7088,49 @@ def main():
                 delete_supplier(connection)
 
         elif main_menu == "Customer Insights":
+            if st.sidebar.toggle("Analytics Mode", key="analytics_mode"):
+                maybe_refresh_analytics_snapshot(connection)
             customer_insights(connection)
 
         elif main_menu == "Insights":
+            if st.sidebar.toggle("Analytics Mode", key="analytics_mode"):
+                maybe_refresh_analytics_snapshot(connection)
             dashboard_tab = st.sidebar.radio(
                 "Dashboard Insights",
-                ["Supplier Performance"]
+                ["Supplier Performance", "Analytics", "Sales Alerts", "Daily Reports"]
             )
             if dashboard_tab == "Supplier Performance":
                 supplier_performance_dashboard(connection)
 
+            elif dashboard_tab == "Analytics":
+                analytics_dashboard(connection)
+
+            elif dashboard_tab == "Sales Alerts":
+                sales_alerts(connection)
+
+            elif dashboard_tab == "Daily Reports":
+                narrative_reports_page(connection)
+
+        elif main_menu == "System":
+            submenu = st.sidebar.radio("Options", ["Diagnostics", "Jobs", "Change Feed", "Partitions", "Audit Log"])
+
+            if submenu == "Diagnostics":
+                diagnostics(connection)
+
+            elif submenu == "Jobs":
+                jobs_page(connection)
+
+            elif submenu == "Change Feed":
+                change_feed_status()
+
+            elif submenu == "Partitions":
+                partition_manager(connection)
+
+            elif submenu == "Audit Log":
+                audit_log_page(connection)
+
         connection.close()
+        record_rerun(f"Page: {main_menu}", (time.perf_counter() - started) * 1000)
     else:
         st.error("Unable to connect to the database.")
 
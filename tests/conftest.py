@@ -0,0 +1,34 @@
+import atexit
+import json
+import os
+import shutil
+import sys
+import tempfile
+
+# dashboard reads its backend at import time; tests run on the SQLite backend in a scratch directory
+DATA_DIR = tempfile.mkdtemp(prefix="inventory-tests-")
+atexit.register(shutil.rmtree, DATA_DIR, ignore_errors=True)
+os.environ["INVENTORY_BACKEND"] = "sqlite"
+os.environ["INVENTORY_SQLITE_PATH"] = os.path.join(DATA_DIR, "inventory.db")
+os.environ["INVENTORY_ARCHIVE_DIR"] = os.path.join(DATA_DIR, "archive")
+os.environ["INVENTORY_ANALYTICS_PATH"] = os.path.join(DATA_DIR, "analytics.duckdb")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest  # noqa: E402
+
+# Tests marked "mysql" need a scratch database, given as a JSON mysql.connector config, e.g.
+# INVENTORY_TEST_MYSQL='{"user": "root", "password": "password", "database": "inventory_test"}'.
+# They create the tables they use there and drop them again afterwards.
+MYSQL_TEST_CONFIG = json.loads(os.environ.get("INVENTORY_TEST_MYSQL", "null"))
+
+
+def pytest_configure(config):
+    config.addinivalue_line("markers", "mysql: needs the MySQL scratch database named by INVENTORY_TEST_MYSQL")
+    config.addinivalue_line("markers", "benchmark: timing budgets; deselect with -m 'not benchmark' on slow machines")
+
+
+@pytest.fixture
+def mysql_config():
+    if MYSQL_TEST_CONFIG is None:
+        pytest.skip("INVENTORY_TEST_MYSQL is not set")
+    return MYSQL_TEST_CONFIG
@@ -0,0 +1,71 @@
+from datetime import date, timedelta
+
+import pytest
+
+import dashboard
+
+TODAY = date.today()
+
+
+@pytest.fixture
+def snapshot(tmp_path, monkeypatch):
+    # A small sales history copied into the DuckDB snapshot, with analytics mode on and
+    # the MySQL fallback turned into a failure
+    monkeypatch.setattr(dashboard, "SQLITE_PATH", str(tmp_path / "inventory.db"))
+    connection = dashboard.open_connection()
+    dashboard.setup_sqlite_schema(connection)
+    cursor = connection.cursor()
+    cursor.execute("INSERT INTO Supplier (SupplierID, SupplierName) VALUES (1, 'Supplier')")
+    cursor.executemany(
+        "INSERT INTO Customer (CustomerID, CustomerName) VALUES (%s, %s)", [(1, "Ada"), (2, "Grace"), (3, "Linus")]
+    )
+    cursor.execute("INSERT INTO Product (ProductID, ProductName, Price) VALUES (1, 'Widget', 2.5)")
+    cursor.executemany(
+        "INSERT INTO Sales (CustomerID, ProductID, SaleDate, SaleAmount) VALUES (%s, 1, %s, %s)",
+        [(1, TODAY - timedelta(days=3), 10), (1, TODAY - timedelta(days=40), 20), (2, TODAY - timedelta(days=9), 5)],
+    )
+    # Old enough for the snapshot's commit lag on "updated" tables
+    written = "2000-01-01 00:00:00"
+    cursor.execute(
+        "INSERT INTO `Order` (OrderID, SupplierID, OrderDate, Status, UpdatedAt) VALUES (1, 1, %s, 'Pending', %s)",
+        (TODAY, written),
+    )
+    cursor.execute(
+        "INSERT INTO OrderItem (OrderID, ProductID, Quantity, Price, UpdatedAt) VALUES (1, 1, 4, 2.5, %s)", (written,)
+    )
+    connection.commit()
+    dashboard.refresh_analytics_snapshot(connection)
+
+    def no_fallback(*args, **kwargs):
+        raise AssertionError(f"fell back to the database: {args[1]}")
+
+    monkeypatch.setattr(dashboard, "analytics_mode_enabled", lambda: True)
+    monkeypatch.setattr(dashboard, "fetch_table_data", no_fallback)
+    yield connection
+    connection.close()
+
+
+def test_duckdb_answers_every_insight_query(snapshot):
+    start, end = TODAY - timedelta(days=30), TODAY
+
+    totals = dashboard.customer_sales_totals(snapshot, start, end).set_index("Customer")
+    assert totals.loc["Ada", "TotalSpent"] == 10 and totals.loc["Linus", "TotalOrders"] == 0
+
+    orders = dashboard.supplier_order_totals(snapshot, start, end)
+    assert orders["OrderValue"].tolist() == [10]
+
+    trend, days = dashboard.sales_trend.__wrapped__(snapshot, start, end, dashboard.DOWNSAMPLING_METHODS[0], True)
+    assert days == 2 and trend["Revenue"].sum() == 15
+
+    features = dashboard.rfm_features(snapshot).set_index("CustomerID")
+    assert features.loc[1, "Recency"] == 3 and features.loc[2, "Frequency"] == 1
+    assert dashboard.rfm_features(snapshot, [2]).index.size == 1
+
+    # The first refresh rebuilds; the second only looks for sales past the watermark
+    assert dashboard.refresh_customer_segments(snapshot) == 2
+    assert dashboard.refresh_customer_segments(snapshot) == 0
+
+
+def test_duckdb_errors_fall_back_to_the_database(snapshot, monkeypatch):
+    monkeypatch.setattr(dashboard, "fetch_table_data", lambda connection, query, params=None: "database")
+    assert dashboard.run_insight_query(snapshot, "SELECT * FROM NotInTheSnapshot") == "database"
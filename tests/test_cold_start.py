@@ -0,0 +1,18 @@
+import pytest
+
+import dashboard
+
+# Imported inside the functions that use them; a cold start must not pay for them
+LAZY_DEPENDENCIES = {"duckdb", "langchain_groq", "pymongo", "pymysqlreplication", "scipy"}
+
+
+@pytest.mark.benchmark
+def test_import_stays_within_the_cold_start_budget():
+    profile = dashboard.import_time_profile()
+    total_ms = profile.loc[profile["Module"] == "dashboard", "CumulativeMs"].sum()
+    assert 0 < total_ms <= dashboard.COLD_START_BUDGET_MS
+
+
+def test_feature_dependencies_are_not_imported_at_startup():
+    profile = dashboard.import_time_profile()
+    assert LAZY_DEPENDENCIES.isdisjoint(profile["Module"])
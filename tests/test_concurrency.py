@@ -0,0 +1,224 @@
+import random
+import threading
+import uuid
+from datetime import date
+
+import mysql.connector
+import pytest
+from mysql.connector import Error
+
+import dashboard
+
+WRITERS = 50
+PRODUCTS = (1, 2)
+LOCATIONS = (1, 2)
+STOCK_PER_LOCATION = 60
+
+MYSQL_BASE_TABLES = [
+    "CREATE TABLE Supplier (SupplierID INT AUTO_INCREMENT PRIMARY KEY, SupplierName VARCHAR(255) NOT NULL)",
+    "CREATE TABLE Location (LocationID INT AUTO_INCREMENT PRIMARY KEY, LocationName VARCHAR(255) NOT NULL)",
+    """
+        CREATE TABLE Product (
+            ProductID INT AUTO_INCREMENT PRIMARY KEY,
+            ProductName VARCHAR(255) NOT NULL,
+            Price DECIMAL(10, 2) NOT NULL DEFAULT 0
+        )
+    """,
+    "CREATE TABLE Inventory (ProductID INT NOT NULL, LocationID INT NOT NULL, Quantity INT NOT NULL DEFAULT 0)",
+    """
+        CREATE TABLE `Order` (
+            OrderID INT AUTO_INCREMENT PRIMARY KEY,
+            SupplierID INT,
+            OrderDate DATE NOT NULL,
+            Status VARCHAR(32) NOT NULL DEFAULT 'Pending'
+        )
+    """,
+    """
+        CREATE TABLE OrderItem (
+            OrderItemID INT AUTO_INCREMENT PRIMARY KEY,
+            OrderID INT NOT NULL,
+            ProductID INT NOT NULL,
+            Quantity INT NOT NULL,
+            Price DECIMAL(10, 2) NOT NULL
+        )
+    """,
+]
+MYSQL_SETUP = [
+    dashboard.setup_concurrency_control,
+    dashboard.setup_inventory_ledger,
+    dashboard.setup_idempotency,
+    dashboard.setup_receiving,
+]
+MYSQL_TABLES = (
+    "Supplier", "Location", "Product", "Inventory", "Order", "OrderItem",
+    "InventoryMovement", "InventoryLedgerState", "IdempotencyKey", "ReceivingBatch",
+)
+
+
+def drop_mysql_tables(connection):
+    cursor = connection.cursor()
+    cursor.execute("DROP TABLE IF EXISTS " + ", ".join(f"`{table}`" for table in MYSQL_TABLES))
+    connection.commit()
+
+
+@pytest.fixture(params=["sqlite", pytest.param("mysql", marks=pytest.mark.mysql)])
+def connect(request, tmp_path, monkeypatch):
+    # Opens a standalone connection on the backend under test, as open_connection does
+    if request.param == "sqlite":
+        monkeypatch.setattr(dashboard, "SQLITE_PATH", str(tmp_path / "inventory.db"))
+        connection = dashboard.open_connection()
+        dashboard.setup_sqlite_schema(connection)
+        connection.close()
+        yield dashboard.open_connection
+        return
+
+    config = request.getfixturevalue("mysql_config")
+    connection = mysql.connector.connect(**config)
+    drop_mysql_tables(connection)
+    cursor = connection.cursor()
+    for statement in MYSQL_BASE_TABLES:
+        cursor.execute(statement)
+    for setup in MYSQL_SETUP:
+        setup(connection)
+    try:
+        yield lambda: mysql.connector.connect(**config)
+    finally:
+        drop_mysql_tables(connection)
+        connection.close()
+
+
+@pytest.fixture
+def database(connect):
+    connection = connect()
+    cursor = connection.cursor()
+    cursor.execute("INSERT INTO Supplier (SupplierID, SupplierName) VALUES (1, 'Supplier')")
+    cursor.executemany(
+        "INSERT INTO Location (LocationID, LocationName) VALUES (%s, %s)",
+        [(location_id, f"Location {location_id}") for location_id in LOCATIONS],
+    )
+    cursor.executemany(
+        "INSERT INTO Product (ProductID, ProductName, Price) VALUES (%s, %s, 1)",
+        [(product_id, f"Product {product_id}") for product_id in PRODUCTS],
+    )
+    cursor.executemany(
+        "INSERT INTO Inventory (ProductID, LocationID, Quantity) VALUES (%s, %s, %s)",
+        [(product_id, location_id, STOCK_PER_LOCATION) for product_id in PRODUCTS for location_id in LOCATIONS],
+    )
+    connection.commit()
+    yield connection
+    connection.close()
+
+
+def submit_order(connection, items):
+    # What the Add Order page does on submit: dashboard.place_order under run_idempotent,
+    # so it runs through run_in_transaction with the audit cursor
+    lines = [(product_id, quantity, 1.0) for product_id, quantity in items]
+    (order_id, _), replayed = dashboard.run_idempotent(
+        connection,
+        uuid.uuid4().hex,
+        "add_order",
+        lambda cursor: dashboard.place_order(cursor, 1, date.today(), "Pending", lines),
+    )
+    assert not replayed
+    return order_id
+
+
+def available_stock(connection):
+    cursor = connection.cursor()
+    cursor.execute(
+        f"""
+            SELECT Inventory.ProductID, Inventory.LocationID,
+                   Inventory.Quantity + COALESCE(Pending.Delta, 0)
+            FROM Inventory
+            LEFT JOIN ({dashboard.PENDING_MOVEMENTS_SUBQUERY}) AS Pending
+                ON Pending.ProductID = Inventory.ProductID AND Pending.LocationID = Inventory.LocationID
+        """
+    )
+    stock = {(row[0], row[1]): row[2] for row in cursor.fetchall()}
+    connection.rollback()
+    return stock
+
+
+def test_concurrent_writers_never_oversell(connect, database):
+    placed = []
+    failures = []
+    lock = threading.Lock()
+    start = threading.Barrier(WRITERS)
+
+    def writer(seed):
+        rng = random.Random(seed)
+        connection = connect()
+        try:
+            start.wait()
+            while True:
+                items = [(product_id, rng.randint(1, 3)) for product_id in rng.sample(PRODUCTS, rng.randint(1, 2))]
+                try:
+                    order_id = submit_order(connection, items)
+                except dashboard.InsufficientStock:
+                    return  # sold out for this writer's next order
+                except Error as e:
+                    if e.errno in dashboard.TRANSIENT_ERRNOS:
+                        continue  # out of retries under contention; try another order
+                    raise
+                with lock:
+                    placed.append((order_id, items))
+        except Exception as e:
+            with lock:
+                failures.append(e)
+        finally:
+            connection.close()
+
+    threads = [threading.Thread(target=writer, args=(seed,)) for seed in range(WRITERS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert not failures
+    stock = available_stock(database)
+    assert all(quantity >= 0 for quantity in stock.values()), stock
+    for product_id in PRODUCTS:
+        sold = sum(quantity for _, items in placed for item, quantity in items if item == product_id)
+        remaining = sum(quantity for (item, _), quantity in stock.items() if item == product_id)
+        assert sold + remaining == STOCK_PER_LOCATION * len(LOCATIONS)
+
+    # Every committed order reserved exactly its items, and nothing else was reserved
+    cursor = database.cursor()
+    cursor.execute("SELECT OrderID, ProductID, -SUM(Quantity) FROM InventoryMovement GROUP BY OrderID, ProductID")
+    reserved = {(row[0], row[1]): row[2] for row in cursor.fetchall()}
+    assert reserved == {(order_id, product_id): quantity for order_id, items in placed for product_id, quantity in items}
+
+
+def test_editing_order_lines_moves_the_reservation(database):
+    order_id = submit_order(database, [(1, 10), (2, 5)])
+
+    def edit(cursor):
+        cursor.execute("UPDATE OrderItem SET ProductID = 2, Quantity = 7 WHERE OrderID = %s AND ProductID = 1", (order_id,))
+        dashboard.rereserve_order_stock(cursor, order_id, [1, 2])
+
+    dashboard.run_in_transaction(database, edit)
+    cursor = database.cursor()
+    cursor.execute("SELECT ProductID, -SUM(Quantity) FROM InventoryMovement WHERE OrderID = %s GROUP BY ProductID", (order_id,))
+    assert {row[0]: row[1] for row in cursor.fetchall()} == {1: 0, 2: 12}
+
+    def oversize(cursor):
+        cursor.execute("UPDATE OrderItem SET Quantity = 500 WHERE OrderID = %s", (order_id,))
+        dashboard.rereserve_order_stock(cursor, order_id, [2])
+
+    with pytest.raises(dashboard.InsufficientStock):
+        dashboard.run_in_transaction(database, oversize)
+    cursor.execute("SELECT SUM(Quantity) FROM OrderItem WHERE OrderID = %s", (order_id,))
+    assert cursor.fetchone()[0] == 12
+    database.rollback()
+
+
+def test_stock_held_only_as_movements_gets_a_lock_row(database):
+    cursor = database.cursor()
+    cursor.execute("INSERT INTO Location (LocationID, LocationName) VALUES (3, 'Location 3')")
+    dashboard.record_movements(cursor, [(1, 3, "Receipt", 5, None)])
+    database.commit()
+
+    dashboard.run_in_transaction(database, lambda cursor: dashboard.reserve_stock(cursor, [(1, 125)]))
+    cursor.execute("SELECT Quantity FROM Inventory WHERE ProductID = 1 AND LocationID = 3")
+    assert cursor.fetchone()[0] == 0
+    assert available_stock(database)[(1, 3)] == 0
@@ -0,0 +1,118 @@
+import pytest
+from streamlit.testing.v1 import AppTest
+
+import dashboard
+
+
+@pytest.fixture
+def database(tmp_path, monkeypatch):
+    monkeypatch.setattr(dashboard, "SQLITE_PATH", str(tmp_path / "inventory.db"))
+    connection = dashboard.open_connection()
+    dashboard.setup_sqlite_schema(connection)
+    cursor = connection.cursor()
+    cursor.execute("INSERT INTO Supplier (SupplierID, SupplierName) VALUES (1, 'Supplier')")
+    cursor.execute("INSERT INTO Location (LocationID, LocationName) VALUES (1, 'Location 1')")
+    cursor.executemany(
+        "INSERT INTO Product (ProductID, ProductName, Price) VALUES (%s, %s, 1)", [(1, "Widget"), (2, "Gadget")]
+    )
+    cursor.executemany("INSERT INTO Inventory (ProductID, LocationID, Quantity) VALUES (%s, 1, 20)", [(1,), (2,)])
+    connection.commit()
+    (order_id, _), _ = dashboard.run_idempotent(
+        connection,
+        "fragments-order",
+        "add_order",
+        lambda cursor: dashboard.place_order(cursor, 1, "2024-01-01", "Pending", [(1, 5, 1.0), (2, 3, 1.0)]),
+    )
+    dashboard.statement_registry.clear()
+    yield connection, order_id
+    connection.close()
+
+
+def order_items(connection, order_id):
+    cursor = connection.cursor(dictionary=True)
+    cursor.execute(
+        "SELECT OrderItemID, ProductID, Quantity, Price, Version FROM OrderItem WHERE OrderID = %s ORDER BY OrderItemID",
+        (order_id,),
+    )
+    items = cursor.fetchall()
+    connection.rollback()
+    return items
+
+
+def reserved(connection, order_id):
+    cursor = connection.cursor()
+    cursor.execute("SELECT ProductID, -SUM(Quantity) FROM InventoryMovement WHERE OrderID = %s GROUP BY ProductID", (order_id,))
+    totals = dict(cursor.fetchall())
+    connection.rollback()
+    return totals
+
+
+def test_fragment_connection_reuses_an_open_page_connection(database):
+    connection, _ = database
+    page = dashboard.ConnectionRouter(connection, [])
+    with dashboard.fragment_connection(page) as live:
+        assert live is page
+
+
+def test_fragment_connection_opens_its_own_after_the_page_closed(database):
+    connection, _ = database
+    page = dashboard.ConnectionRouter(dashboard.open_connection(), [])
+    page.close()
+    with dashboard.fragment_connection(page) as live:
+        assert live is not page and not live.closed
+        cursor = live.cursor()
+        cursor.execute("SELECT COUNT(*) FROM Product")
+        assert cursor.fetchone()[0] == 2
+    assert live.closed
+
+
+def test_update_order_items_checks_versions_and_moves_stock(database):
+    connection, order_id = database
+    first, second = order_items(connection, order_id)
+    edited = dict(first, ProductID=2, Quantity=4)
+
+    dashboard.run_in_transaction(
+        connection, lambda cursor: dashboard.update_order_items(cursor, order_id, [edited], {1, 2})
+    )
+    assert [(item["ProductID"], item["Quantity"], item["Version"]) for item in order_items(connection, order_id)] == [
+        (2, 4, first["Version"] + 1),
+        (2, 3, second["Version"]),
+    ]
+    assert reserved(connection, order_id) == {1: 0, 2: 7}
+
+    # The grid still holds the old Version: the save is refused and nothing changes
+    stale = dict(first, Quantity=1)
+    with pytest.raises(dashboard.ConcurrencyConflict):
+        dashboard.run_in_transaction(
+            connection, lambda cursor: dashboard.update_order_items(cursor, order_id, [stale], {2})
+        )
+    assert reserved(connection, order_id) == {1: 0, 2: 7}
+
+
+def modify_order_page():
+    import dashboard
+
+    connection = dashboard.ConnectionRouter(dashboard.open_connection(), [])
+    dashboard.fetch_order_working_set(connection, 1)
+    dashboard.session_cache_put("current", "order", 1)
+    dashboard.order_header_form(connection, 1)
+    dashboard.order_items_grid(connection, 1)
+    dashboard.order_stock_panel(connection, 1)
+    connection.close()
+
+
+def fragment_runs(name):
+    return len(dashboard.rerun_timings()["samples"].get(f"Fragment: {name}", []))
+
+
+def test_modify_order_fragments_render_the_working_set(database):
+    before = {name: fragment_runs(name) for name in ("Order Header", "Order Items", "Order Stock")}
+    app = AppTest.from_function(modify_order_page, default_timeout=60)
+    app.run()
+    assert not app.exception
+    assert "0 of 2 items changed" in [caption.value for caption in app.caption]
+    assert all(fragment_runs(name) == runs + 1 for name, runs in before.items())
+
+    # A fragment's own button runs after the page connection was closed
+    next(button for button in app.button if button.label == "Check Stock for Items").click().run()
+    assert not app.exception and not app.error
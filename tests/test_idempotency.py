@@ -0,0 +1,45 @@
+import pytest
+
+import dashboard
+
+
+@pytest.fixture
+def database(tmp_path, monkeypatch):
+    monkeypatch.setattr(dashboard, "SQLITE_PATH", str(tmp_path / "inventory.db"))
+    connection = dashboard.open_connection()
+    dashboard.setup_sqlite_schema(connection)
+    dashboard.idempotency_purge_state.clear()
+    yield connection
+    dashboard.idempotency_purge_state.clear()
+    connection.close()
+
+
+def test_explicit_key_only_replays_the_same_payload(monkeypatch):
+    monkeypatch.setattr(dashboard.st, "query_params", {"idempotency_key": "client-key-1"})
+    first = dashboard.request_key("add_order", [1, "2024-01-01", [{"ProductID": 1, "Quantity": 2}]])
+    retry = dashboard.request_key("add_order", [1, "2024-01-01", [{"ProductID": 1, "Quantity": 2}]])
+    changed = dashboard.request_key("add_order", [1, "2024-01-01", [{"ProductID": 1, "Quantity": 3}]])
+    assert first == retry
+    assert changed != first
+
+
+def test_expired_keys_are_purged_from_the_page_at_most_once_per_interval(database):
+    cursor = database.cursor()
+    cursor.execute(
+        "INSERT INTO IdempotencyKey (RequestKey, Operation, CreatedAt) VALUES ('old', 'add_order', NOW() - INTERVAL %s DAY)",
+        (dashboard.IDEMPOTENCY_KEY_TTL_DAYS + 1,),
+    )
+    cursor.execute("INSERT INTO IdempotencyKey (RequestKey, Operation) VALUES ('new', 'add_order')")
+    database.commit()
+
+    dashboard.maybe_purge_idempotency_keys(database)
+    cursor.execute("SELECT RequestKey FROM IdempotencyKey")
+    assert cursor.fetchall() == [("new",)]
+
+    cursor.execute(
+        "UPDATE IdempotencyKey SET CreatedAt = NOW() - INTERVAL %s DAY", (dashboard.IDEMPOTENCY_KEY_TTL_DAYS + 1,)
+    )
+    database.commit()
+    dashboard.maybe_purge_idempotency_keys(database)
+    cursor.execute("SELECT COUNT(*) FROM IdempotencyKey")
+    assert cursor.fetchone()[0] == 1
@@ -0,0 +1,169 @@
+import json
+import sqlite3
+from types import SimpleNamespace
+
+import mysql.connector
+import pytest
+
+import dashboard
+
+LOCATIONS = 25  # three batches of REPORT_BATCH_SIZE
+OLD_REPORT_RUN = """
+    CREATE TABLE ReportRun (
+        RunID INTEGER PRIMARY KEY,
+        StartedAt DATETIME NOT NULL,
+        Model VARCHAR(64) NOT NULL,
+        Entities INT NOT NULL,
+        CacheHits INT NOT NULL,
+        Calls INT NOT NULL,
+        PromptTokens INT NOT NULL,
+        CompletionTokens INT NOT NULL,
+        MedianLatencyMs DOUBLE NULL,
+        MaxLatencyMs DOUBLE NULL,
+        ElapsedMs DOUBLE NOT NULL
+    )
+"""
+
+
+class FailingBatchModel(dashboard.StubChatModel):
+    # The batch holding Location 15 always errors, as a rate limit that outlasts the retries would
+    def __init__(self):
+        self.prompts = []
+
+    async def ainvoke(self, prompt):
+        self.prompts.append(prompt)
+        if '"key":"Location:15"' in prompt:
+            raise RuntimeError("429 Too Many Requests")
+        return await super().ainvoke(prompt)
+
+
+class ForgetfulModel(dashboard.StubChatModel):
+    # Answers for every entity but Location 3
+    async def ainvoke(self, prompt):
+        response = await super().ainvoke(prompt)
+        narratives = json.loads(response.content)
+        narratives.pop("Location:3", None)
+        response.content = json.dumps(narratives)
+        return response
+
+
+@pytest.fixture
+def database(tmp_path, monkeypatch):
+    monkeypatch.setattr(dashboard, "SQLITE_PATH", str(tmp_path / "inventory.db"))
+    monkeypatch.setattr(dashboard, "LLM_RETRIES", 0)
+    monkeypatch.setattr(dashboard, "LLM_REQUESTS_PER_MINUTE", 6000)
+    connection = dashboard.open_connection()
+    dashboard.setup_sqlite_schema(connection)
+    cursor = connection.cursor()
+    cursor.execute("INSERT INTO Product (ProductID, ProductName, Price) VALUES (1, 'Widget', 2.5)")
+    cursor.executemany(
+        "INSERT INTO Location (LocationID, LocationName) VALUES (%s, %s)",
+        [(location_id, f"Store {location_id}") for location_id in range(1, LOCATIONS + 1)],
+    )
+    cursor.executemany(
+        "INSERT INTO Inventory (ProductID, LocationID, Quantity) VALUES (1, %s, %s)",
+        [(location_id, location_id * 3) for location_id in range(1, LOCATIONS + 1)],
+    )
+    connection.commit()
+    yield connection
+    connection.close()
+
+
+def count(connection, table):
+    cursor = connection.cursor()
+    cursor.execute(f"SELECT COUNT(*) FROM {table}")
+    rows = cursor.fetchone()[0]
+    connection.rollback()
+    return rows
+
+
+def test_all_batches_narrated_then_served_from_cache(database):
+    run = dashboard.generate_narrative_reports(database, dashboard.StubChatModel())
+    assert (run["Entities"], run["CacheHits"], run["Failed"], run["Calls"]) == (LOCATIONS, 0, 0, 3)
+    assert run["Errors"] == {}
+    assert count(database, "NarrativeReport") == LOCATIONS
+
+    again = dashboard.generate_narrative_reports(database, dashboard.StubChatModel())
+    assert (again["CacheHits"], again["Calls"]) == (LOCATIONS, 0)
+    cursor = database.cursor()
+    cursor.execute("SELECT Failed, Calls FROM ReportRun ORDER BY RunID")
+    assert cursor.fetchall() == [(0, 3), (0, 0)]
+
+
+def test_failed_batch_keeps_the_successful_ones(database):
+    model = FailingBatchModel()
+    run = dashboard.generate_narrative_reports(database, model)
+    assert len(model.prompts) == 3
+    assert run["Failed"] == 10
+    assert sorted(run["Errors"]) == sorted(f"Location:{location_id}" for location_id in range(11, 21))
+    assert all(error.startswith("RuntimeError: 429") for error in run["Errors"].values())
+    assert count(database, "NarrativeReport") == LOCATIONS - 10
+    assert count(database, "LLMResponseCache") == LOCATIONS - 10
+
+    # The next run only asks for what failed
+    retry = dashboard.generate_narrative_reports(database, dashboard.StubChatModel())
+    assert (retry["CacheHits"], retry["Calls"], retry["Failed"]) == (LOCATIONS - 10, 1, 0)
+    assert count(database, "NarrativeReport") == LOCATIONS
+
+
+def test_entity_missing_from_the_answer_counts_as_failed(database):
+    run = dashboard.generate_narrative_reports(database, ForgetfulModel())
+    assert run["Errors"] == {"Location:3": "missing from the model's answer"}
+    assert count(database, "NarrativeReport") == LOCATIONS - 1
+
+
+def test_job_fails_with_the_partial_result(database, monkeypatch):
+    monkeypatch.setattr(dashboard, "report_model", FailingBatchModel)
+    job = SimpleNamespace(progress=lambda *args, **kwargs: None)
+    with pytest.raises(RuntimeError, match=f"Narrated {LOCATIONS - 10} of {LOCATIONS} entities") as failure:
+        dashboard.narrative_report_job(job, {})
+    assert "Location:15 (RuntimeError: 429 Too Many Requests)" in str(failure.value)
+    assert count(database, "NarrativeReport") == LOCATIONS - 10
+
+
+def test_report_runs_from_before_failed_was_recorded_are_migrated(tmp_path, monkeypatch):
+    path = tmp_path / "old.db"
+    old = sqlite3.connect(path)
+    old.execute(OLD_REPORT_RUN)
+    old.execute(
+        "INSERT INTO ReportRun (StartedAt, Model, Entities, CacheHits, Calls, PromptTokens, CompletionTokens, ElapsedMs) "
+        "VALUES ('2024-01-01 06:00:00', 'stub', 5, 2, 1, 100, 50, 12.5)"
+    )
+    old.commit()
+    old.close()
+
+    monkeypatch.setattr(dashboard, "SQLITE_PATH", str(path))
+    connection = dashboard.open_connection()
+    dashboard.setup_sqlite_schema(connection)
+    cursor = connection.cursor()
+    cursor.execute("SELECT Entities, CacheHits, Failed FROM ReportRun")
+    assert cursor.fetchall() == [(5, 2, 0)]
+    connection.close()
+
+
+@pytest.mark.mysql
+def test_report_run_failed_column_is_added_on_mysql(mysql_config):
+    connection = mysql.connector.connect(**mysql_config)
+    cursor = connection.cursor()
+    drop = "DROP TABLE IF EXISTS ReportRun, NarrativeReport, LLMResponseCache"
+    cursor.execute(drop)
+    try:
+        cursor.execute(OLD_REPORT_RUN.replace("INTEGER PRIMARY KEY", "BIGINT AUTO_INCREMENT PRIMARY KEY"))
+        cursor.execute(
+            "INSERT INTO ReportRun (StartedAt, Model, Entities, CacheHits, Calls, PromptTokens, CompletionTokens, ElapsedMs) "
+            "VALUES ('2024-01-01 06:00:00', 'stub', 5, 2, 1, 100, 50, 12.5)"
+        )
+        connection.commit()
+        dashboard.setup_narrative_reports(connection)
+        dashboard.setup_narrative_reports(connection)  # a second run finds the column and leaves it
+        cursor.execute(
+            "SELECT COLUMN_NAME FROM INFORMATION_SCHEMA.COLUMNS "
+            "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'ReportRun' ORDER BY ORDINAL_POSITION"
+        )
+        columns = [row[0] for row in cursor.fetchall()]
+        assert columns[columns.index("CacheHits") + 1] == "Failed"
+        cursor.execute("SELECT Failed FROM ReportRun")
+        assert cursor.fetchall() == [(0,)]
+    finally:
+        cursor.execute(drop)
+        connection.close()
@@ -0,0 +1,97 @@
+from datetime import date
+
+import mysql.connector
+import pytest
+
+import dashboard
+
+
+class SchemaCursor:
+    # Answers partitioning_blockers' two INFORMATION_SCHEMA queries from canned rows
+    def __init__(self, connection):
+        self.connection = connection
+        self.rows = []
+
+    def execute(self, query, params=None):
+        self.connection.statements.append(query)
+        if "INFORMATION_SCHEMA.STATISTICS" in query:
+            self.rows = self.connection.unique_keys
+        elif "INFORMATION_SCHEMA.KEY_COLUMN_USAGE" in query:
+            self.rows = self.connection.foreign_keys
+        else:
+            self.rows = []
+
+    def fetchall(self):
+        return self.rows
+
+
+class SchemaConnection:
+    def __init__(self, unique_keys=(), foreign_keys=()):
+        self.unique_keys = list(unique_keys)
+        self.foreign_keys = list(foreign_keys)
+        self.statements = []
+
+    def cursor(self):
+        return SchemaCursor(self)
+
+
+def test_order_is_not_offered_for_native_partitioning():
+    # OrderItem and Shipment reference Order by foreign key
+    assert "Order" not in dashboard.PARTITIONED_TABLES
+
+
+def test_partition_by_month_refuses_a_table_that_does_not_qualify():
+    connection = SchemaConnection(
+        unique_keys=[("PRIMARY",)], foreign_keys=[("fk_sales_customer", "Sales", "Customer")]
+    )
+    with pytest.raises(ValueError, match="unique key PRIMARY does not include SaleDate"):
+        dashboard.partition_by_month(connection, "Sales", date(2024, 1, 1), 12)
+    assert not any(statement.startswith("ALTER") for statement in connection.statements)
+
+
+def test_partition_by_month_partitions_a_table_that_qualifies():
+    connection = SchemaConnection()
+    dashboard.partition_by_month(connection, "AuditEntry", date(2024, 1, 1), 2)
+    assert connection.statements[-1] == (
+        "ALTER TABLE `AuditEntry` PARTITION BY RANGE (TO_DAYS(`ChangedAt`)) ("
+        "PARTITION p202401 VALUES LESS THAN (TO_DAYS('2024-02-01')), "
+        "PARTITION p202402 VALUES LESS THAN (TO_DAYS('2024-03-01')), "
+        "PARTITION pmax VALUES LESS THAN MAXVALUE)"
+    )
+
+
+@pytest.mark.mysql
+def test_partitioning_blockers_reads_the_schema(mysql_config, monkeypatch):
+    monkeypatch.setitem(dashboard.PARTITIONED_TABLES, "PartitionParent", "CreatedOn")
+    monkeypatch.setitem(dashboard.PARTITIONED_TABLES, "PartitionLog", "CreatedOn")
+    connection = mysql.connector.connect(**mysql_config)
+    cursor = connection.cursor()
+    drop = "DROP TABLE IF EXISTS PartitionChild, PartitionParent, PartitionLog"
+    cursor.execute(drop)
+    try:
+        cursor.execute("CREATE TABLE PartitionParent (ParentID INT PRIMARY KEY, CreatedOn DATE NOT NULL)")
+        cursor.execute(
+            """
+                CREATE TABLE PartitionChild (
+                    ChildID INT PRIMARY KEY,
+                    ParentID INT,
+                    CONSTRAINT fk_child_parent FOREIGN KEY (ParentID) REFERENCES PartitionParent (ParentID)
+                )
+            """
+        )
+        cursor.execute(
+            "CREATE TABLE PartitionLog (LogID INT, CreatedOn DATE NOT NULL, PRIMARY KEY (LogID, CreatedOn))"
+        )
+        assert dashboard.partitioning_blockers(connection, "PartitionParent") == [
+            "unique key PRIMARY does not include CreatedOn",
+            "foreign key fk_child_parent from PartitionChild to PartitionParent",
+        ]
+        assert dashboard.partitioning_blockers(connection, "PartitionLog") == []
+        dashboard.partition_by_month(connection, "PartitionLog", date(2024, 1, 1), 3)
+        cursor.execute(
+            "SELECT COUNT(*) FROM INFORMATION_SCHEMA.PARTITIONS WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'PartitionLog'"
+        )
+        assert cursor.fetchone()[0] == 4
+    finally:
+        cursor.execute(drop)
+        connection.close()
@@ -0,0 +1,63 @@
+from datetime import date, timedelta
+from types import SimpleNamespace
+
+import pytest
+
+import dashboard
+
+TODAY = date.today()
+
+
+@pytest.fixture
+def database(tmp_path, monkeypatch):
+    monkeypatch.setattr(dashboard, "SQLITE_PATH", str(tmp_path / "inventory.db"))
+    connection = dashboard.open_connection()
+    dashboard.setup_sqlite_schema(connection)
+    cursor = connection.cursor()
+    cursor.executemany("INSERT INTO Customer (CustomerID, CustomerName) VALUES (%s, %s)", [(1, "Ada"), (2, "Grace")])
+    cursor.execute("INSERT INTO Product (ProductID, ProductName, Price) VALUES (1, 'Widget', 2.5)")
+    cursor.executemany(
+        "INSERT INTO Sales (CustomerID, ProductID, SaleDate, SaleAmount) VALUES (%s, 1, %s, %s)",
+        [(1, TODAY - timedelta(days=3), 10), (2, TODAY - timedelta(days=30), 5)],
+    )
+    connection.commit()
+    yield connection
+    connection.close()
+
+
+@pytest.fixture
+def scheduler(monkeypatch):
+    submitted = []
+    dashboard.rfm_refresh_state.clear()
+    monkeypatch.setattr(
+        dashboard,
+        "job_scheduler",
+        lambda: SimpleNamespace(submit=lambda *args: submitted.append(args) or len(submitted)),
+    )
+    yield submitted
+    dashboard.rfm_refresh_state.clear()
+
+
+def test_segmentation_page_only_reads_segments(database, scheduler, monkeypatch):
+    def on_page_thread(*args, **kwargs):
+        raise AssertionError("segments rebuilt on the page thread")
+
+    for name in ("refresh_customer_segments", "rebuild_customer_segments", "age_customer_segments"):
+        monkeypatch.setattr(dashboard, name, on_page_thread)
+
+    dashboard.customer_segmentation(database)
+    dashboard.customer_segmentation(database)
+    assert scheduler == [("rfm_rebuild", {"refresh": True})]
+
+
+def test_refresh_job_builds_then_ages_segments(database):
+    job = SimpleNamespace(progress=lambda *args, **kwargs: None)
+
+    assert dashboard.rfm_rebuild_job(job, {"refresh": True}) == "Rescored 2 customers."
+    cursor = database.cursor()
+    cursor.execute("UPDATE CustomerSegment SET Recency = 0")
+    database.commit()
+
+    dashboard.rfm_rebuild_job(job, {"refresh": True})
+    cursor.execute("SELECT CustomerID, Recency FROM CustomerSegment ORDER BY CustomerID")
+    assert cursor.fetchall() == [(1, 3), (2, 30)]
@@ -0,0 +1,77 @@
+import pytest
+from mysql.connector import Error
+
+import dashboard
+
+ORDER_BY_ID = "SELECT OrderID, Status FROM `Order` WHERE OrderID = %s"
+
+
+@pytest.fixture
+def database(tmp_path, monkeypatch):
+    monkeypatch.setattr(dashboard, "SQLITE_PATH", str(tmp_path / "inventory.db"))
+    connection = dashboard.open_connection()
+    dashboard.setup_sqlite_schema(connection)
+    cursor = connection.cursor()
+    cursor.execute("INSERT INTO Supplier (SupplierID, SupplierName) VALUES (1, 'Supplier')")
+    cursor.executemany(
+        "INSERT INTO `Order` (OrderID, SupplierID, OrderDate, Status) VALUES (%s, 1, '2024-01-01', %s)",
+        [(1, "Pending"), (2, "Shipped")],
+    )
+    connection.commit()
+    dashboard.statement_registry.clear()
+    yield connection
+    dashboard.statement_registry.clear()
+    connection.close()
+
+
+class LostStatementCursor:
+    # A prepared cursor whose server-side statement is gone, as after a reconnect
+    column_names = ()
+
+    def execute(self, sql, params):
+        raise Error(msg="Unknown prepared statement handler", errno=dashboard.UNKNOWN_STATEMENT_ERRNO)
+
+
+def test_statement_is_prepared_once_per_connection_and_reused(database):
+    first = dashboard.run_statement(database, "order_by_id", ORDER_BY_ID, (1,))
+    cursor = database.prepared_statements["order_by_id"]
+    second = dashboard.run_statement(database, "order_by_id", ORDER_BY_ID, (2,))
+
+    assert first.to_dict("records") == [{"OrderID": 1, "Status": "Pending"}]
+    assert second.to_dict("records") == [{"OrderID": 2, "Status": "Shipped"}]
+    assert database.prepared_statements["order_by_id"] is cursor
+    stats = dashboard.statement_registry()["stats"]["order_by_id"]
+    assert (stats["Prepares"], stats["Executions"]) == (1, 1)
+
+
+def test_registry_hands_out_the_same_sql_object(database):
+    dashboard.run_statement(database, "order_by_id", ORDER_BY_ID, (1,))
+    copy = "".join(list(ORDER_BY_ID))
+    assert copy is not ORDER_BY_ID
+    dashboard.run_statement(database, "order_by_id", copy, (1,))
+    assert dashboard.statement_registry()["sql"]["order_by_id"] is ORDER_BY_ID
+
+
+def test_lost_statement_is_prepared_again(database):
+    dashboard.run_statement(database, "order_by_id", ORDER_BY_ID, (1,))
+    database.prepared_statements["order_by_id"] = LostStatementCursor()
+
+    result = dashboard.run_statement(database, "order_by_id", ORDER_BY_ID, (2,))
+    assert result["Status"].tolist() == ["Shipped"]
+    assert not isinstance(database.prepared_statements["order_by_id"], LostStatementCursor)
+    assert dashboard.statement_registry()["stats"]["order_by_id"]["Prepares"] == 2
+
+
+def test_other_errors_are_raised(database):
+    with pytest.raises(Error):
+        dashboard.run_statement(database, "broken", "SELECT NoSuchColumn FROM `Order`")
+    assert "broken" not in database.prepared_statements
+
+
+def test_statement_report_splits_prepare_from_execute_cost(database):
+    for order_id in (1, 2, 1):
+        dashboard.run_statement(database, "order_by_id", ORDER_BY_ID, (order_id,))
+    report = dashboard.statement_report().set_index("Statement")
+    assert report.loc["order_by_id", "Prepares"] == 1
+    assert report.loc["order_by_id", "Executions"] == 2
+    assert report.loc["order_by_id", "PrepareCostMs"] >= 0